@@ -4,29 +4,48 @@ import sys
 import datetime
 import time
 import os
+import queue
+import atexit
+import signal
 import logging
+import logging.handlers
 import yaml
 import pytz
 import numpy as np
 
 from forecastconsumption import forecastconsumption
+from forecastconsumption import onlinemodel
 from dynamictariff import dynamictariff as tariff_factory
 from inverter import inverter as inverter_factory
 from logfilelimiter import logfilelimiter
+from scheduler import scheduler
+from metrics import metrics
+from profiler import profiler
+from history import history
+from forecastseries import forecastseries
+from forecastseries.forecastseries import RESAMPLE_MEAN
 
 from forecastsolar import solar as solar_factory
-
+from forecastsolar import nowcast
+from startup import startup
 
 LOGFILE_ENABLED_DEFAULT = True
 LOGFILE = "logs/batcontrol.log"
 CONFIGFILE = "config/batcontrol_config.yaml"
-VALID_UTILITIES = ['tibber', 'awattar_at', 'awattar_de', 'evcc']
+VALID_UTILITIES = ['tibber', 'awattar_at', 'awattar_de', 'evcc', 'file']
 VALID_INVERTERS = ['fronius_gen24', 'testdriver']
 ERROR_IGNORE_TIME = 600 # 10 Minutes
+TIME_RESOLUTION_MINUTES_DEFAULT = 60 # Length of forecast and price slots
+VALID_TIME_RESOLUTIONS = [15, 30, 60]
 EVALUATIONS_EVERY_MINUTES = 3 # Every x minutes on the clock
 DELAY_EVALUATION_BY_SECONDS = 15 # Delay evaluation for x seconds at every trigger
 TIME_BETWEEN_EVALUATIONS = EVALUATIONS_EVERY_MINUTES * 60 # Interval between evaluations in seconds
-TIME_BETWEEN_UTILITY_API_CALLS = 900  # 15 Minutes
+TIME_BETWEEN_UTILITY_API_CALLS = 900  # 15 Minutes, while expected prices are missing
+# Number of evaluations to profile on SIGUSR1
+PROFILE_DEFAULT_CYCLES = 5
+# Debounce external events (MQTT, evcc) before an early evaluation is started
+EVENT_DEBOUNCE_SECONDS = 1
+EVENT_MAX_DELAY_SECONDS = 5
 # Minimum charge rate to controlling loops between charging and
 #   self discharge.
 # 500W is Fronius' internal value for forced recharge.
@@ -45,7 +64,14 @@ formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s",
 streamhandler = logging.StreamHandler(sys.stdout)
 streamhandler.setFormatter(formatter)
 
-logger.addHandler(streamhandler)
+# Log records are written to stdout and the logfile by a separate thread,
+#   so slow storage (SD card) does not block the control loop.
+log_queue = queue.SimpleQueue()
+loglistener = logging.handlers.QueueListener(log_queue, streamhandler)
+loglistener.start()
+atexit.register(loglistener.stop)
+
+logger.addHandler(logging.handlers.QueueHandler(log_queue))
 
 logger.setLevel(loglevel)
 
@@ -54,6 +80,10 @@ logger.info('[Main] Starting Batcontrol')
 
 class Batcontrol(object):
     def __init__(self, configfile):
+        # The inverter, MQTT, evcc and the first forecasts are initialized
+        #   concurrently, wait() below is the readiness barrier
+        self.startup = startup.ParallelStartup()
+
         # For API
         self.api_overwrite = False
         # -1 = charge from grid , 0 = avoid discharge , 10 = discharge allowed
@@ -81,14 +111,32 @@ class Batcontrol(object):
         self.fetched_stored_usable_energy = False
 
         self.last_run_time = 0
+        self.run_actuate_time = 0
+        self.run_publish_time = 0
+
+        self.scheduler = scheduler.EvaluationScheduler(
+            EVENT_DEBOUNCE_SECONDS,
+            EVENT_MAX_DELAY_SECONDS
+        )
 
         self.logfile = LOGFILE
         self.logfile_enabled = True
         self.logfilelimiter = None
 
-        self.load_config(configfile)
+        with self.startup.stage('config'):
+            self.load_config(configfile)
         config = self.config
 
+        self.time_resolution_minutes = config.get(
+            'time_resolution_minutes', TIME_RESOLUTION_MINUTES_DEFAULT)
+        self.slot_seconds = self.time_resolution_minutes * 60
+
+        # Profiling on request, results are written next to the logfile
+        self.profiler = profiler.RunProfiler(
+            os.path.dirname(self.logfile) or '.',
+            PROFILE_DEFAULT_CYCLES
+        )
+
         timezone = pytz.timezone(config['timezone'])
         self.timezone = timezone
 
@@ -103,20 +151,40 @@ class Batcontrol(object):
             os.environ['TZ'] = config['timezone']
         time.tzset()
 
-        self.dynamic_tariff = tariff_factory.DynamicTariff.create_tarif_provider(
-            config['utility'],
-            timezone,
-            TIME_BETWEEN_UTILITY_API_CALLS,
-            DELAY_EVALUATION_BY_SECONDS
-        )
-
-        self.inverter = inverter_factory.Inverter.create_inverter(config['inverter'])
+        # Login and configuration of the inverter, with retries
+        self.inverter = None
+        self.startup.submit(
+            'inverter', inverter_factory.Inverter.create_inverter, config['inverter'])
 
         self.pvsettings = config['pvinstallations']
-        self.fc_solar = solar_factory.ForecastSolar.create_solar_provider(self.pvsettings,
-                                                                          timezone,
-                                                                          DELAY_EVALUATION_BY_SECONDS
-                                                                         )
+        solar_config = config.get('solar_forecast', {})
+        with self.startup.stage('providers'):
+            self.dynamic_tariff = tariff_factory.DynamicTariff.create_tarif_provider(
+                config['utility'],
+                timezone,
+                TIME_BETWEEN_UTILITY_API_CALLS,
+                DELAY_EVALUATION_BY_SECONDS
+            )
+            self.fc_solar = solar_factory.ForecastSolar.create_solar_provider(
+                self.pvsettings,
+                timezone,
+                DELAY_EVALUATION_BY_SECONDS,
+                solar_config.get('provider', 'fcsolarapi'),
+                slot_seconds=self.slot_seconds,
+                provider_config=solar_config
+            )
+
+        # Fill the provider caches for the first evaluation, which retries on errors
+        self.startup.submit('prefetch_prices', self.dynamic_tariff.get_prices, required=False)
+        self.startup.submit('prefetch_solar', self.fc_solar.get_forecast, required=False)
+
+        # Correct the near-term solar forecast with the measured PV power
+        self.nowcast = None
+        if solar_config.get('nowcast', False):
+            self.nowcast = nowcast.NowcastCorrection(
+                solar_config.get('nowcast_smoothing_minutes', 60) * 60,
+                solar_config.get('nowcast_horizon_hours', 3) * 3600
+            )
 
         self.load_profile = config['consumption_forecast']['load_profile']
         try:
@@ -125,8 +193,24 @@ class Batcontrol(object):
             # default setting
             annual_consumption = 0
 
-        self.fc_consumption = forecastconsumption.ForecastConsumption(
-            self.load_profile, timezone, annual_consumption )
+        # Learn the consumption from the load measured by the inverter
+        self.consumption_model = None
+        consumption_config = config['consumption_forecast']
+        if consumption_config.get('online_learning', False):
+            self.consumption_model = onlinemodel.OnlineConsumptionModel(
+                consumption_config.get(
+                    'online_model_path',
+                    os.path.join(os.path.dirname(self.logfile) or '.', 'consumption_model.npz')
+                ),
+                timezone,
+                consumption_config.get('online_memory_weeks', 4),
+                consumption_config.get('online_min_weeks', 2)
+            )
+
+        with self.startup.stage('load_profile'):
+            self.fc_consumption = forecastconsumption.ForecastConsumption(
+                self.load_profile, timezone, annual_consumption,
+                online_model=self.consumption_model )
 
         self.batconfig = config['battery_control']
         self.time_at_forecast_error = -1
@@ -140,50 +224,120 @@ class Batcontrol(object):
 
             if config['mqtt']['enabled']:
                 logger.info('[Main] MQTT Connection enabled')
-                import mqtt_api
-                self.mqtt_api = mqtt_api.MqttApi(config['mqtt'])
-                self.mqtt_api.wait_ready()
-                # Register for callbacks
-                self.mqtt_api.register_set_callback(
-                    'mode',
-                    self.api_set_mode,
-                    int
-                )
-                self.mqtt_api.register_set_callback(
-                    'charge_rate',
-                    self.api_set_charge_rate,
-                    int
-                )
-                self.mqtt_api.register_set_callback(
-                    'always_allow_discharge_limit',
-                    self.api_set_always_allow_discharge_limit,
-                    float
-                )
-                self.mqtt_api.register_set_callback(
-                    'max_charging_from_grid_limit',
-                    self.api_set_max_charging_from_grid_limit,
-                    float
-                )
-                self.mqtt_api.register_set_callback(
-                    'min_price_difference',
-                    self.api_set_min_price_difference,
-                    float
-                )
-                # Inverter Callbacks
-                self.inverter.activate_mqtt(self.mqtt_api)
+                self.startup.submit('mqtt', self.__connect_mqtt, config['mqtt'])
+
+        self.metrics_exporter = None
+        if config.get('metrics', {}).get('enabled', False):
+            from metrics import exporter
+            self.metrics_exporter = exporter.MetricsExporter(config['metrics'])
+            self.metrics_exporter.start()
+
+        self.history = None
+        history_config = config.get('history', {})
+        if history_config.get('enabled', False):
+            self.history = history.HistoryStore(
+                history_config.get(
+                    'path',
+                    os.path.join(os.path.dirname(self.logfile) or '.', 'history.sqlite')
+                ),
+                history_config.get('raw_retention_days', 7),
+                history_config.get('downsampled_retention_days', 365)
+            )
 
         self.evcc_api = None
+        self.evcc_consumption_overlay = False
         if 'evcc' in config.keys():
             if config['evcc']['enabled'] == True:
                 logger.info('[Main] evcc Connection enabled')
-                import evcc_api
-                self.evcc_api = evcc_api.EvccApi(config['evcc'])
-                self.evcc_api.register_block_function(self.set_discharge_blocked)
-                self.evcc_api.wait_ready()
-                logger.info('[Main] evcc Connection ready')
+                self.evcc_consumption_overlay = config['evcc'].get('consumption_overlay', False)
+                # A shared connection is connected by MqttApi first, so its will is set
+                after = 'mqtt' if self.__shares_mqtt_connection(config) else None
+                self.startup.submit('evcc', self.__connect_evcc, config['evcc'], after=after)
+
+        # Readiness barrier before the first control action
+        results = self.startup.wait()
+        self.inverter = results['inverter']
+        if 'mqtt' in results:
+            self.mqtt_api = results['mqtt']
+            # Inverter Callbacks
+            self.inverter.activate_mqtt(self.mqtt_api)
+        if 'evcc' in results:
+            self.evcc_api = results['evcc']
+        self.startup.set_ready()
+
+    def __connect_mqtt(self, config):
+        """ Connect the MQTT API and register the set callbacks, runs in a startup thread """
+        import mqtt_api
+        api = mqtt_api.MqttApi(config)
+        api.wait_ready()
+        # Register for callbacks
+        api.register_set_callback(
+            'mode',
+            self.api_set_mode,
+            int
+        )
+        api.register_set_callback(
+            'charge_rate',
+            self.api_set_charge_rate,
+            int
+        )
+        api.register_set_callback(
+            'always_allow_discharge_limit',
+            self.api_set_always_allow_discharge_limit,
+            float
+        )
+        api.register_set_callback(
+            'max_charging_from_grid_limit',
+            self.api_set_max_charging_from_grid_limit,
+            float
+        )
+        api.register_set_callback(
+            'min_price_difference',
+            self.api_set_min_price_difference,
+            float
+        )
+        api.register_set_callback(
+            'profile',
+            self.profiler.request_cpu,
+            int
+        )
+        api.register_set_callback(
+            'profile_memory',
+            self.profiler.request_memory,
+            int
+        )
+        return api
+
+    def __connect_evcc(self, config):
+        """ Connect the evcc API, runs in a startup thread """
+        import evcc_api
+        # the online consumption model subtracts the charge power from the load
+        api = evcc_api.EvccApi(config, track_charge_power=self.consumption_model is not None)
+        if config.get('block_while_charging', True):
+            api.register_block_function(self.set_discharge_blocked)
+        else:
+            api.register_block_function(lambda blocked: None)
+        api.wait_ready()
+        logger.info('[Main] evcc Connection ready')
+        return api
+
+    @staticmethod
+    def __shares_mqtt_connection(config) -> bool:
+        """ True if MqttApi and EvccApi use the same broker and credentials """
+        if not config.get('mqtt', {}).get('enabled', False):
+            return False
+        import mqtt_connection
+        return mqtt_connection.MqttConnection.get_key(config['mqtt']) == \
+            mqtt_connection.MqttConnection.get_key(config['evcc'])
 
     def shutdown(self):
         logger.info('[Main] Shutting down Batcontrol')
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.shutdown()
+        if self.history is not None:
+            self.history.shutdown()
+        if self.consumption_model is not None:
+            self.consumption_model.shutdown()
         try:
             self.inverter.shutdown()
             del self.inverter
@@ -224,6 +378,13 @@ class Batcontrol(object):
         else:
             config['utility']['apikey'] = None
 
+        if config.get('time_resolution_minutes',
+                      TIME_RESOLUTION_MINUTES_DEFAULT) not in VALID_TIME_RESOLUTIONS:
+            raise RuntimeError(
+                '[Config] time_resolution_minutes must be one of '
+                f'{VALID_TIME_RESOLUTIONS}'
+            )
+
         if config['inverter']['type'] in VALID_INVERTERS:
             pass
         else:
@@ -316,7 +477,10 @@ class Batcontrol(object):
 
         if config['max_logfile_size'] > 0:
             self.logfilelimiter = logfilelimiter.LogFileLimiter(
-                self.logfile, config['max_logfile_size'])
+                self.logfile,
+                config['max_logfile_size'],
+                config.get('logfile_compressed_segments', 0)
+            )
 
         # is the path valid and writable?
         if not os.path.isdir(os.path.dirname(self.logfile)):
@@ -328,22 +492,26 @@ class Batcontrol(object):
                 f"Logfile path {os.path.dirname(self.logfile)} not writable"
             )
 
-        filehandler = logging.FileHandler(self.logfile)
+        if self.logfilelimiter is not None:
+            # Reports written bytes to the limiter
+            filehandler = logfilelimiter.LimitedFileHandler(self.logfilelimiter)
+        else:
+            filehandler = logging.FileHandler(self.logfile)
         filehandler.setFormatter(formatter)
-        logger.addHandler(filehandler)
+        loglistener.handlers = loglistener.handlers + (filehandler,)
 
     def reset_forecast_error(self):
         self.time_at_forecast_error = -1
 
     def handle_forecast_error(self):
-        now = time.time()
+        current_time = time.time()
 
         # set time_at_forecast_error if it is at the default value of -1
         if self.time_at_forecast_error == -1:
-            self.time_at_forecast_error = now
+            self.time_at_forecast_error = current_time
 
         # get time delta since error
-        time_passed = now-self.time_at_forecast_error
+        time_passed = current_time-self.time_at_forecast_error
 
         if time_passed < ERROR_IGNORE_TIME:
             # keep current mode
@@ -357,30 +525,56 @@ class Batcontrol(object):
                 time_passed)
             self.allow_discharging()
 
-    def run(self):
-        """ Main calculation & control loop """
+    def run(self, is_periodic:bool=True):
+        """ Main calculation & control loop
+            is_periodic: False for evaluations started early by external events
+        """
+        with self.profiler.cycle():
+            with metrics.EVALUATION_DURATION.time(stage='total'):
+                try:
+                    self.__run(is_periodic)
+                finally:
+                    # both publish sections of __run as one observation
+                    metrics.EVALUATION_DURATION.observe(
+                        self.run_publish_time, stage='publish')
+
+    def __run(self, is_periodic:bool):
         # Reset some values
         self.__reset_run_data()
         # for API
+        publish_start = time.perf_counter()
         self.refresh_static_values()
         self.set_discharge_limit(
             self.get_max_capacity() * self.always_allow_discharge_limit
             )
+        self.run_publish_time += time.perf_counter() - publish_start
         self.last_run_time = time.time()
 
         # prune log file if file is too large
         if self.logfilelimiter is not None and self.logfile_enabled:
             self.logfilelimiter.run()
 
+        if self.consumption_model is not None:
+            self.__learn_consumption()
+
+        pv_power = self.__get_pv_power()
+        if pv_power is not None:
+            self.fc_solar.record_pv_power(self.last_run_time, pv_power)
+
         # get forecasts
+        fetch_start = time.perf_counter()
         try:
-            price_dict = self.dynamic_tariff.get_prices()
+            # tariffs provide their own resolution, e.g. hourly or 15 minutes
+            price_forecast = self.dynamic_tariff.get_prices().resample(
+                self.slot_seconds, RESAMPLE_MEAN)
             production_forecast = self.fc_solar.get_forecast()
-            # harmonize forecast horizon
-            fc_period = min(max(price_dict.keys()),
-                            max(production_forecast.keys()))
+            # harmonize forecast horizon, both start with the current slot
+            price_forecast, production_forecast = forecastseries.intersect(
+                price_forecast.align(self.last_run_time),
+                production_forecast.align(self.last_run_time)
+            )
             consumption_forecast = self.fc_consumption.get_forecast(
-                fc_period+1)
+                len(price_forecast), price_forecast.start, self.slot_seconds)
         except Exception as e:
             logger.warning(
                 '[BatCtrl] Following Exception occurred when trying to get forecasts: %s', e,
@@ -388,52 +582,106 @@ class Batcontrol(object):
                 )
             self.handle_forecast_error()
             return
+        finally:
+            metrics.EVALUATION_DURATION.observe(
+                time.perf_counter() - fetch_start, stage='fetch')
 
         self.reset_forecast_error()
 
-        # initialize arrays
-        net_consumption = np.zeros(fc_period+1)
-        production = np.zeros(fc_period+1)
-        consumption = np.zeros(fc_period+1)
-        prices = np.zeros(fc_period+1)
+        if self.nowcast is not None and pv_power is not None:
+            production_forecast = self.__apply_nowcast(production_forecast, pv_power)
 
-        for h in range(fc_period+1):
-            production[h] = production_forecast[h]
-            consumption[h] = consumption_forecast[h]
-            prices[h] = price_dict[h]
+        production = production_forecast.values
+        consumption = consumption_forecast.values
+        prices = price_forecast.values
+
+        # add expected charging of electric vehicles
+        overlay = None
+        if self.evcc_api is not None and self.evcc_consumption_overlay:
+            overlay = self.evcc_api.get_consumption_overlay(
+                consumption_forecast.start, len(consumption), self.slot_seconds,
+                self.last_run_time)
+            consumption = consumption + overlay
 
         net_consumption = consumption-production
-        logger.debug('[BatCTRL] Production FCST: %s',
-                     np.ndarray.round(production, 1))
-        logger.debug('[BatCTRL] Consumption FCST: %s',
-                     np.ndarray.round(consumption, 1))
-        logger.debug('[BatCTRL] Net Consumption FCST: %s',
-                     np.ndarray.round(net_consumption, 1))
-        logger.debug('[BatCTRL] Prices: %s', np.ndarray.round(prices, 3))
+        # Rounding and formatting the arrays is expensive, skip if not logged
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('[BatCTRL] Production FCST: %s',
+                         np.ndarray.round(production, 1))
+            logger.debug('[BatCTRL] Consumption FCST: %s',
+                         np.ndarray.round(consumption, 1))
+            logger.debug('[BatCTRL] Net Consumption FCST: %s',
+                         np.ndarray.round(net_consumption, 1))
+            logger.debug('[BatCTRL] Prices: %s', np.ndarray.round(prices, 3))
         # negative = charging or feed in
         # positive = dis-charging or grid consumption
 
         # Store data for API
+        publish_start = time.perf_counter()
         self.__save_run_data(production, consumption, net_consumption, prices)
+        self.run_publish_time += time.perf_counter() - publish_start
 
         # stop here if api_overwrite is set and reset it
+        #   Early evaluations, e.g. triggered by the API call itself, keep it
+        #   until the next periodic evaluation.
         if self.api_overwrite:
             logger.info(
                 '[BatCTRL] API Overwrite active. Skipping control logic. '
                 'Next evaluation in %.0f seconds',
                 TIME_BETWEEN_EVALUATIONS
             )
-            self.api_overwrite = False
+            if is_periodic:
+                self.api_overwrite = False
+            self.__record_history()
             return
 
-        # correction for time that has already passed since the start of the current hour
-        net_consumption[0] *= 1 - \
-            datetime.datetime.now().astimezone(self.timezone).minute/60
+        # correction for time that has already passed since the start of the current slot
+        remaining_share = 1 - (
+            datetime.datetime.fromtimestamp(self.last_run_time, self.timezone).minute
+            % self.time_resolution_minutes) / self.time_resolution_minutes
+        net_consumption[0] *= remaining_share
+        if overlay is not None:
+            # the overlay starts at last_run_time, restore its full first slot
+            net_consumption[0] += overlay[0] * (1 - remaining_share)
+
+        decide_start = time.perf_counter()
+        self.set_wr_parameters(net_consumption, prices)
+        # actuate is recorded separately in __write_inverter_mode
+        metrics.EVALUATION_DURATION.observe(
+            time.perf_counter() - decide_start - self.run_actuate_time, stage='decide')
 
-        self.set_wr_parameters(net_consumption, price_dict)
+        self.__record_history()
 
         # %%
-    def set_wr_parameters(self, net_consumption: np.ndarray, prices: dict):
+    def __get_pv_power(self):
+        """ Measured PV power in W, None if not available """
+        try:
+            return self.inverter.get_pv_power()
+        except RuntimeError as e:
+            logger.warning('[BatCTRL] Could not read PV power: %s', e)
+            return None
+
+    def __apply_nowcast(self, production_forecast, pv_power):
+        """ Update the nowcast ratio with the measured PV power and correct the forecast """
+        self.nowcast.update(self.last_run_time, pv_power, production_forecast)
+        metrics.NOWCAST_RATIO.set(self.nowcast.ratio)
+        return self.nowcast.apply(self.last_run_time, production_forecast)
+
+    def __learn_consumption(self):
+        """ Update the online consumption model with the measured house load """
+        try:
+            load_power = self.inverter.get_load_power()
+            if load_power is None:
+                return
+            # electric vehicles are forecast separately by evcc
+            if self.evcc_api is not None:
+                load_power = max(load_power - self.evcc_api.get_charge_power(), 0)
+        except RuntimeError as e:
+            logger.warning('[BatCTRL] Could not read load power for consumption model: %s', e)
+            return
+        self.consumption_model.update(self.last_run_time, load_power)
+
+    def set_wr_parameters(self, net_consumption: np.ndarray, prices: np.ndarray):
         # ensure availability of data
         max_hour = min(len(net_consumption), len(prices))
 
@@ -468,8 +716,11 @@ class Batcontrol(object):
 
             # charge if battery capacity available and more stored energy is required
             if is_charging_possible and required_recharge_energy > 0:
-                remaining_time = (
-                    60-datetime.datetime.now().astimezone(self.timezone).minute)/60
+                # charge within the remaining time of the current slot
+                minute = datetime.datetime.fromtimestamp(
+                    self.last_run_time, self.timezone).minute
+                remaining_time = (self.time_resolution_minutes -
+                                  minute % self.time_resolution_minutes)/60
                 charge_rate = required_recharge_energy/remaining_time
 
                 if charge_rate < MIN_CHARGE_RATE:
@@ -485,49 +736,45 @@ class Batcontrol(object):
                 self.avoid_discharging()
 
     # %%
-    def get_required_required_recharge_energy(self, net_consumption: list, prices: dict):
+    @staticmethod
+    def get_uncovered_energy(demand: np.ndarray, supply: np.ndarray) -> float:
+        """ Energy of demand which can not be covered by the supply of earlier slots.
+
+            Equal to shifting the supply greedily to the demand slot by slot,
+            but computed as the maximum backlog of a queue (Lindley recursion):
+            demand[0] + max(0, max(cumsum(demand[1:] - supply[:-1])))
+        """
+        if len(demand) == 0:
+            return 0
+        uncovered = demand[0]
+        if len(demand) > 1:
+            uncovered += max(0, np.max(np.cumsum(demand[1:] - supply[:-1])))
+        return uncovered
+
+    def get_required_required_recharge_energy(self, net_consumption: np.ndarray,
+                                              prices: np.ndarray):
         current_price = prices[0]
+        net_consumption = np.asarray(net_consumption)
         max_hour = len(net_consumption)
-        consumption = np.array(net_consumption)
-        consumption[consumption < 0] = 0
-
-        production = -np.array(net_consumption)
-        production[production < 0] = 0
+        consumption = np.maximum(net_consumption, 0)
+        production = np.maximum(-net_consumption, 0)
         min_price_difference = self.min_price_difference
 
         # evaluation period until price is first time lower then current price
-        for h in range(1, max_hour):
-            future_price = prices[h]
-            if future_price <= current_price:
-                max_hour = h
-                break
-
-        # get high price hours
-        high_price_hours = []
-        for h in range(max_hour):
-            future_price = prices[h]
-            if future_price > current_price+min_price_difference:
-                high_price_hours.append(h)
-
-        # start with nearest hour
-        high_price_hours.sort()
-        required_energy = 0
-        for high_price_hour in high_price_hours:
-            energy_to_shift = consumption[high_price_hour]
-
-            # correct energy to shift with potential production
-            # start with nearest hour
-            for hour in range(1,high_price_hour):
-                if production[hour] == 0:
-                    continue
-                if production[hour] >= energy_to_shift:
-                    production[hour] -= energy_to_shift
-                    energy_to_shift = 0
-                else:
-                    energy_to_shift -= production[hour]
-                    production[hour] = 0
-            # add_remaining energy to shift to recharge amount
-            required_energy += energy_to_shift
+        lower_prices = prices[1:max_hour] <= current_price
+        if lower_prices.any():
+            max_hour = int(np.argmax(lower_prices)) + 1
+
+        # get high price slots
+        high_price = prices[:max_hour] > current_price+min_price_difference
+        demand = np.where(high_price, consumption[:max_hour], 0)
+
+        # correct energy to shift with potential production of earlier slots,
+        #   production of the current slot is not considered
+        supply = production[:max_hour].copy()
+        supply[0] = 0
+        required_energy = self.get_uncovered_energy(demand, supply)
+        high_price_hours = np.flatnonzero(high_price).tolist()
 
         if required_energy > 0:
             logger.debug("[Rule] Required Energy: %0.1f Wh is based on next 'high price' hours %s",
@@ -571,7 +818,7 @@ class Batcontrol(object):
             return True
         return False
 # %%
-    def is_discharge_allowed(self, net_consumption: np.ndarray, prices: dict) -> bool:
+    def is_discharge_allowed(self, net_consumption: np.ndarray, prices: np.ndarray) -> bool:
         """ Evaluate if the battery is allowed to discharge
 
             - Check if battery is above always_allow_discharge_limit
@@ -591,71 +838,46 @@ class Batcontrol(object):
         min_price_difference = self.min_price_difference
         max_hour = len(net_consumption)
         # relevant time range : until next recharge possibility
-        for h in range(1, max_hour):
-            future_price = prices[h]
-            if future_price <= current_price-min_price_difference:
-                max_hour = h
-                logger.debug("[Rule] Recharge possible in %d hours, limiting evaluation window.", h)
-                logger.debug("[Rule] Future price: %.3f < Current price: %.3f - min_price_diff. %.3f ",
-                             future_price,
-                             current_price,
-                             self.min_price_difference
-                        )
-                break
-        dt = datetime.timedelta(hours=max_hour-1)
-        t0 = datetime.datetime.now()
-        t1 = t0+dt
-        last_hour = t1.astimezone(self.timezone).strftime("%H:59")
-
-        logger.debug(
-              '[Rule] Evaluating next %d hours until %s',
-              max_hour,
-              last_hour
-            )
+        recharge_prices = prices[1:max_hour] <= current_price-min_price_difference
+        if recharge_prices.any():
+            max_hour = int(np.argmax(recharge_prices)) + 1
+            logger.debug("[Rule] Recharge possible in %d slots, limiting evaluation window.",
+                         max_hour)
+            logger.debug("[Rule] Future price: %.3f < Current price: %.3f - min_price_diff. %.3f ",
+                         prices[max_hour],
+                         current_price,
+                         self.min_price_difference
+                    )
+        if logger.isEnabledFor(logging.DEBUG):
+            slot_start = self.last_run_time - self.last_run_time % self.slot_seconds
+            t1 = datetime.datetime.fromtimestamp(
+                slot_start + max_hour * self.slot_seconds - 60, self.timezone)
+            last_hour = t1.strftime("%H:%M")
+
+            logger.debug(
+                  '[Rule] Evaluating next %d slots until %s',
+                  max_hour,
+                  last_hour
+                )
         # distribute remaining energy
-        consumption = np.array(net_consumption)
-        consumption[consumption < 0] = 0
-
-        production = -np.array(net_consumption)
-        production[production < 0] = 0
-
-        # get hours with higher price
-        higher_price_hours = []
-        for h in range(max_hour):
-            future_price = prices[h]
-            # !!! different formula compared to detect relevant hours
-            if future_price > current_price:
-                higher_price_hours.append(h)
-
-        higher_price_hours.sort()
-        higher_price_hours.reverse()
-
-        reserved_storage = 0
-        for higher_price_hour in higher_price_hours:
-            if consumption[higher_price_hour] == 0:
-                continue
-            required_energy = consumption[higher_price_hour]
-
-            # correct reserved_storage with potential production
-            # start with latest hour
-            for hour in list(range(higher_price_hour))[::-1]:
-                if production[hour] == 0:
-                    continue
-                if production[hour] >= required_energy:
-                    production[hour] -= required_energy
-                    required_energy = 0
-                    break
-                else:
-                    required_energy -= production[hour]
-                    production[hour] = 0
-            # add_remaining required_energy to reserved_storage
-            reserved_storage += required_energy
+        net_consumption = np.asarray(net_consumption[:max_hour])
+        consumption = np.maximum(net_consumption, 0)
+        production = np.maximum(-net_consumption, 0)
+
+        # get slots with higher price
+        # !!! different formula compared to detect relevant slots
+        higher_price = prices[:max_hour] > current_price
+        demand = np.where(higher_price, consumption, 0)
+
+        # correct reserved_storage with potential production of earlier slots
+        reserved_storage = self.get_uncovered_energy(demand, production)
+        higher_price_hours = np.flatnonzero(higher_price).tolist()
 
         if len(higher_price_hours) > 0:
             # This message is somehow confusing, because we are working with an
             # hour offset "the next 2 hours", but people may read "2 o'clock".
             logger.debug("[Rule] Reserved Energy will be used in the next hours: %s",
-                         higher_price_hours[::-1])
+                         higher_price_hours)
             logger.debug(
                 "[Rule] Reserved Energy: %0.1f Wh. Usable in Battery: %0.1f Wh",
                 reserved_storage,
@@ -670,7 +892,7 @@ class Batcontrol(object):
 
         if self.discharge_blocked:
             logger.debug(
-                f'[BatCTRL] Discharge blocked due to external lock')
+                '[BatCTRL] Discharge blocked due to external lock')
             return False
 
         if (stored_usable_energy > reserved_storage):
@@ -704,21 +926,33 @@ class Batcontrol(object):
         if self.last_charge_rate > 0 and mode != MODE_FORCE_CHARGING:
             self.__set_charge_rate(0)
 
+    def __write_inverter_mode(self, mode:str, function:callable, *args):
+        """ Call the inverter and record duration and count """
+        start = time.perf_counter()
+        try:
+            function(*args)
+        finally:
+            duration = time.perf_counter() - start
+            self.run_actuate_time += duration
+            metrics.EVALUATION_DURATION.observe(duration, stage='actuate')
+            metrics.INVERTER_WRITES.inc(mode=mode)
+
     def allow_discharging(self):
         logger.info('[BatCTRL] Mode: Allow Discharging')
-        self.inverter.set_mode_allow_discharge()
+        self.__write_inverter_mode('allow_discharge', self.inverter.set_mode_allow_discharge)
         self.__set_mode(MODE_ALLOW_DISCHARGING)
 
     def avoid_discharging(self):
         logger.info('[BatCTRL] Mode: Avoid Discharging')
-        self.inverter.set_mode_avoid_discharge()
+        self.__write_inverter_mode('avoid_discharge', self.inverter.set_mode_avoid_discharge)
         self.__set_mode(MODE_AVOID_DISCHARGING)
 
     def force_charge(self, charge_rate=500):
         charge_rate = int(min(charge_rate, self.inverter.max_grid_charge_rate))
         logger.info(
             '[BatCTRL] Mode: grid charging. Charge rate : %d W', charge_rate)
-        self.inverter.set_mode_force_charge(charge_rate)
+        self.__write_inverter_mode(
+            'force_charge', self.inverter.set_mode_force_charge, charge_rate)
         self.__set_mode(MODE_FORCE_CHARGING)
         self.__set_charge_rate(charge_rate)
 
@@ -728,14 +962,43 @@ class Batcontrol(object):
         self.last_net_consumption = net_consumption
         self.last_prices = prices
         if self.mqtt_api is not None:
-            self.mqtt_api.publish_production(production, self.last_run_time)
-            self.mqtt_api.publish_consumption(consumption, self.last_run_time)
+            self.mqtt_api.publish_production(
+                production, self.last_run_time, self.slot_seconds)
+            self.mqtt_api.publish_consumption(
+                consumption, self.last_run_time, self.slot_seconds)
             self.mqtt_api.publish_net_consumption(
-                net_consumption, self.last_run_time)
-            self.mqtt_api.publish_prices(prices, self.last_run_time)
+                net_consumption, self.last_run_time, self.slot_seconds)
+            self.mqtt_api.publish_prices(prices, self.last_run_time, self.slot_seconds)
+
+    def __record_history(self):
+        """ Queue inputs and results of this evaluation for the history store """
+        if self.history is None:
+            return
+        values = {
+            'soc': self.get_SOC(),
+            'stored_energy': self.get_stored_energy(),
+            'stored_usable_energy': self.get_stored_usable_energy(),
+            'reserved_energy': self.get_reserved_energy(),
+            'mode': self.last_mode,
+            'charge_rate': self.last_charge_rate,
+            'discharge_blocked': int(self.discharge_blocked),
+            'price': self.last_prices[0],
+            'production': self.last_production[0],
+            'consumption': self.last_consumption[0],
+            'net_consumption': self.last_net_consumption[0],
+        }
+        forecasts = {
+            'fc_prices': self.last_prices,
+            'fc_production': self.last_production,
+            'fc_consumption': self.last_consumption,
+            'fc_net_consumption': self.last_net_consumption,
+        }
+        self.history.record(self.last_run_time, values, forecasts)
 
     def __reset_run_data(self):
         """ Reset value Cache """
+        self.run_actuate_time = 0
+        self.run_publish_time = 0
         self.fetched_soc = False
         self.fetched_max_capacity = False
         self.fetched_stored_energy = False
@@ -811,6 +1074,9 @@ class Batcontrol(object):
             If block is removed, the next calculation cycle will
             decide what to do.
         """
+        # evcc may report a charging car before the inverter is ready
+        if self.startup.defer_until_ready(self.set_discharge_blocked, discharge_blocked):
+            return
         if discharge_blocked == self.discharge_blocked:
             return
         logger.info('[BatCTRL] Discharge block: %s', {discharge_blocked})
@@ -818,9 +1084,12 @@ class Batcontrol(object):
             self.mqtt_api.publish_discharge_blocked(discharge_blocked)
         self.discharge_blocked = discharge_blocked
 
-        if not self.__is_above_always_allow_discharge_limit():
+        if discharge_blocked and not self.__is_above_always_allow_discharge_limit():
             self.avoid_discharging()
 
+        # Let the control logic decide immediately, especially after a release
+        self.scheduler.request_evaluation('discharge_blocked')
+
     def refresh_static_values(self):
         if self.mqtt_api is not None:
             self.mqtt_api.publish_SOC(self.get_SOC())
@@ -848,6 +1117,9 @@ class Batcontrol(object):
         if mode not in [MODE_FORCE_CHARGING, MODE_AVOID_DISCHARGING, MODE_ALLOW_DISCHARGING]:
             logger.warning('[BatCtrl] API: Invalid mode %s', mode)
             return
+        # called by MQTT, possibly before the inverter is ready
+        if self.startup.defer_until_ready(self.api_set_mode, mode):
+            return
 
         logger.info('[BatCtrl] API: Setting mode to %s', mode)
         self.api_overwrite = True
@@ -859,15 +1131,20 @@ class Batcontrol(object):
                 self.avoid_discharging()
             elif mode == MODE_ALLOW_DISCHARGING:
                 self.allow_discharging()
+        # publish the new state, the control logic is skipped until the next periodic run
+        self.scheduler.request_evaluation('mode')
 
     def api_set_charge_rate(self, charge_rate: int):
         if charge_rate < 0:
             logger.warning('[BatCtrl] API: Invalid charge rate %d W', charge_rate)
             return
+        if self.startup.defer_until_ready(self.api_set_charge_rate, charge_rate):
+            return
         logger.info('[BatCtrl] API: Setting charge rate to %d W',  charge_rate)
         self.api_overwrite = True
         if charge_rate != self.last_charge_rate:
             self.force_charge(charge_rate)
+        self.scheduler.request_evaluation('charge_rate')
 
     def api_set_always_allow_discharge_limit(self, limit: float):
         if limit < 0 or limit > 1:
@@ -877,6 +1154,7 @@ class Batcontrol(object):
         logger.info(
             '[BatCtrl] API: Setting always allow discharge limit to %.2f' , limit )
         self.always_allow_discharge_limit = limit
+        self.scheduler.request_evaluation('always_allow_discharge_limit')
 
     def api_set_max_charging_from_grid_limit(self, limit: float):
         if limit < 0 or limit > 1:
@@ -886,6 +1164,7 @@ class Batcontrol(object):
         logger.info(
                '[BatCtrl] API: Setting max charging from grid limit to %.2f' ,limit )
         self.max_charging_from_grid_limit = limit
+        self.scheduler.request_evaluation('max_charging_from_grid_limit')
 
     def api_set_min_price_difference(self, min_price_difference: float):
         if min_price_difference < 0:
@@ -895,12 +1174,19 @@ class Batcontrol(object):
         logger.info(
               '[BatCtrl] API: Setting min price difference to %.3f', min_price_difference)
         self.min_price_difference = min_price_difference
+        self.scheduler.request_evaluation('min_price_difference')
 
 if __name__ == '__main__':
+    # Interpreter start and module imports, before the stages of the startup report
+    startup.report_process_start('imports')
     bc = Batcontrol(CONFIGFILE)
+    # kill -USR1 <pid> profiles the next evaluations
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: bc.profiler.request())
     try:
+        periodic = True
         while (1):
-            bc.run()
+            bc.run(periodic)
             now = datetime.datetime.now().astimezone(bc.timezone)
             # reset base to full minutes on the clock
             next_eval = now - datetime.timedelta(minutes=now.minute % EVALUATIONS_EVERY_MINUTES,
@@ -913,7 +1199,15 @@ if __name__ == '__main__':
             sleeptime = (next_eval - now).total_seconds()
             logger.info("[Main] Next evaluation at %s. Sleeping for %.0f seconds",
                          next_eval.strftime("%H:%M:%S"), sleeptime)
-            time.sleep(sleeptime)
+            # Sleeps until next_eval, but wakes up early on external events
+            reasons = bc.scheduler.wait_until(next_eval.timestamp())
+            periodic = scheduler.REASON_PERIODIC in reasons
+            if not periodic:
+                logger.info("[Main] Early evaluation triggered by: %s", ', '.join(reasons))
+            else:
+                drift = time.time() - next_eval.timestamp()
+                metrics.LOOP_DRIFT.set(drift)
+                metrics.LOOP_DRIFT_HISTOGRAM.observe(drift)
     finally:
         bc.shutdown()
         del bc
@@ -0,0 +1,179 @@
+""" Shared helpers of the benchmarks: timing statistics, configs and JSON output """
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+import tempfile
+import numpy as np
+import yaml
+import batcontrol
+from forecastseries.forecastseries import ForecastSeries
+from dynamictariff.dynamictariff_interface import TariffInterface
+from forecastsolar.forecastsolar_interface import ForecastSolarInterface
+from mockservers.mockservers import market_price
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DUMMY_CONFIG = os.path.join(REPO_DIR, 'config', 'batcontrol_config_dummy.yaml')
+
+
+def summarize(samples:list) -> dict:
+    """ Statistics of durations in seconds, reported in milliseconds """
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    if len(values) == 0:
+        return {'runs': 0}
+    return {
+        'runs': len(values),
+        'min_ms': float(values.min()),
+        'median_ms': float(np.median(values)),
+        'p95_ms': float(np.percentile(values, 95)),
+        'mean_ms': float(values.mean()),
+    }
+
+
+def measure(function, runs:int, warmup:int=1, min_sample:float=0.002) -> dict:
+    """ Duration of one call of function, from runs samples after warmup calls.
+
+        Fast functions are called repeatedly per sample, so a sample takes
+        at least min_sample seconds and the timer resolution does not matter.
+    """
+    for _ in range(warmup):
+        function()
+    start = time.perf_counter()
+    function()
+    number = max(1, int(min_sample / max(time.perf_counter() - start, 1e-9)))
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        samples.append((time.perf_counter() - start) / number)
+    result = summarize(samples)
+    result['calls_per_run'] = number
+    return result
+
+
+def synthetic_prices(start:float, slots:int, step:int=3600) -> np.ndarray:
+    """ End prices in EUR/kWh with the daily shape of the stand-in servers """
+    times = start + np.arange(slots) * step
+    return np.array([market_price(t) for t in times]) / 1000 * 1.19 + 0.15
+
+
+def synthetic_production(start:float, slots:int, step:int=3600,
+                         peak_power:float=8000) -> np.ndarray:
+    """ Production in Wh per slot, a sine between 6:00 and 20:00 UTC """
+    hours = ((start + (np.arange(slots) + 0.5) * step) % 86400) / 3600
+    power = np.where((hours > 6) & (hours < 20),
+                     peak_power * np.sin((hours - 6) / 14 * np.pi), 0)
+    return power * step / 3600
+
+
+class StaticTariff(TariffInterface):
+    """ Stub tariff with synthetic prices for slots from the current slot """
+    def __init__(self, slots:int, step:int=3600):
+        self.slots = slots
+        self.step = step
+
+    def get_prices(self) -> ForecastSeries:
+        now = time.time()
+        start = now - now % self.step
+        return ForecastSeries(start, self.step, synthetic_prices(start, self.slots, self.step))
+
+
+class StaticSolar(ForecastSolarInterface):
+    """ Stub solar forecast with synthetic production for slots from the current slot """
+    def __init__(self, slots:int, step:int=3600):
+        self.slots = slots
+        self.step = step
+
+    def get_forecast(self) -> ForecastSeries:
+        now = time.time()
+        start = now - now % self.step
+        return ForecastSeries(
+            start, self.step, synthetic_production(start, self.slots, self.step))
+
+
+def write_config(overrides:dict, directory:str=None) -> str:
+    """ Dummy config with the testdriver inverter, without MQTT, evcc,
+        logfile, history and metrics, updated with overrides. Returns the path.
+        Batcontrol resolves the load profile relative to REPO_DIR.
+    """
+    with open(DUMMY_CONFIG, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    config['inverter'] = {'type': 'testdriver', 'max_grid_charge_rate': 5000}
+    config['mqtt']['enabled'] = False
+    config['evcc']['enabled'] = False
+    config['history'] = {'enabled': False}
+    config['logfile_enabled'] = False
+    config['loglevel'] = 'warning'
+    config['metrics'] = {'enabled': False}
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix='batcontrol_bench_')
+    path = os.path.join(directory, 'batcontrol_config.yaml')
+    with open(path, 'w', encoding='utf-8') as f:
+        yaml.safe_dump(config, f)
+    return path
+
+
+def create_batcontrol(slots:int, step:int=3600, overrides:dict=None,
+                      directory:str=None):
+    """ Batcontrol from write_config with StaticTariff and StaticSolar of slots.
+
+        Batcontrol is created with the file providers of the same synthetic
+        data, so the startup does not access the network.
+    """
+    os.chdir(REPO_DIR)
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix='batcontrol_bench_')
+    tariff = StaticTariff(slots, step)
+    solar = StaticSolar(slots, step)
+    prices_file = os.path.join(directory, 'prices.npz')
+    production_file = os.path.join(directory, 'production.npz')
+    tariff.get_prices().to_npz(prices_file)
+    solar.get_forecast().to_npz(production_file)
+
+    overrides = dict(overrides or {})
+    overrides.setdefault('time_resolution_minutes', step // 60)
+    overrides.setdefault('utility', {'type': 'file', 'path': prices_file})
+    overrides.setdefault('solar_forecast', {
+        'provider': 'file', 'file_path': production_file, 'fallback': None})
+    bc = batcontrol.Batcontrol(write_config(overrides, directory))
+    # the file providers are limited to the published prices and HORIZON_HOURS
+    bc.dynamic_tariff = tariff
+    bc.fc_solar = solar
+    return bc
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def write_results(benchmark:str, results:dict, output:str=None) -> dict:
+    """ Add metadata and write the results as JSON to output or stdout """
+    report = {
+        'benchmark': benchmark,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'numpy': np.__version__,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+    return report
@@ -0,0 +1,57 @@
+""" Macro benchmark of a complete evaluation
+
+Measures Batcontrol.run() with the testdriver inverter and stub providers,
+StaticTariff and StaticSolar, which return synthetic prices and production
+of the horizon without network access. The duration covers everything
+batcontrol does per evaluation: consumption forecast, rules, inverter
+commands and run data for the API.
+
+Usage:
+    python -m benchmarks.macro --output macro.json
+    python -m benchmarks.macro --horizons 96 --slot-minutes 15 --runs 200
+"""
+import sys
+import argparse
+import tempfile
+from .common import measure, create_batcontrol, write_results
+
+DEFAULT_HORIZONS = [24, 48, 96, 672]
+
+
+def run(horizons:list, runs:int, step:int) -> dict:
+    """ Results per horizon """
+    results = {}
+    for slots in horizons:
+        with tempfile.TemporaryDirectory() as directory:
+            bc = create_batcontrol(slots, step, directory=directory)
+            # below the always_allow_discharge_limit, so the rules evaluate the forecast
+            bc.inverter.SOC = 30
+            try:
+                result = measure(bc.run, runs, min_sample=0)
+                result['last_mode'] = bc.last_mode
+                results[str(slots)] = result
+            finally:
+                bc.shutdown()
+    return results
+
+
+def main():
+    """ Command line interface """
+    parser = argparse.ArgumentParser(description='Batcontrol.run() with stub providers')
+    parser.add_argument('--output', help='JSON file, default stdout')
+    parser.add_argument('--runs', type=int, default=50, help='evaluations per horizon')
+    parser.add_argument('--horizons', type=int, nargs='+', default=DEFAULT_HORIZONS,
+                        help='forecast horizons in slots')
+    parser.add_argument('--slot-minutes', type=int, default=60, choices=[15, 30, 60])
+    args = parser.parse_args()
+
+    results = run(args.horizons, args.runs, args.slot_minutes * 60)
+    write_results('macro', {
+        'slot_minutes': args.slot_minutes,
+        'run': results,
+    }, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+""" Microbenchmarks of the control loop components
+
+Measures the duration of one call per component and horizon in slots:
+    consumption_forecast: ForecastConsumption.get_forecast
+    is_discharge_allowed, required_recharge_energy: the rules of Batcontrol
+    tariff_awattar, tariff_tibber, tariff_evcc: get_prices_from_raw_data
+        with hourly raw data of the horizon
+    fcsolar_fetch: FCSolar.get_forecast with expired cache, requests and
+        parses all installations from a local stand-in server
+    fcsolar_cached: FCSolar.get_forecast from the cached results
+    mqtt_create_forecast: MqttApi._create_forecast of the JSON payloads
+
+Usage:
+    python -m benchmarks.micro --output micro.json
+    python -m benchmarks.micro --horizons 24 96 --only tariff_awattar tariff_tibber
+"""
+import sys
+import time
+import inspect
+import datetime
+import argparse
+import tempfile
+import numpy as np
+import mqtt_api
+from dynamictariff.awattar import Awattar
+from dynamictariff.tibber import Tibber
+from dynamictariff.evcc import Evcc
+from forecastsolar.fcsolar import FCSolar
+from mockservers.mockservers import Faults, ForecastSolarServer
+from .common import (
+    measure, create_batcontrol, synthetic_prices, synthetic_production, write_results)
+
+DEFAULT_HORIZONS = [24, 48, 96, 672]
+
+
+def _slot_start(step:int) -> float:
+    now = time.time()
+    return now - now % step
+
+
+def bench_consumption_forecast(bc, slots:int, step:int) -> callable:
+    """ Consumption forecast from the load profile """
+    start = _slot_start(step)
+    return lambda: bc.fc_consumption.get_forecast(slots, start, step)
+
+
+def _net_consumption(bc, slots:int, step:int) -> tuple:
+    start = _slot_start(step)
+    consumption = bc.fc_consumption.get_forecast(slots, start, step).values
+    net_consumption = consumption - synthetic_production(start, slots, step)
+    return net_consumption, synthetic_prices(start, slots, step)
+
+
+def bench_is_discharge_allowed(bc, slots:int, step:int) -> callable:
+    """ Discharge rule with the reserved energy for higher prices """
+    net_consumption, prices = _net_consumption(bc, slots, step)
+    return lambda: bc.is_discharge_allowed(net_consumption, prices)
+
+
+def bench_required_recharge_energy(bc, slots:int, step:int) -> callable:
+    """ Grid charging rule """
+    net_consumption, prices = _net_consumption(bc, slots, step)
+    return lambda: bc.get_required_required_recharge_energy(net_consumption, prices)
+
+
+def _hourly_starts(slots:int, step:int) -> np.ndarray:
+    hours = max(1, int(np.ceil(slots * step / 3600)))
+    return _slot_start(3600) + np.arange(hours) * 3600
+
+
+def _isoformat(timestamp:float, timezone) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, timezone).isoformat()
+
+
+def bench_tariff_awattar(bc, slots:int, step:int) -> callable:
+    """ Awattar marketdata parser """
+    tariff = Awattar(bc.timezone, 'de')
+    tariff.set_price_parameters(0.19, 0.015, 0.03)
+    starts = _hourly_starts(slots, step)
+    tariff.raw_data = {'data': [{
+        'start_timestamp': int(start * 1000),
+        'end_timestamp': int((start + 3600) * 1000),
+        'marketprice': float(price * 1000),
+        'unit': 'Eur/MWh',
+    } for start, price in zip(starts, synthetic_prices(starts[0], len(starts)))]}
+    return tariff.get_prices_from_raw_data
+
+
+def bench_tariff_tibber(bc, slots:int, step:int) -> callable:
+    """ Tibber GraphQL parser, the horizon is split into today and tomorrow """
+    tariff = Tibber(bc.timezone, 'stand-in')
+    starts = _hourly_starts(slots, step)
+    prices = [{'total': float(price), 'startsAt': _isoformat(start, bc.timezone)}
+              for start, price in zip(starts, synthetic_prices(starts[0], len(starts)))]
+    price_info = {'current': prices[0], 'today': prices[:24], 'tomorrow': prices[24:]}
+    tariff.raw_data = {'data': {'viewer': {'homes': [
+        {'currentSubscription': {'priceInfo': price_info}}]}}}
+    return tariff.get_prices_from_raw_data
+
+
+def bench_tariff_evcc(bc, slots:int, step:int) -> callable:
+    """ evcc tariff parser """
+    tariff = Evcc(bc.timezone, 'http://127.0.0.1/api/tariff/grid')
+    starts = _hourly_starts(slots, step)
+    tariff.raw_data = {'result': {'rates': [{
+        'start': _isoformat(start, bc.timezone),
+        'end': _isoformat(start + 3600, bc.timezone),
+        'price': float(price),
+    } for start, price in zip(starts, synthetic_prices(starts[0], len(starts)))]}}
+    return tariff.get_prices_from_raw_data
+
+
+def _fcsolar(bc, server:ForecastSolarServer, step:int) -> FCSolar:
+    fc_solar = FCSolar(bc.config['pvinstallations'], bc.timezone, 0, step,
+                       url=server.url + '/')
+    # the stand-in server has no rate limit, neither has the benchmark
+    fc_solar.budget.limit = 10 ** 9
+    return fc_solar
+
+
+def bench_fcsolar_fetch(bc, step:int, server:ForecastSolarServer) -> callable:
+    """ Request, parse and combine all installations """
+    fc_solar = _fcsolar(bc, server, step)
+
+    def fetch():
+        fc_solar.results.clear()
+        fc_solar.budget.tokens = fc_solar.budget.limit
+        return fc_solar.get_forecast()
+    return fetch
+
+
+def bench_fcsolar_cached(bc, step:int, server:ForecastSolarServer) -> callable:
+    """ Slots from the cached results """
+    fc_solar = _fcsolar(bc, server, step)
+    fc_solar.get_forecast()
+    return fc_solar.get_forecast
+
+
+def bench_mqtt_create_forecast(slots:int, step:int) -> callable:
+    """ JSON payload of a forecast """
+    # no broker connection required
+    api = mqtt_api.MqttApi.__new__(mqtt_api.MqttApi)
+    start = _slot_start(step)
+    production = synthetic_production(start, slots, step)
+    return lambda: api._create_forecast(production, start, step)  # pylint: disable=protected-access
+
+
+# Each setup declares the arguments it needs from bc, slots, step and server
+BENCHMARKS = {
+    'consumption_forecast': bench_consumption_forecast,
+    'is_discharge_allowed': bench_is_discharge_allowed,
+    'required_recharge_energy': bench_required_recharge_energy,
+    'tariff_awattar': bench_tariff_awattar,
+    'tariff_tibber': bench_tariff_tibber,
+    'tariff_evcc': bench_tariff_evcc,
+    'fcsolar_fetch': bench_fcsolar_fetch,
+    'fcsolar_cached': bench_fcsolar_cached,
+    'mqtt_create_forecast': bench_mqtt_create_forecast,
+}
+
+
+def _setup(benchmark:callable, arguments:dict) -> callable:
+    """ Call the setup of a benchmark with the arguments of its signature """
+    parameters = inspect.signature(benchmark).parameters
+    return benchmark(**{name: arguments[name] for name in parameters})
+
+
+def run(horizons:list, names:list, runs:int, step:int) -> dict:
+    """ Results per benchmark and horizon """
+    results = {name: {} for name in names}
+    with tempfile.TemporaryDirectory() as directory:
+        bc = create_batcontrol(max(horizons), step, directory=directory)
+        # below the always_allow_discharge_limit, so the rules evaluate the forecast
+        bc.inverter.SOC = 30
+        bc.last_run_time = time.time()
+        try:
+            for slots in horizons:
+                hours = int(np.ceil(slots * step / 3600)) + 24
+                with ForecastSolarServer(Faults(), rate_limit=None, hours=hours) as server:
+                    for name in names:
+                        arguments = {'bc': bc, 'slots': slots, 'step': step, 'server': server}
+                        results[name][str(slots)] = measure(
+                            _setup(BENCHMARKS[name], arguments), runs)
+        finally:
+            bc.shutdown()
+    return results
+
+
+def main():
+    """ Command line interface """
+    parser = argparse.ArgumentParser(description='Microbenchmarks of the control loop')
+    parser.add_argument('--output', help='JSON file, default stdout')
+    parser.add_argument('--runs', type=int, default=20, help='samples per benchmark')
+    parser.add_argument('--horizons', type=int, nargs='+', default=DEFAULT_HORIZONS,
+                        help='forecast horizons in slots')
+    parser.add_argument('--slot-minutes', type=int, default=60, choices=[15, 30, 60])
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    args = parser.parse_args()
+
+    results = run(args.horizons, args.only, args.runs, args.slot_minutes * 60)
+    write_results('micro', {
+        'slot_minutes': args.slot_minutes,
+        'benchmarks': results,
+    }, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+""" End-to-end latency of Batcontrol.run() under network conditions
+
+Runs batcontrol with the testdriver inverter against the stand-in servers of
+mockservers for the tariff and the solar forecast. Each scenario injects
+latency, jitter, errors or a rate limit and measures:
+    startup: Batcontrol() including the first requests of all providers
+    cold: the first run after start, with the data fetched during startup
+    warm: runs with cached provider data, no requests expected
+    refresh: runs with expired caches, tariff and forecast are requested again
+
+Usage:
+    python -m benchmarks.network --output network.json
+    python -m benchmarks.network --scenarios lan slow --tariff tibber --runs 3
+    python -m benchmarks.network --solar openmeteo
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+import tempfile
+import batcontrol
+from mockservers.mockservers import (
+    Faults, AwattarServer, TibberServer, EvccServer, ForecastSolarServer, OpenMeteoServer)
+from .common import REPO_DIR, summarize, write_config, write_results
+
+logger = logging.getLogger('__main__')
+
+# faults of the tariff and forecast servers, rate limit of the solar forecast
+SCENARIOS = {
+    'lan': {'faults': {'latency': 0.005}, 'rate_limit': None},
+    'internet': {'faults': {'latency': 0.08, 'jitter': 0.04}, 'rate_limit': None},
+    'slow': {'faults': {'latency': 0.5, 'jitter': 0.5}, 'rate_limit': None},
+    'faulty': {'faults': {'latency': 0.08, 'error_rate': 0.3}, 'rate_limit': None},
+    'rate_limited': {'faults': {'latency': 0.08}, 'rate_limit': (1, 3600)},
+}
+
+TARIFFS = {
+    # server, utility config with the url of the server
+    'awattar': (AwattarServer, lambda url: {
+        'type': 'awattar_de', 'api_url': url + '/v1/marketdata'}),
+    'tibber': (TibberServer, lambda url: {
+        'type': 'tibber', 'apikey': 'stand-in', 'api_url': url + '/v1-beta/gql'}),
+    'evcc': (EvccServer, lambda url: {
+        'type': 'evcc', 'url': url + '/api/tariff/grid'}),
+}
+
+SOLAR_PROVIDERS = {
+    # server, solar_forecast config with the url of the server
+    'fcsolar': (ForecastSolarServer, lambda url: {
+        'provider': 'fcsolarapi', 'fcsolar_url': url + '/'}),
+    'openmeteo': (OpenMeteoServer, lambda url: {
+        'provider': 'openmeteo', 'openmeteo_url': url + '/v1/forecast'}),
+    'evcc': (EvccServer, lambda url: {
+        'provider': 'evcc', 'evcc_url': url + '/api/tariff/solar'}),
+}
+
+
+def expire_caches(bc:batcontrol.Batcontrol) -> None:
+    """ Let the next run request the tariff and all installations again """
+    bc.dynamic_tariff.last_update = 0
+    fc_solar = getattr(bc.fc_solar, 'primary', bc.fc_solar)
+    fc_solar.last_update = 0
+    if hasattr(fc_solar, 'budget'):
+        # forecast.solar: the stand-in server enforces the rate limit, not the client
+        fc_solar.results.clear()
+        fc_solar.budget.tokens = fc_solar.budget.limit
+
+
+def timed_run(bc:batcontrol.Batcontrol) -> float:
+    """ Duration of one evaluation in seconds """
+    start = time.perf_counter()
+    bc.run()
+    return time.perf_counter() - start
+
+
+def run_scenario(name:str, tariff:str, solar:str, runs:int, seed:int) -> dict:
+    """ Start the servers, run batcontrol and collect the timings """
+    scenario = SCENARIOS[name]
+    server_class, utility = TARIFFS[tariff]
+    tariff_server = server_class(Faults(seed=seed, **scenario['faults']))
+    solar_class, solar_forecast = SOLAR_PROVIDERS[solar]
+    solar_server = solar_class(
+        Faults(seed=seed + 1, **scenario['faults']), rate_limit=scenario['rate_limit'])
+
+    with tariff_server, solar_server, tempfile.TemporaryDirectory() as directory:
+        configfile = write_config({
+            'utility': utility(tariff_server.url),
+            'solar_forecast': dict(
+                solar_forecast(solar_server.url), fallback='clearsky', nowcast=False),
+        }, directory)
+        start = time.perf_counter()
+        bc = batcontrol.Batcontrol(configfile)
+        startup = time.perf_counter() - start
+        requests_startup = tariff_server.request_count + solar_server.request_count
+        try:
+            cold = timed_run(bc)
+            requests_cold = tariff_server.request_count + solar_server.request_count \
+                - requests_startup
+
+            warm = [timed_run(bc) for _ in range(runs)]
+            requests_warm = tariff_server.request_count + solar_server.request_count \
+                - requests_cold - requests_startup
+
+            refresh = []
+            for _ in range(runs):
+                expire_caches(bc)
+                refresh.append(timed_run(bc))
+            mode = bc.last_mode
+        finally:
+            bc.shutdown()
+
+    return {
+        'tariff': tariff,
+        'solar': solar,
+        'startup': summarize([startup]),
+        'cold': summarize([cold]),
+        'warm': summarize(warm),
+        'refresh': summarize(refresh),
+        'requests': {
+            'startup': requests_startup,
+            'cold': requests_cold,
+            'warm': requests_warm,
+            'tariff': tariff_server.request_count,
+            'solar': solar_server.request_count,
+        },
+        'last_mode': mode,
+    }
+
+
+def main():
+    """ Command line interface """
+    parser = argparse.ArgumentParser(description='Batcontrol.run() latency against stand-in APIs')
+    parser.add_argument('--output', help='JSON file, default stdout')
+    parser.add_argument('--runs', type=int, default=5, help='warm and refresh runs per scenario')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+                        default=list(SCENARIOS))
+    parser.add_argument('--tariff', choices=sorted(TARIFFS), default='awattar')
+    parser.add_argument('--solar', choices=sorted(SOLAR_PROVIDERS), default='fcsolar')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the injected faults')
+    args = parser.parse_args()
+
+    os.chdir(REPO_DIR)
+    # no random delay before refreshing the providers
+    batcontrol.DELAY_EVALUATION_BY_SECONDS = 0
+
+    results = {}
+    for name in args.scenarios:
+        print(f'[Benchmark] scenario {name}', file=sys.stderr)
+        results[name] = run_scenario(name, args.tariff, args.solar, args.runs, args.seed)
+    write_results('network', results, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
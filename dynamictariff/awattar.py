@@ -22,9 +22,9 @@ Methods:
     get_prices_from_raw_data(self):
         Processes the raw data to extract and calculate electricity prices.
 """
-import datetime
-import math
-import requests
+import numpy as np
+from httpclient.httpclient import HttpClient, NOT_MODIFIED
+from forecastseries.forecastseries import ForecastSeries
 from .baseclass import DynamicTariffBaseclass
 
 class Awattar(DynamicTariffBaseclass):
@@ -32,13 +32,18 @@ class Awattar(DynamicTariffBaseclass):
         Inherits from DynamicTariffBaseclass
     """
 
-    def __init__(self, timezone ,country:str, min_time_between_API_calls=0, delay_evaluation_by_seconds=0):
+    def __init__(self, timezone ,country:str, min_time_between_API_calls=0, delay_evaluation_by_seconds=0, url=None):
         super().__init__(timezone,min_time_between_API_calls, delay_evaluation_by_seconds)
         country= country.lower()
         if country in ['at','de']:
             self.url=f'https://api.awattar.{country}/v1/marketdata'
         else:
             raise RuntimeError(f'[Awattar] Country Code {country} not known')
+        # e.g. a local stand-in server for tests
+        if url:
+            self.url=url
+
+        self.client=HttpClient('awattar')
 
         self.vat=0
         self.price_fees=0
@@ -51,7 +56,9 @@ class Awattar(DynamicTariffBaseclass):
         self.price_markup=price_markup
 
     def get_raw_data_from_provider(self):
-        response=requests.get(self.url, timeout=30)
+        response=self.client.get(self.url, conditional=self.prices is not None)
+        if response.status_code == NOT_MODIFIED:
+            return None
         if response.status_code != 200:
             raise RuntimeError(f'[Awattar_AT] API returned {response}')
 
@@ -59,18 +66,10 @@ class Awattar(DynamicTariffBaseclass):
         return raw_data
 
 
-    def get_prices_from_raw_data(self):
+    def get_prices_from_raw_data(self) -> ForecastSeries:
         data=self.raw_data['data']
-        now=datetime.datetime.now().astimezone(self.timezone)
-        prices={}
-        for item in data:
-            timestamp=datetime.datetime.fromtimestamp(
-                            item['start_timestamp']/1000).astimezone(self.timezone
-                        )
-            diff=timestamp-now
-            rel_hour=math.ceil(diff.total_seconds()/3600)
-            if rel_hour >=0:
-                end_price=( item['marketprice']/1000*(1+self.price_markup) + self.price_fees
-                          ) * (1+self.vat)
-                prices[rel_hour]=end_price
-        return prices
+        timestamps=np.array([item['start_timestamp'] for item in data], dtype=np.float64)/1000
+        marketprices=np.array([item['marketprice'] for item in data], dtype=np.float64)
+        end_prices=( marketprices/1000*(1+self.price_markup) + self.price_fees
+                   ) * (1+self.vat)
+        return ForecastSeries.from_timestamps(timestamps, end_prices)
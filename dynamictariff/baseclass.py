@@ -1,26 +1,61 @@
-""" Parent Class for implementing different tariffs"""
+""" Parent Class for implementing different tariffs
+
+Day-ahead prices are published once a day, at about 13:00 CET for the next
+day. The prices are refreshed depending on the known horizon:
+- the cached prices cover the expected horizon (today, after the
+  publication also tomorrow): refresh only every SAFETY_REFRESH_INTERVAL
+- tomorrow's prices are due but missing: poll every PUBLICATION_POLL_INTERVAL
+  during the publication window, later every min_time_between_API_calls
+"""
 import time
 import random
+import datetime
 import logging
+import pytz
+from metrics import metrics
+from forecastseries.forecastseries import ForecastSeries
 from .dynamictariff_interface import TariffInterface
 
 
 logger = logging.getLogger('__main__')
 
+PUBLICATION_TIMEZONE = pytz.timezone('Europe/Berlin')
+PUBLICATION_HOUR = 13  # day-ahead auction results, local time of PUBLICATION_TIMEZONE
+PUBLICATION_WINDOW = 3 * 3600  # seconds after PUBLICATION_HOUR with fast polling
+PUBLICATION_POLL_INTERVAL = 300  # seconds
+SAFETY_REFRESH_INTERVAL = 6 * 3600  # seconds, refresh of complete prices for corrections
+
+
+def get_local_time(now:float, days:int, hour:int=0) -> float:
+    """ Timestamp of hour, days after the date of now in PUBLICATION_TIMEZONE """
+    date = datetime.datetime.fromtimestamp(now, PUBLICATION_TIMEZONE).date() \
+        + datetime.timedelta(days=days)
+    return PUBLICATION_TIMEZONE.localize(
+        datetime.datetime.combine(date, datetime.time(hour))).timestamp()
+
+
+def get_expected_end(now:float) -> float:
+    """ End of the published day-ahead prices at now: the end of today,
+        after the publication the end of tomorrow
+    """
+    publication = get_local_time(now, 0, PUBLICATION_HOUR)
+    return get_local_time(now, 2 if now >= publication else 1)
+
 class DynamicTariffBaseclass(TariffInterface):
     """ Parent Class for implementing different tariffs"""
     def __init__(self, timezone,min_time_between_API_calls, delay_evaluation_by_seconds) -> None:  #pylint: disable=invalid-name
         self.raw_data={}
+        self.prices=None
         self.last_update=0
         self.min_time_between_updates=min_time_between_API_calls
         self.timezone=timezone
         self.delay_evaluation_by_seconds=delay_evaluation_by_seconds
 
-    def get_prices(self) -> dict[int, float]:
-        """ Get prices from provider """
+    def get_prices(self) -> ForecastSeries:
+        """ Get prices from provider, starting with the current slot """
         now=time.time()
         time_passed=now-self.last_update
-        if time_passed> self.min_time_between_updates:
+        if time_passed> self.get_refresh_interval(now):
             # Not on initial call
             if self.last_update > 0 and self.delay_evaluation_by_seconds > 0:
                 sleeptime = random.randrange(0, self.delay_evaluation_by_seconds, 1)
@@ -28,19 +63,46 @@ class DynamicTariffBaseclass(TariffInterface):
                         '[Tariff] Waiting for %d seconds before requesting new data',
                         sleeptime)
                 time.sleep(sleeptime)
-            self.raw_data=self.get_raw_data_from_provider()
+            raw_data=self.get_raw_data_from_provider()
+            if raw_data is None:
+                # 304 Not Modified, the parsed prices are still up to date
+                logger.debug('[Tariff] Prices not modified')
+            else:
+                self.raw_data=raw_data
+                # parse once per fetch, only the price arrays are kept
+                self.prices=self.get_prices_from_raw_data()
+                self.raw_data={}
             self.last_update=now
-        prices=self.get_prices_from_raw_data()
-        return prices
+            logger.debug(
+                '[Tariff] Received prices until %s',
+                datetime.datetime.fromtimestamp(self.prices.end, self.timezone).isoformat())
+        else:
+            metrics.PROVIDER_CACHE_HITS.inc(provider=type(self).__name__.lower())
+        return self.prices.align(time.time())
+
+    def get_refresh_interval(self, now:float) -> float:
+        """ Seconds between two requests, depending on the cached horizon """
+        if self.prices is None or len(self.prices) == 0:
+            return 0
+        if self.prices.end >= get_expected_end(now):
+            return SAFETY_REFRESH_INTERVAL
+        publication = get_local_time(now, 0, PUBLICATION_HOUR)
+        if publication <= now < publication + PUBLICATION_WINDOW:
+            return PUBLICATION_POLL_INTERVAL
+        return self.min_time_between_updates
 
     def get_raw_data_from_provider(self) -> dict:
-        """ Prototype for get_raw_data_from_provider """
+        """ Prototype for get_raw_data_from_provider, returns None if the
+            data has not been modified since the last request
+        """
         raise RuntimeError("[Dyn Tariff Base Class] Function "
                            "'get_raw_data_from_provider' not implemented"
                            )
 
-    def get_prices_from_raw_data(self) -> dict[int, float]:
-        """ Prototype for get_prices_from_raw_data """
+    def get_prices_from_raw_data(self) -> ForecastSeries:
+        """ Prototype for get_prices_from_raw_data, parses self.raw_data into
+            a ForecastSeries of all known prices. Called once per fetch.
+        """
         raise RuntimeError("[Dyn Tariff Base Class] Function "
                            "'get_prices_from_raw_data' not implemented"
                            )
@@ -14,9 +14,6 @@ Raises:
     RuntimeError: If required fields are missing in the configuration
                      or if the provider type is unknown.
 """
-from .awattar import Awattar
-from .tibber import Tibber
-from .evcc import Evcc
 from .dynamictariff_interface import TariffInterface
 
 class DynamicTariff:
@@ -30,6 +27,8 @@ class DynamicTariff:
         selected_tariff=None
         provider=config['type']
 
+        # Providers are imported on demand, the HTTP based ones import requests
+
         if provider.lower()=='awattar_at':
             required_fields=['vat', 'markup', 'fees']
             for field in required_fields:
@@ -40,9 +39,11 @@ class DynamicTariff:
             vat = float(config['vat'])
             markup = float(config['markup'])
             fees = float(config['fees'])
+            from .awattar import Awattar
             selected_tariff= Awattar(timezone,'at',
                                      min_time_between_api_calls,
-                                     delay_evaluation_by_seconds
+                                     delay_evaluation_by_seconds,
+                                     config.get('api_url')
                                     )
             selected_tariff.set_price_parameters(vat,fees,markup)
 
@@ -56,9 +57,11 @@ class DynamicTariff:
             vat = float(config['vat'])
             markup = float(config['markup'])
             fees = float(config['fees'])
+            from .awattar import Awattar
             selected_tariff= Awattar(timezone,'de',
                                      min_time_between_api_calls,
-                                     delay_evaluation_by_seconds
+                                     delay_evaluation_by_seconds,
+                                     config.get('api_url')
                                      )
             selected_tariff.set_price_parameters(vat,fees,markup)
 
@@ -69,10 +72,12 @@ class DynamicTariff:
                     'Please provide "apikey :YOURKEY" in your configuration file'
                     )
             token = config['apikey']
+            from .tibber import Tibber
             selected_tariff=Tibber(timezone,
                                    token,
                                    min_time_between_api_calls,
-                                   delay_evaluation_by_seconds
+                                   delay_evaluation_by_seconds,
+                                   config.get('api_url')
                                    )
 
         elif provider.lower()=='evcc':
@@ -82,7 +87,17 @@ class DynamicTariff:
                     'Please provide "url" in your configuration file, '
                     'like http://evcc.local/api/tariff/grid'
                     )
+            from .evcc import Evcc
             selected_tariff= Evcc(timezone,config['url'],min_time_between_api_calls)
+
+        elif provider.lower()=='file':
+            if not 'path' in config.keys() :
+                raise RuntimeError (
+                    '[Dynamic Tariff] file requires a path. '
+                    'Please provide "path" to a CSV or NPZ file with prices in your configuration file'
+                    )
+            from .filetariff import FileTariff
+            selected_tariff= FileTariff(timezone,config['path'])
         else:
             raise RuntimeError(f'[DynamicTariff] Unkown provider {provider}')
         return selected_tariff
@@ -1,6 +1,7 @@
 """ Interface for tariff classes """
 
 from abc import ABC, abstractmethod
+from forecastseries.forecastseries import ForecastSeries
 
 class TariffInterface(ABC):
     """ Interface for tariff classes """
@@ -9,5 +10,5 @@ class TariffInterface(ABC):
         """ Initialize the tariff class """
 
     @abstractmethod
-    def get_prices(self) -> dict[int, float]:
-        """ get prices in processable format with hours as keys """
+    def get_prices(self) -> ForecastSeries:
+        """ get prices starting with the current slot """
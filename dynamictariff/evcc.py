@@ -14,8 +14,7 @@ Methods:
         Fetches raw data from the evcc API and returns it as a JSON object.
 
     get_prices_from_raw_data(self):
-        Processes the raw data from the evcc API and returns a dictionary of prices
-        indexed by the relative hour.
+        Processes the raw data from the evcc API and returns a ForecastSeries of prices.
 
     test():
         A test function to run the Evcc class with a provided URL and print the fetched prices.
@@ -25,8 +24,8 @@ Usage:
     python evcc.py <url>
 """
 import datetime
-import math
-import requests
+from httpclient.httpclient import HttpClient, NOT_MODIFIED
+from forecastseries.forecastseries import ForecastSeries
 from .baseclass import DynamicTariffBaseclass
 
 class Evcc(DynamicTariffBaseclass):
@@ -37,10 +36,13 @@ class Evcc(DynamicTariffBaseclass):
         super().__init__(timezone,min_time_between_API_calls, 0)
         self.delay_evaluation_by_seconds=0
         self.url=url
+        self.client=HttpClient('evcc')
 
     def get_raw_data_from_provider(self) -> dict:  # pylint: disable=unused-private-member
-        response=requests.get(self.url, timeout=30)
+        response=self.client.get(self.url, conditional=self.prices is not None)
 
+        if response.status_code == NOT_MODIFIED:
+            return None
         if response.status_code != 200:
             raise RuntimeError(f'[evcc] API returned {response}')
 
@@ -64,19 +66,16 @@ class Evcc(DynamicTariffBaseclass):
         return raw_data
 
 
-    def get_prices_from_raw_data(self) -> dict[int, float]:   # pylint: disable=unused-private-member
+    def get_prices_from_raw_data(self) -> ForecastSeries:   # pylint: disable=unused-private-member
         data=self.raw_data['result']['rates']
-        now=datetime.datetime.now().astimezone(self.timezone)
-        prices={}
+        timestamps=[]
+        prices=[]
 
         for item in data:
             # "start":"2024-06-20T08:00:00+02:00" to timestamp
-            timestamp=datetime.datetime.fromisoformat(item['start']).astimezone(self.timezone)
-            diff=timestamp-now
-            rel_hour=math.ceil(diff.total_seconds()/3600)
-            if rel_hour >=0:
-                prices[rel_hour]=item['price']
-        return prices
+            timestamps.append(datetime.datetime.fromisoformat(item['start']).timestamp())
+            prices.append(item['price'])
+        return ForecastSeries.from_timestamps(timestamps, prices)
 
 def test():
     """
@@ -111,7 +110,7 @@ def test():
     evcc = Evcc(pytz.timezone('Europe/Berlin'), url)  # Assuming the Evcc constructor takes a URL
 
     prices = evcc.get_prices()
-    print(json.dumps(prices, indent=4))
+    print(json.dumps(prices.to_dict(), indent=4))
 
 if __name__ == "__main__":
     test()
@@ -0,0 +1,35 @@
+""" Tariff from a file with historical prices
+
+Reads end prices in EUR/kWh from a CSV or NPZ file (see
+ForecastSeries.from_file) for replays and benchmarks without network access.
+
+The file is loaded once. get_prices() returns the prices which were
+published at the time of the clock: until the end of the day, after the
+day-ahead publication until the end of the next day. The clock defaults to
+time.time and can be replaced by a simulated clock.
+"""
+import time
+import logging
+from forecastseries.forecastseries import ForecastSeries
+from .baseclass import get_expected_end
+from .dynamictariff_interface import TariffInterface
+
+logger = logging.getLogger('__main__')
+logger.info('[FileTariff] loading module')
+
+
+class FileTariff(TariffInterface):
+    """ Prices from a CSV or NPZ file, indexed by the clock """
+    def __init__(self, timezone, path:str, clock=None) -> None:
+        self.timezone = timezone
+        self.path = path
+        self.clock = clock
+        self.prices = ForecastSeries.from_file(path)
+        logger.info('[FileTariff] Loaded %d prices from %s', len(self.prices), path)
+
+    def get_prices(self) -> ForecastSeries:
+        """ Published prices starting with the current slot """
+        now = self.clock() if self.clock is not None else time.time()
+        prices = self.prices.align(now)
+        length = int((get_expected_end(now) - prices.start) // prices.step)
+        return prices.align(now, max(length, 1))
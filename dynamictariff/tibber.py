@@ -2,18 +2,19 @@
 """
 
 import datetime
-import math
-import requests
+from httpclient.httpclient import HttpClient
+from forecastseries.forecastseries import ForecastSeries
 from .baseclass import DynamicTariffBaseclass
 
 class Tibber(DynamicTariffBaseclass):
     """ Implement Tibber API to get dynamic electricity prices
         Inherits from DynamicTariffBaseclass
     """
-    def __init__(self, timezone , token, min_time_between_API_calls=0, delay_evaluation_by_seconds=0):
+    def __init__(self, timezone , token, min_time_between_API_calls=0, delay_evaluation_by_seconds=0, url=None):
         super().__init__(timezone,min_time_between_API_calls, delay_evaluation_by_seconds)
         self.access_token=token
-        self.url="https://api.tibber.com/v1-beta/gql"
+        self.url=url or "https://api.tibber.com/v1-beta/gql"
+        self.client=HttpClient('tibber')
 
     def get_raw_data_from_provider(self) -> dict:
         """ Get raw data from Tibber API """
@@ -24,25 +25,22 @@ class Tibber(DynamicTariffBaseclass):
         data="""{ "query":
         "{viewer {homes {currentSubscription {priceInfo { current {total startsAt } today {total startsAt } tomorrow {total startsAt }}}}}}" }
         """
-        response=requests.post(self.url, data, headers=headers, timeout=30)
+        response=self.client.post(self.url, data, headers=headers)
         if response.status_code != 200:
             raise RuntimeError(f'[Tibber] Tibber Api responded with Error {response}')
         raw_data=response.json()
         return raw_data
 
 
-    def get_prices_from_raw_data(self) -> dict[int, float]:
-        """ Extract prices from raw to internal datastracture based on hours """
+    def get_prices_from_raw_data(self) -> ForecastSeries:
+        """ Extract prices from raw to internal datastracture, in the resolution provided by Tibber """
         homeid=0
         rawdata=self.raw_data['data']
-        now=datetime.datetime.now().astimezone(self.timezone)
-        prices={}
+        timestamps=[]
+        prices=[]
         for day in ['today', 'tomorrow']:
             dayinfo=rawdata['viewer']['homes'][homeid]['currentSubscription']['priceInfo'][day]
             for item in dayinfo:
-                timestamp=datetime.datetime.fromisoformat(item['startsAt'])
-                diff=timestamp-now
-                rel_hour=math.ceil(diff.total_seconds()/3600)
-                if rel_hour >=0:
-                    prices[rel_hour]=item['total']
-        return prices
+                timestamps.append(datetime.datetime.fromisoformat(item['startsAt']).timestamp())
+                prices.append(item['total'])
+        return ForecastSeries.from_timestamps(timestamps, prices)
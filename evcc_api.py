@@ -4,13 +4,26 @@ This module provides the EvccApi class for interacting with an
 evcc (Electric Vehicle Charging Controller) via MQTT.
 """
 import time
-import re
+import datetime
+import threading
 import logging
+import numpy as np
 import paho.mqtt.client as mqtt
+import mqtt_connection
 
 logger = logging.getLogger('__main__')
 logger.info('[evcc] loading module')
 
+# Assumed charge power, if evcc provides a plan target time, but no projected window
+DEFAULT_PLAN_CHARGE_POWER = 11000 # W
+
+# Last topic levels of a loadpoint used by the consumption overlay
+CHARGE_POWER_LEAVES = ['chargePower']
+PLAN_LEAVES = [
+    'chargeRemainingEnergy', 'planEnergy', 'planProjectedStart',
+    'planProjectedEnd', 'effectivePlanTime'
+]
+
 class EvccApi():
     """
     A class to interact with the evcc (Electric Vehicle Charging Controller) via MQTT.
@@ -22,11 +35,14 @@ class EvccApi():
         block_function (function): Function to be called to block/unblock Battery.
         topic_status (str): MQTT topic for evcc status messages.
         topic_loadpoint (str): MQTT topic for evcc loadpoint messages.
+        connection (MqttConnection): MQTT connection, shared with MqttApi on the same broker.
         client (mqtt.Client): MQTT client instance.
 
     Methods:
-        __init__(config: dict):
+        __init__(config: dict, track_charge_power: bool):
             Initializes the EvccApi instance with the given configuration.
+            The charge power is subscribed if track_charge_power or the
+            consumption overlay is enabled, the plan only for the overlay.
 
         wait_ready() -> bool:
             Waits until the MQTT client is connected to the broker.
@@ -40,23 +56,50 @@ class EvccApi():
         set_evcc_charging(charging: bool):
             Sets the evcc charging status and handles state changes.
 
-        handle_status_messages(message):
+        handle_status_messages(message, loadpoint):
             Handles incoming status messages from the MQTT broker.
 
-        handle_charging_message(message):
+        handle_charging_message(message, loadpoint):
             Handles incoming charging messages from the MQTT broker.
 
+        handle_charge_power_message(message, loadpoint):
+            Handles incoming chargePower messages from the MQTT broker.
+
+        handle_plan_message(message, loadpoint):
+            Handles incoming charge plan messages from the MQTT broker.
+
+        get_consumption_overlay(start, slots, slot_seconds, now) -> np.ndarray:
+            Returns the expected energy used by the loadpoints per slot from now.
+
         _handle_message(client, userdata, message):
             Internal callback function to handle incoming MQTT messages.
     """
-    def __init__(self, config:dict):
+    def __init__(self, config:dict, track_charge_power:bool=False):
         self.config=config
 
         # internal state
         self.evcc_is_online = False
         self.evcc_is_charging = False
 
+        # loadpoint -> is_charging, maintained together with the counter
+        #   status and power are written by the MQTT thread and read by the
+        #   main loop, loadpoint_lock protects both
+        self.loadpoint_lock = threading.Lock()
         self.evcc_loadpoint_status = {}
+        self.num_loadpoints_charging = 0
+        # loadpoint -> charge power in W
+        self.evcc_loadpoint_power = {}
+        # loadpoint -> dict with plan values from evcc
+        self.evcc_loadpoint_plan = {}
+        # loadpoint -> list of (start, end, power in W) expected charging intervals,
+        #   updated on incoming messages, the evaluation clips them to its time
+        self.overlay_intervals = {}
+        # all intervals as array with the columns start, end, power
+        self.overlay_array = np.zeros((0, 3))
+        # protects plan, intervals and array
+        self.overlay_lock = threading.Lock()
+        self.plan_charge_power = config.get('plan_charge_power', DEFAULT_PLAN_CHARGE_POWER)
+        self.consumption_overlay = config.get('consumption_overlay', False)
 
         self.block_function = None
 
@@ -70,56 +113,71 @@ class EvccApi():
         else:
             logger.error('[evcc] Invalid loadpoint_topic type')
 
-        self.client = mqtt.Client()
-        if 'logger' in config and config['logger'] is True:
-            self.client.enable_logger(logger)
-
-        if 'username' in config and 'password' in config:
-            self.client.username_pw_set(config['username'], config['password'])
-
-        # TLS , not tested yet
-        if config['tls'] is True:
-            self.client.tls_set(
-                config['tls']['ca_certs'],
-                config['tls']['certfile'],
-                config['tls']['keyfile'],
-                cert_reqs=config['tls']['cert_reqs'],
-                tls_version=config['tls']['tls_version'],
-                ciphers=config['tls']['ciphers']
-            )
-
-        self.client.loop_start()
-        self.client.connect(config['broker'], config['port'], 60)
-        self.client.on_connect = self.on_connect
-
-        self.wait_ready()
-        # Register callback functions, survives reconnects
-        self.client.message_callback_add(self.topic_status, self._handle_message)
+        # Handlers per last topic level, used for loadpoints
+        #   e.g. evcc/loadpoints/1/charging -> loadpoint evcc/loadpoints/1
+        #   Only the levels used by the enabled features are subscribed.
+        self.loadpoint_handlers = {
+            'charging': self.handle_charging_message,
+        }
+        if track_charge_power or self.consumption_overlay:
+            for leaf in CHARGE_POWER_LEAVES:
+                self.loadpoint_handlers[leaf] = self.handle_charge_power_message
+        if self.consumption_overlay:
+            for leaf in PLAN_LEAVES:
+                self.loadpoint_handlers[leaf] = self.handle_plan_message
+        known_leaves = ['charging'] + CHARGE_POWER_LEAVES + PLAN_LEAVES
+        # Precompiled topic -> (handler, loadpoint) table, wildcard topics
+        #   are added on their first message.
+        self.topic_handlers = {
+            self.topic_status: (self.handle_status_messages, None)
+        }
+        # Custom wildcard topics, which only provide the charging state
+        self.custom_wildcard_topics = []
+        subscriptions = [self.topic_status]
         for topic in self.list_topics_loadpoint:
-            self.__store_loadpoint_status(topic, False)
-            self.client.message_callback_add(topic, self._handle_message)
+            loadpoint, leaf = self.__split_loadpoint_topic(topic)
+            if leaf not in known_leaves:
+                # Custom topic, which only provides the charging state
+                if '+' in topic or '#' in topic:
+                    self.custom_wildcard_topics.append(topic)
+                else:
+                    self.topic_handlers[topic] = (self.handle_charging_message, topic)
+                subscriptions.append(topic)
+                continue
+            for related_leaf, handler in self.loadpoint_handlers.items():
+                related_topic = loadpoint + '/' + related_leaf
+                subscriptions.append(related_topic)
+                if '+' not in related_topic:
+                    self.topic_handlers[related_topic] = (handler, loadpoint)
+            if '+' not in loadpoint:
+                self.__store_loadpoint_status(loadpoint, False)
+
+        # Shared with MqttApi if both use the same broker and credentials
+        self.connection = mqtt_connection.get_connection(config)
+        self.client = self.connection.client
 
-    def on_connect(self, client, userdata, flags, rc): # pylint: disable=unused-argument
-        """ Callback function for MQTT on_connect """
-        logger.info('[evcc] Connected to MQTT Broker with result code %s', rc)
-        # Subscribe to status and loadpoint(s)
-        self.client.subscribe(self.topic_status)
-        for topic in self.list_topics_loadpoint:
+        # Register callback functions, survives reconnects
+        self.connection.add_on_connect_callback(self.on_connect)
+        for topic in subscriptions:
             logger.info('[evcc] Subscribing to %s', topic)
-            self.client.subscribe(topic)
+            self.connection.subscribe(topic, self._handle_message)
+        self.connection.connect()
+
+    @staticmethod
+    def __split_loadpoint_topic(topic:str) -> tuple:
+        """ Split a loadpoint topic into loadpoint and last level
+            evcc/loadpoints/1/charging -> (evcc/loadpoints/1, charging)
+        """
+        loadpoint, _, leaf = topic.rpartition('/')
+        return loadpoint, leaf
+
+    def on_connect(self, _client):
+        """ Callback function for MQTT on_connect """
+        logger.info('[evcc] Connected to MQTT Broker')
 
     def wait_ready(self) -> bool:
         """ Wait until the MQTT client is connected to the broker """
-        retry = 30
-        # Check if we are connected and wait for it
-        while self.client.is_connected() is False:
-            retry -= 1
-            if retry == 0:
-                logger.error('[evcc] Could not connect to MQTT Broker')
-                return False
-            logger.info('[evcc] Waiting for connection')
-            time.sleep(1)
-        return True
+        return self.connection.wait_ready()
 
     def register_block_function(self, function):
         """ Register a function to be called to block/unblock battery while charging """
@@ -137,7 +195,7 @@ class EvccApi():
                     logger.error('[evcc] evcc was charging, remove block')
                     self.evcc_is_charging = False
                     self.block_function(False)
-                    self.__reset_loadpoint_status()
+                self.__reset_loadpoint_status()
             else:
                 logger.info('[evcc] evcc is online')
             self.evcc_is_online = online
@@ -156,59 +214,221 @@ class EvccApi():
                 self.block_function(False)
         self.evcc_is_charging = charging
 
-    def __store_loadpoint_status(self, topic:str, is_charging:bool):
-        """ Store the loadpoint status """
-        send_info = False
-        if topic not in self.evcc_loadpoint_status:
-            self.evcc_loadpoint_status[topic] = is_charging
-            send_info = True
-        if self.evcc_loadpoint_status[topic] != is_charging:
-            self.evcc_loadpoint_status[topic] = is_charging
-            send_info = True
-        # Send info if status changed
-        if send_info is True:
-            if is_charging is False:
-                logger.info('[evcc] Loadpoint %s is not charging.', topic)
-            else:
-                logger.info('[evcc] Loadpoint %s is charging.', topic)
-
+    def __store_loadpoint_status(self, loadpoint:str, is_charging:bool):
+        """ Store the loadpoint status and maintain the number of charging loadpoints """
+        with self.loadpoint_lock:
+            previous = self.evcc_loadpoint_status.get(loadpoint)
+            if previous == is_charging:
+                return
+            self.evcc_loadpoint_status[loadpoint] = is_charging
+            if is_charging:
+                self.num_loadpoints_charging += 1
+            elif previous is True:
+                self.num_loadpoints_charging -= 1
+
+        if previous is None:
+            logger.info('[evcc] Discovered loadpoint %s', loadpoint)
+        if is_charging is False:
+            logger.info('[evcc] Loadpoint %s is not charging.', loadpoint)
+        else:
+            logger.info('[evcc] Loadpoint %s is charging.', loadpoint)
 
     def __reset_loadpoint_status(self):
         """ Reset the loadpoint status """
-        for topic in self.list_topics_loadpoint:
-            self.evcc_loadpoint_status[topic] = False
-
-    def handle_status_messages(self, message):
+        with self.loadpoint_lock:
+            for loadpoint in self.evcc_loadpoint_status:
+                self.evcc_loadpoint_status[loadpoint] = False
+            self.num_loadpoints_charging = 0
+            # Without evcc, there is no expected charging anymore
+            self.evcc_loadpoint_power = {}
+        with self.overlay_lock:
+            self.evcc_loadpoint_plan = {}
+            self.overlay_intervals = {}
+            self.overlay_array = np.zeros((0, 3))
+
+    def handle_status_messages(self, message, loadpoint=None): # pylint: disable=unused-argument
         """ Handle incoming status messages from the MQTT broker """
         if message.payload == b'online':
             self.set_evcc_online(True)
         elif message.payload == b'offline':
             self.set_evcc_online(False)
 
-    def handle_charging_message(self, message):
+    def handle_charging_message(self, message, loadpoint:str):
         """ Handle incoming charging messages from the MQTT broker """
-        if re.match(b'true', message.payload, re.IGNORECASE):
-            self.__store_loadpoint_status(message.topic, True)
-        elif re.match(b'false', message.payload, re.IGNORECASE):
-            self.__store_loadpoint_status(message.topic, False)
+        payload = message.payload.strip().lower()
+        if payload == b'true':
+            self.__store_loadpoint_status(loadpoint, True)
+        elif payload == b'false':
+            self.__store_loadpoint_status(loadpoint, False)
 
         self.evaluate_charging_status()
 
-    def evaluate_charging_status(self):
-        """ Go through the loadpoints and check if one is charging """
-        for _, is_charging in self.evcc_loadpoint_status.items():
-            if is_charging is True:
-                self.set_evcc_charging(True)
+    def handle_charge_power_message(self, message, loadpoint:str):
+        """ Handle incoming chargePower messages in W """
+        try:
+            power = float(message.payload)
+        except ValueError:
+            logger.warning('[evcc] Invalid chargePower %s on %s', message.payload, loadpoint)
+            return
+        with self.loadpoint_lock:
+            self.evcc_loadpoint_power[loadpoint] = power
+        self.__update_overlay(loadpoint)
+
+    @staticmethod
+    def __parse_time(payload:bytes) -> float:
+        """ Parse a RFC3339 timestamp from evcc, returns 0 if not set """
+        value = payload.decode('utf-8').strip()
+        if not value:
+            return 0
+        # fromisoformat does not support Z before python 3.11
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        try:
+            timestamp = datetime.datetime.fromisoformat(value).timestamp()
+        except (ValueError, OverflowError, OSError):
+            return 0
+        # evcc sends 0001-01-01T00:00:00Z for "no plan"
+        return max(timestamp, 0)
+
+    def handle_plan_message(self, message, loadpoint:str):
+        """ Handle incoming plan related messages:
+            chargeRemainingEnergy (Wh), planEnergy (kWh),
+            planProjectedStart, planProjectedEnd, effectivePlanTime (RFC3339)
+        """
+        leaf = message.topic.rpartition('/')[2]
+        try:
+            if leaf == 'chargeRemainingEnergy':
+                key, value = 'remaining_energy', float(message.payload or 0)
+            elif leaf == 'planEnergy':
+                key, value = 'plan_energy', float(message.payload or 0) * 1000
+            elif leaf == 'planProjectedStart':
+                key, value = 'projected_start', self.__parse_time(message.payload)
+            elif leaf == 'planProjectedEnd':
+                key, value = 'projected_end', self.__parse_time(message.payload)
+            elif leaf == 'effectivePlanTime':
+                key, value = 'plan_time', self.__parse_time(message.payload)
+            else:
                 return
-        self.set_evcc_charging(False)
+        except ValueError:
+            logger.warning('[evcc] Invalid %s %s on %s', leaf, message.payload, loadpoint)
+            return
+        with self.overlay_lock:
+            self.evcc_loadpoint_plan.setdefault(loadpoint, {})[key] = value
+        self.__update_overlay(loadpoint)
+
+    def __update_overlay(self, loadpoint:str):
+        """ Recalculate the expected charging intervals of a single loadpoint.
+            Called on incoming messages, so the evaluation only has to
+            clip the intervals to its time and map them onto its slots.
+        """
+        with self.loadpoint_lock:
+            power = self.evcc_loadpoint_power.get(loadpoint, 0)
+        with self.overlay_lock:
+            plan = dict(self.evcc_loadpoint_plan.get(loadpoint, {}))
+        intervals = self.__expected_intervals(plan, power, time.time())
+
+        with self.overlay_lock:
+            self.overlay_intervals[loadpoint] = intervals
+            rows = [
+                interval for loadpoint_intervals in self.overlay_intervals.values()
+                for interval in loadpoint_intervals
+            ]
+            self.overlay_array = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        logger.debug('[evcc] Expected charging of loadpoint %s: %s', loadpoint, intervals)
+
+    def __expected_intervals(self, plan:dict, power:float, now:float) -> list:
+        """ Expected charging intervals (start, end, power in W) of a
+            loadpoint from its plan and current charge power, beginning at now
+        """
+        energy = plan.get('remaining_energy', 0) or plan.get('plan_energy', 0)
+        intervals = []
+
+        plan_start = plan.get('projected_start', 0)
+        plan_end = plan.get('projected_end', 0)
+        plan_time = plan.get('plan_time', 0)
+        if plan_end <= now and plan_time > now and energy > 0:
+            # Only the target time is known, assume charging right before it
+            plan_end = plan_time
+            plan_start = plan_end - energy / self.plan_charge_power * 3600
+        has_plan = plan_end > now and plan_end > plan_start > 0 and energy > 0
+        if has_plan:
+            start = max(plan_start, now)
+            intervals.append((start, plan_end, energy / (plan_end - start) * 3600))
+        if power > 0 and (not has_plan or plan_start > now):
+            # Charging outside of a plan, assume it continues until the remaining
+            #   energy is charged or for the rest of the hour
+            if energy > 0 and not has_plan:
+                end = now + energy / power * 3600
+            else:
+                end = now + 3600 - now % 3600
+            if has_plan:
+                end = min(end, plan_start)
+            intervals.append((now, end, power))
+        return intervals
+
+    def get_charge_power(self) -> float:
+        """ Current charge power in W of all charging loadpoints,
+            called by the main loop while the MQTT thread updates the loadpoints
+        """
+        with self.loadpoint_lock:
+            status = dict(self.evcc_loadpoint_status)
+            power = dict(self.evcc_loadpoint_power)
+        return sum(
+            power.get(loadpoint, 0) for loadpoint, is_charging in status.items() if is_charging
+        )
+
+    def get_consumption_overlay(self, start:float, slots:int, slot_seconds:int=3600,
+                                now:float=None) -> np.ndarray:
+        """ Expected energy in Wh used by the loadpoints for each slot,
+            beginning at the timestamp start. Charging is expected from now,
+            the time of the evaluation, so the first slot only contains the
+            energy of its remaining time.
+        """
+        if now is None:
+            now = time.time()
+        with self.overlay_lock:
+            interval_array = self.overlay_array
+
+        overlay = np.zeros(slots)
+        if len(interval_array) > 0:
+            # Charging before the evaluation has already happened
+            interval_start = np.maximum(interval_array[:, 0], now)
+            slot_start = start + np.arange(slots) * slot_seconds
+            slot_end = slot_start + slot_seconds
+            # Seconds of each interval (rows) falling into each slot (columns)
+            overlap = np.minimum(interval_array[:, 1, None], slot_end) - \
+                np.maximum(interval_start[:, None], slot_start)
+            overlap = np.clip(overlap, 0, None)
+            overlay = (overlap * interval_array[:, 2, None]).sum(axis=0) / 3600
+        return overlay
+
+    def evaluate_charging_status(self):
+        """ Check if one of the loadpoints is charging """
+        self.set_evcc_charging(self.num_loadpoints_charging > 0)
+
+    def __resolve_wildcard(self, topic:str) -> tuple:
+        """ (handler, loadpoint) of the first message of a loadpoint matched
+            by a wildcard subscription, None if no handler exists
+        """
+        for topic_filter in self.custom_wildcard_topics:
+            if mqtt.topic_matches_sub(topic_filter, topic):
+                # every matching topic is a loadpoint of its own
+                return self.handle_charging_message, topic
+        loadpoint, leaf = self.__split_loadpoint_topic(topic)
+        handler = self.loadpoint_handlers.get(leaf)
+        if handler is None:
+            return None
+        return handler, loadpoint
 
     def _handle_message(self, client, userdata, message): # pylint: disable=unused-argument
         """ Message dispatching function """
         logger.debug('[evcc] Received message on %s', message.topic)
-        if message.topic == self.config['status_topic']:
-            self.handle_status_messages(message)
-        # Check if message.topic is in self.list_topics_loadpoint
-        elif message.topic in self.list_topics_loadpoint:
-            self.handle_charging_message(message)
-        else:
-            logger.warning('[evcc] No callback registered for %s', message.topic)
+        entry = self.topic_handlers.get(message.topic)
+        if entry is None:
+            entry = self.__resolve_wildcard(message.topic)
+            if entry is None:
+                logger.warning('[evcc] No callback registered for %s', message.topic)
+                return
+            self.topic_handlers[message.topic] = entry
+        handler, loadpoint = entry
+        handler(message, loadpoint)
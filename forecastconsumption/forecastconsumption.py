@@ -1,10 +1,13 @@
 #%%
+import csv
 import datetime
+import time
 import math
+import statistics
 import logging
 import pytz
-import pandas as pd
 import numpy as np
+from forecastseries.forecastseries import ForecastSeries
 
 
 logger = logging.getLogger("__main__")
@@ -24,8 +27,11 @@ class ForecastConsumption:
         forecasting will be done by considering month, weekday and hour
     """
 
-    def __init__(self, loadprofile, timezone, annual_consumption=0 , datafile=None, ) -> None:
+    def __init__(self, loadprofile, timezone, annual_consumption=0 , datafile=None,
+                 online_model=None) -> None:
         self.path_to_load_profile=loadprofile
+        # optional OnlineConsumptionModel, blended with the load profile
+        self.online_model=online_model
         if datafile:
             self.create_loadprofile(datafile,self.path_to_load_profile)
         self.load_loadprofile()
@@ -39,7 +45,7 @@ class ForecastConsumption:
                     )
         else:
             self.scaling_factor=1
-            annual_consumption_load_profile= self.dataframe['energy'].sum()*8760/2016/1000
+            annual_consumption_load_profile= np.nansum(self.profile_energy)*8760/2016/1000
             logger.info(
                 "[FC Cons] The annual consumption of the applied load profile is %.2f kWh ",
                  annual_consumption_load_profile
@@ -51,7 +57,7 @@ class ForecastConsumption:
         self.timezone=timezone
 
     def calculate_scaling_factor(self, annual_consumption):
-        annual_consumption_load_profile= self.dataframe['energy'].sum()*8760/2016/1000
+        annual_consumption_load_profile= np.nansum(self.profile_energy)*8760/2016/1000
         logger.info(
             "[FC Cons] The annual consumption of the applied load profile is %s kWh ",
             annual_consumption_load_profile
@@ -60,6 +66,9 @@ class ForecastConsumption:
         return scaling_factor
 
     def load_data_file(self, datafile):
+        # pandas takes longer to import than the rest of batcontrol,
+        #   it is only needed to create a load profile from measured data
+        import pandas as pd  # pylint: disable=import-outside-toplevel
         df = pd.read_csv(datafile)
         df['timestamp'] = df['timestamp'].map(
             lambda timestamp: pd.to_datetime(timestamp).astimezone(self.timezone))
@@ -71,27 +80,45 @@ class ForecastConsumption:
         df['energy'] = df['energy']/3600*-1
         return df
 
-    def get_forecast(self, hours):
-        t0 = datetime.datetime.now().astimezone(self.timezone)
-        df = self.dataframe
-        prediction = {}
-
-        for h in range(hours):
-            delta_t = datetime.timedelta(hours=h)
-            t1 = t0+delta_t
-            energy = df.loc[df['hour'] == t1.hour].loc[df['month'] ==
-                                    t1.month].loc[df['weekday'] == t1.weekday()]['energy'].median()
-            if math.isnan(energy):
-                energy = df['energy'].median()
-            prediction[h]=energy*self.scaling_factor
-
-        logger.debug(
-                  '[FC Cons] predicting consumption: %s',
-                   np.array(list(prediction.values())).round(1)
-                )
-        return prediction
+    def get_forecast(self, slots, start=None, step=3600) -> ForecastSeries:
+        """ Forecast the consumption in Wh for the given number of slots,
+            starting with the slot containing start (default: now)
+
+            The hourly values of the load profile are interpolated between
+            the hour centers, so shorter slots follow a smooth profile.
+        """
+        if start is None:
+            start = time.time()
+        start = start - start % step
+        # hourly profile values covering the requested slots, with one hour margin
+        first_hour = start - start % 3600 - 3600
+        num_hours = int(math.ceil((start + slots * step - first_hour) / 3600)) + 1
+        hour_starts = first_hour + np.arange(num_hours) * 3600
+        months = np.empty(num_hours, dtype=int)
+        weekdays = np.empty(num_hours, dtype=int)
+        hours = np.empty(num_hours, dtype=int)
+        for i, hour_start in enumerate(hour_starts):
+            t1 = datetime.datetime.fromtimestamp(hour_start, self.timezone)
+            months[i] = t1.month - 1
+            weekdays[i] = t1.weekday()
+            hours[i] = t1.hour
+        hourly_energy = self.profile_table[months, weekdays, hours] * self.scaling_factor
+        if self.online_model is not None:
+            hourly_energy = self.online_model.blend(weekdays, hours, hourly_energy)
+
+        slot_centers = start + (np.arange(slots) + 0.5) * step
+        prediction = np.interp(slot_centers, hour_starts + 1800, hourly_energy) \
+            * step / 3600
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                      '[FC Cons] predicting consumption: %s',
+                       prediction.round(1)
+                    )
+        return ForecastSeries(start, step, prediction)
 
     def create_loadprofile(self, datafile, path_to_profile='load_profile.csv'):
+        import pandas as pd  # pylint: disable=import-outside-toplevel
         df=self.load_data_file(datafile)
         a=[]
         energy=0
@@ -107,11 +134,37 @@ class ForecastConsumption:
                 )
 
     def load_loadprofile(self):
-        self.dataframe=pd.read_csv(self.path_to_load_profile)
+        """ Read the columns month, weekday, hour and energy of the load profile """
+        keys = []
+        energy = []
+        with open(self.path_to_load_profile, 'r', newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                keys.append((int(float(row['month'])), int(float(row['weekday'])),
+                             int(float(row['hour']))))
+                # profiles created from sparse data have empty values
+                value = (row['energy'] or '').strip()
+                energy.append(float(value) if value else math.nan)
+        self.profile_energy=np.array(energy, dtype=np.float64)
+        self.profile_table=self.__create_profile_table(keys, self.profile_energy)
+
+    @staticmethod
+    def __create_profile_table(keys, energy):
+        """ Median energy by month, weekday and hour as array [12, 7, 24].
+            Missing combinations use the median of the whole profile.
+        """
+        table = np.full((12, 7, 24), np.median(energy[~np.isnan(energy)]))
+        groups = {}
+        for key, value in zip(keys, energy):
+            if not math.isnan(value):
+                groups.setdefault(key, []).append(value)
+        for (month, weekday, hour), values in groups.items():
+            if 1 <= month <= 12 and 0 <= weekday <= 6 and 0 <= hour <= 23:
+                table[month - 1, weekday, hour] = statistics.median(values)
+        return table
 # %%
 if __name__ == '__main__':
     tz=pytz.timezone('Europe/Berlin')
     fc=ForecastConsumption('../config/load_profile.csv',tz)
-    print(fc.get_forecast(25))
+    print(fc.get_forecast(25).to_dict())
 
 # %%
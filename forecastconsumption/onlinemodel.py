@@ -0,0 +1,102 @@
+""" Online consumption model learned from the measured household load
+
+The model keeps the mean load in W for every weekday and hour in an array
+[7, 24], updated by every evaluation with the load measured by the inverter:
+
+- Each measurement is weighted with the seconds since the previous one, so
+  the result does not depend on the evaluation interval.
+- The weight of a bin is limited to memory_weeks hours. Once it is reached,
+  older data decays exponentially and the model follows seasonal changes.
+- Every update is O(1), the table is saved to disk every save_interval
+  seconds with np.savez and loaded again at startup.
+
+blend() mixes the learned values with the static load profile. A bin with
+less than min_weeks hours of data is blended in proportion to its data.
+"""
+import os
+import time
+import datetime
+import logging
+import numpy as np
+
+logger = logging.getLogger('__main__')
+logger.info('[OnlineConsumption] loading module')
+
+MAX_SAMPLE_GAP = 900  # seconds, longer gaps between measurements count as this
+TABLE_SHAPE = (7, 24)  # weekday (0 = Monday), hour
+
+
+class OnlineConsumptionModel:
+    """ Mean household load by weekday and hour, learned online """
+    def __init__(self, path:str, timezone, memory_weeks:float=4, min_weeks:float=2,
+                 save_interval:float=3600):
+        self.path = path
+        self.timezone = timezone
+        # every bin gets one hour of data per week
+        self.max_weight = memory_weeks * 3600
+        self.min_weight = max(min_weeks * 3600, 1)
+        self.save_interval = save_interval
+
+        self.mean_power = np.zeros(TABLE_SHAPE)  # W
+        self.weight = np.zeros(TABLE_SHAPE)  # seconds of data
+        self.last_time = None
+        self.last_save = time.time()
+        self.load()
+
+    def load(self) -> None:
+        """ Load the persisted table, a missing or invalid file starts empty """
+        if not os.path.isfile(self.path):
+            logger.info('[OnlineConsumption] No learned consumption at %s, starting empty',
+                        self.path)
+            return
+        try:
+            with np.load(self.path) as data:
+                mean_power = data['mean_power']
+                weight = data['weight']
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning('[OnlineConsumption] Could not load %s: %s', self.path, e)
+            return
+        if mean_power.shape != TABLE_SHAPE or weight.shape != TABLE_SHAPE:
+            logger.warning('[OnlineConsumption] Ignoring %s with unexpected shape', self.path)
+            return
+        self.mean_power = mean_power.astype(np.float64)
+        self.weight = np.minimum(weight.astype(np.float64), self.max_weight)
+        logger.info('[OnlineConsumption] Loaded %.0f hours of learned consumption from %s',
+                    self.weight.sum() / 3600, self.path)
+
+    def save(self) -> None:
+        """ Write the table atomically, a crash never leaves a partial file """
+        temp_path = self.path + '.tmp.npz'
+        try:
+            np.savez(temp_path, mean_power=self.mean_power, weight=self.weight)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.error('[OnlineConsumption] Could not save %s: %s', self.path, e)
+            return
+        self.last_save = time.time()
+
+    def update(self, timestamp:float, load_power:float) -> None:
+        """ Add the load in W measured at timestamp """
+        if self.last_time is None or timestamp <= self.last_time:
+            self.last_time = timestamp
+            return
+        elapsed = min(timestamp - self.last_time, MAX_SAMPLE_GAP)
+        self.last_time = timestamp
+
+        local_time = datetime.datetime.fromtimestamp(timestamp, self.timezone)
+        index = (local_time.weekday(), local_time.hour)
+        weight = min(self.weight[index] + elapsed, self.max_weight)
+        self.mean_power[index] += elapsed / weight * (load_power - self.mean_power[index])
+        self.weight[index] = weight
+
+        if timestamp - self.last_save >= self.save_interval:
+            self.save()
+
+    def blend(self, weekdays:np.ndarray, hours:np.ndarray, profile_energy:np.ndarray) -> np.ndarray:
+        """ Hourly energy in Wh, blended from the learned values and the static profile """
+        shares = np.minimum(self.weight[weekdays, hours] / self.min_weight, 1)
+        return shares * self.mean_power[weekdays, hours] + (1 - shares) * profile_energy
+
+    def shutdown(self) -> None:
+        """ Persist the learned values """
+        self.save()
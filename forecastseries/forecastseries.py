@@ -0,0 +1,204 @@
+""" Timestamp anchored forecast series
+
+A ForecastSeries holds equally spaced values (prices, energy per slot)
+starting at an absolute epoch timestamp. Value i covers the slot
+[start + i * step, start + (i + 1) * step).
+
+Alignment and horizon intersection only compute indices and return views
+on the same array, no values are copied.
+
+resample() converts between slot lengths, e.g. hourly tariffs to 15 minute
+slots. Prices are averaged or repeated (RESAMPLE_MEAN), energies are summed
+or split evenly (RESAMPLE_SUM).
+
+from_file() and to_npz() read and write historical series for replays.
+"""
+import csv
+import datetime
+import numpy as np
+
+DEFAULT_STEP = 3600
+RESAMPLE_MEAN = 'mean'
+RESAMPLE_SUM = 'sum'
+
+
+class ForecastSeries:
+    """ Equally spaced float64 values anchored at an epoch timestamp """
+    __slots__ = ('start', 'step', 'values')
+
+    def __init__(self, start:float, step:float, values):
+        self.start = float(start)
+        self.step = float(step)
+        self.values = np.asarray(values, dtype=np.float64)
+
+    @classmethod
+    def from_timestamps(cls, timestamps, values, step:float=None) -> 'ForecastSeries':
+        """ Create a series from slot start timestamps, e.g. parsed provider data.
+
+            The timestamps are sorted. Without step, the smallest distance
+            between timestamps is used, which detects hourly and 15 minute data.
+            The series ends at the first missing slot, so a gap in the provider
+            data never shifts later values.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        if len(timestamps) == 0:
+            return cls(0, step or DEFAULT_STEP, values)
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+        values = values[order]
+        if step is None:
+            distances = np.diff(timestamps)
+            distances = distances[distances > 0]
+            step = distances.min() if len(distances) > 0 else DEFAULT_STEP
+        gaps = np.flatnonzero(np.diff(timestamps) != step)
+        if len(gaps) > 0:
+            values = values[:gaps[0] + 1]
+        return cls(timestamps[0], step, values)
+
+    @classmethod
+    def from_file(cls, path:str, step:float=None) -> 'ForecastSeries':
+        """ Load a series from a CSV or NPZ file, loaded once into memory.
+
+            CSV: columns timestamp (epoch seconds or ISO 8601) and value
+            NPZ: arrays timestamps and values, as written by to_npz()
+            Unlike from_timestamps, missing slots are interpolated, so
+            years of historical data with a few gaps stay usable.
+        """
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                timestamps = np.asarray(data['timestamps'], dtype=np.float64)
+                values = np.asarray(data['values'], dtype=np.float64)
+        else:
+            timestamps, values = _read_csv(path)
+        if len(timestamps) == 0:
+            raise RuntimeError(f'[ForecastSeries] No values in {path}')
+        timestamps, unique = np.unique(timestamps, return_index=True)
+        values = values[unique]
+        if step is None:
+            distances = np.diff(timestamps)
+            step = distances.min() if len(distances) > 0 else DEFAULT_STEP
+        slots = np.round((timestamps - timestamps[0]) / step)
+        values = np.interp(np.arange(slots[-1] + 1), slots, values)
+        return cls(timestamps[0], step, values)
+
+    def to_npz(self, path:str) -> None:
+        """ Write the series in the NPZ format of from_file() """
+        timestamps = self.start + np.arange(len(self.values)) * self.step
+        np.savez(path, timestamps=timestamps, values=self.values)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __repr__(self) -> str:
+        return f'ForecastSeries(start={self.start:.0f}, step={self.step:.0f}, len={len(self)})'
+
+    @property
+    def end(self) -> float:
+        """ End of the last slot """
+        return self.start + len(self.values) * self.step
+
+    def index_of(self, timestamp:float) -> int:
+        """ Index of the slot containing timestamp, may be negative or beyond the end """
+        return int((timestamp - self.start) // self.step)
+
+    def slot_start(self, timestamp:float) -> float:
+        """ Start of the slot containing timestamp """
+        return self.start + self.index_of(timestamp) * self.step
+
+    def align(self, timestamp:float, length:int=None) -> 'ForecastSeries':
+        """ View starting with the slot containing timestamp, optionally limited to length
+
+            Raises RuntimeError if the series does not cover timestamp.
+        """
+        index = self.index_of(timestamp)
+        if index < 0 or index >= len(self.values):
+            raise RuntimeError(
+                f'[ForecastSeries] {self!r} does not cover timestamp {timestamp:.0f}'
+            )
+        stop = len(self.values) if length is None else min(index + length, len(self.values))
+        return ForecastSeries(self.start + index * self.step, self.step, self.values[index:stop])
+
+    def resample(self, step:float, method:str=RESAMPLE_MEAN) -> 'ForecastSeries':
+        """ Series with another slot length, which must be a multiple or a divisor
+            of the current one.
+
+            Downsampling aligns the new slots to multiples of step. A partial
+            first slot uses the available values, a partial last slot is dropped.
+        """
+        step = float(step)
+        if step == self.step:
+            return self
+        if method not in (RESAMPLE_MEAN, RESAMPLE_SUM):
+            raise ValueError(f'[ForecastSeries] Unknown resample method {method}')
+
+        if step < self.step:
+            factor = self.step / step
+            if factor != int(factor):
+                raise RuntimeError(
+                    f'[ForecastSeries] Cannot resample step {self.step:.0f} to {step:.0f}')
+            factor = int(factor)
+            values = np.repeat(self.values, factor)
+            if method == RESAMPLE_SUM:
+                values /= factor
+            return ForecastSeries(self.start, step, values)
+
+        factor = step / self.step
+        if factor != int(factor):
+            raise RuntimeError(
+                f'[ForecastSeries] Cannot resample step {self.step:.0f} to {step:.0f}')
+        factor = int(factor)
+        new_start = self.start - self.start % step
+        # pad the partial first slot with NaN, they are ignored by nanmean/nansum
+        padding = int(round((self.start - new_start) / self.step))
+        count = (padding + len(self.values)) // factor
+        if count == 0:
+            return ForecastSeries(new_start, step, np.zeros(0))
+        padded = np.full(count * factor, np.nan)
+        padded[padding:] = self.values[:count * factor - padding]
+        blocks = padded.reshape(count, factor)
+        if method == RESAMPLE_SUM:
+            values = np.nansum(blocks, axis=1)
+        else:
+            values = np.nanmean(blocks, axis=1)
+        return ForecastSeries(new_start, step, values)
+
+    def to_dict(self) -> dict:
+        """ Values by relative slot, as returned by the providers before """
+        return dict(enumerate(self.values.tolist()))
+
+
+def _read_csv(path:str) -> tuple:
+    """ timestamps and values of a CSV file with a header line """
+    timestamps = []
+    values = []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            timestamp = row['timestamp'].strip()
+            try:
+                timestamps.append(float(timestamp))
+            except ValueError:
+                timestamps.append(datetime.datetime.fromisoformat(timestamp).timestamp())
+            values.append(float(row['value']))
+    return np.array(timestamps, dtype=np.float64), np.array(values, dtype=np.float64)
+
+
+def intersect(*series:ForecastSeries) -> tuple:
+    """ Views of all series on their common time range
+
+        All series need the same step and slot grid. Raises RuntimeError if
+        they do not overlap.
+    """
+    step = series[0].step
+    for item in series:
+        if item.step != step:
+            raise RuntimeError('[ForecastSeries] Cannot intersect series with different steps')
+    start = max(item.start for item in series)
+    end = min(item.end for item in series)
+    if end <= start:
+        raise RuntimeError('[ForecastSeries] Series do not overlap')
+    length = int(round((end - start) / step))
+    return tuple(item.align(start, length) for item in series)
@@ -0,0 +1,154 @@
+""" Offline clear-sky PV model
+
+Estimates the production of all installations without any network access:
+- solar position from the time and location (Spencer / NOAA equations)
+- clear-sky irradiance with the Meinel model for the direct beam
+- plane of array irradiance from declination and azimuth of each installation
+- direct beam blocked while the sun is below the configured horizon
+
+The estimate is the production on a clear day, multiplied with
+clearsky_factor. A factor below 1 approximates the average (climatological)
+cloudiness, e.g. 0.6.
+
+All installations and time steps are computed in one set of array
+operations, 48 hours take well below a millisecond.
+"""
+import time
+import logging
+import datetime
+import numpy as np
+from forecastseries.forecastseries import ForecastSeries
+from .forecastsolar_interface import ForecastSolarInterface
+
+logger = logging.getLogger('__main__')
+logger.info('[ClearSky] loading module')
+
+SOLAR_CONSTANT = 1353  # W/m2, as used by the Meinel model
+DIFFUSE_SHARE = 0.1  # clear-sky diffuse irradiance relative to the direct beam
+ALBEDO = 0.2
+PERFORMANCE_RATIO = 0.85  # inverter, cable and temperature losses
+SAMPLE_SECONDS = 900  # irradiance is sampled in the middle of each 15 minutes
+HORIZON_HOURS = 48
+
+
+class ClearSky(ForecastSolarInterface):
+    """ Local clear-sky model, needs no network access """
+    def __init__(self, pvinstallations, timezone, api_delay=0, slot_seconds=3600,
+                 clearsky_factor=1.0) -> None:
+        self.pvinstallations = pvinstallations
+        self.timezone = timezone
+        self.slot_seconds = slot_seconds
+        self.clearsky_factor = clearsky_factor
+
+        # installation parameters as column vectors [installations, 1]
+        self.latitude = self.__column(pvinstallations, 'lat')
+        self.longitude = self.__column(pvinstallations, 'lon')
+        self.tilt = self.__column(pvinstallations, 'declination')
+        self.azimuth = self.__column(pvinstallations, 'azimuth')  # 0 = south, 90 = west
+        self.kwp = self.__column(pvinstallations, 'kWp')
+        self.horizons = [
+            self.__parse_horizon(unit.get('horizon')) for unit in pvinstallations
+        ]
+
+    @staticmethod
+    def __column(pvinstallations, key) -> np.ndarray:
+        return np.array(
+            [float(unit[key]) for unit in pvinstallations], dtype=np.float64
+        ).reshape(-1, 1)
+
+    @staticmethod
+    def __parse_horizon(horizon) -> np.ndarray:
+        """ forecast.solar format: elevations in degrees, evenly distributed
+            clockwise starting in the north
+        """
+        if horizon is None:
+            return None
+        try:
+            values = np.array([float(value) for value in str(horizon).split(',')])
+        except ValueError:
+            logger.warning('[ClearSky] Ignoring invalid horizon %s', horizon)
+            return None
+        if len(values) == 0 or not np.any(values > 0):
+            return None
+        return values
+
+    def get_forecast(self) -> ForecastSeries:
+        """ Clear-sky production in Wh per slot for the next 48 hours """
+        now = time.time()
+        current_slot = now - now % self.slot_seconds
+        num_slots = int(HORIZON_HOURS * 3600 / self.slot_seconds)
+        samples_per_slot = max(1, int(self.slot_seconds // SAMPLE_SECONDS))
+        sample_seconds = self.slot_seconds / samples_per_slot
+        times = current_slot + (np.arange(num_slots * samples_per_slot) + 0.5) * sample_seconds
+
+        power = self.get_power(times)
+        # mean power of the samples in each slot times the slot length
+        energy = power.sum(axis=0).reshape(num_slots, samples_per_slot).mean(axis=1) \
+            * self.slot_seconds / 3600
+        return ForecastSeries(current_slot, self.slot_seconds, energy)
+
+    def get_power(self, timestamps:np.ndarray) -> np.ndarray:
+        """ Clear-sky power in W of each installation [installations, timestamps] """
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        first = datetime.datetime.fromtimestamp(timestamps[0], datetime.timezone.utc)
+        year_start = datetime.datetime(first.year, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+        days = (timestamps - year_start) / 86400
+        hours_utc = (timestamps % 86400) / 3600
+
+        # Spencer / NOAA: fractional year, equation of time and declination
+        gamma = 2 * np.pi / 365 * (days - 0.5)
+        equation_of_time = 229.18 * (
+            0.000075 + 0.001868 * np.cos(gamma) - 0.032077 * np.sin(gamma)
+            - 0.014615 * np.cos(2 * gamma) - 0.040849 * np.sin(2 * gamma))
+        declination = (
+            0.006918 - 0.399912 * np.cos(gamma) + 0.070257 * np.sin(gamma)
+            - 0.006758 * np.cos(2 * gamma) + 0.000907 * np.sin(2 * gamma)
+            - 0.002697 * np.cos(3 * gamma) + 0.00148 * np.sin(3 * gamma))
+
+        latitude = np.radians(self.latitude)
+        solar_time = hours_utc * 60 + equation_of_time + 4 * self.longitude  # minutes
+        hour_angle = np.radians(solar_time / 4 - 180)
+        cos_zenith = np.sin(latitude) * np.sin(declination) \
+            + np.cos(latitude) * np.cos(declination) * np.cos(hour_angle)
+        cos_zenith = np.clip(cos_zenith, -1, 1)
+        sin_zenith = np.sqrt(1 - cos_zenith ** 2)
+        # azimuth measured from south, west positive, like the installation azimuth
+        sun_azimuth = np.arctan2(
+            np.sin(hour_angle),
+            np.cos(hour_angle) * np.sin(latitude) - np.tan(declination) * np.cos(latitude))
+
+        daylight = cos_zenith > 0.01
+        safe_cos_zenith = np.where(daylight, cos_zenith, 1)
+        # Kasten air mass and Meinel direct normal irradiance
+        air_mass = 1 / (safe_cos_zenith + 0.50572 * (
+            96.07995 - np.degrees(np.arccos(safe_cos_zenith))) ** -1.6364)
+        direct_normal = np.where(daylight, SOLAR_CONSTANT * 0.7 ** (air_mass ** 0.678), 0)
+        diffuse = DIFFUSE_SHARE * direct_normal
+        global_horizontal = direct_normal * np.maximum(cos_zenith, 0) + diffuse
+
+        tilt = np.radians(self.tilt)
+        cos_incidence = cos_zenith * np.cos(tilt) \
+            + sin_zenith * np.sin(tilt) * np.cos(sun_azimuth - np.radians(self.azimuth))
+        beam = direct_normal * np.maximum(cos_incidence, 0)
+        beam = self.__apply_horizons(beam, cos_zenith, sun_azimuth)
+        plane_of_array = beam \
+            + diffuse * (1 + np.cos(tilt)) / 2 \
+            + global_horizontal * ALBEDO * (1 - np.cos(tilt)) / 2
+
+        return plane_of_array / 1000 * self.kwp * 1000 \
+            * PERFORMANCE_RATIO * self.clearsky_factor
+
+    def __apply_horizons(self, beam, cos_zenith, sun_azimuth) -> np.ndarray:
+        """ No direct beam while the sun is below the horizon of an installation """
+        if all(horizon is None for horizon in self.horizons):
+            return beam
+        elevation = 90 - np.degrees(np.arccos(cos_zenith))
+        # horizon values start in the north and go clockwise
+        azimuth_north = (np.degrees(sun_azimuth) + 180) % 360
+        beam = beam.copy()
+        for i, horizon in enumerate(self.horizons):
+            if horizon is None:
+                continue
+            sector = (azimuth_north[i] / (360 / len(horizon))).astype(int) % len(horizon)
+            beam[i] = np.where(elevation[i] > horizon[sector], beam[i], 0)
+        return beam
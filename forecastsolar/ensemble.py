@@ -0,0 +1,137 @@
+""" Ensemble of several solar forecast providers
+
+All providers are asked concurrently. The evaluation waits at most timeout
+seconds, a provider which is slower keeps running in the background and its
+result is used by the next evaluation. Until then, and if a provider fails,
+its last forecast is used as long as it covers the current slot.
+
+The forecasts are merged slot by slot with a weighted average. The weights
+are the inverse of the exponentially smoothed squared error of each
+provider against the measured PV power (record_pv_power), so providers
+which matched the site well in the last days dominate.
+"""
+import math
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+import numpy as np
+from forecastseries.forecastseries import ForecastSeries, RESAMPLE_SUM
+from .forecastsolar_interface import ForecastSolarInterface
+
+logger = logging.getLogger('__main__')
+logger.info('[Ensemble] loading module')
+
+DEFAULT_TIMEOUT = 10  # seconds
+ERROR_FLOOR = 100  # W, limits the weight of a provider with a tiny error
+MIN_POWER = 50  # W, no error tracking while all values are below, e.g. at night
+MAX_SAMPLE_GAP = 900  # seconds
+
+
+class EnsembleSolar(ForecastSolarInterface):
+    """ Weighted average of several solar forecast providers """
+    def __init__(self, providers:dict, slot_seconds=3600, timeout:float=DEFAULT_TIMEOUT,
+                 error_smoothing_hours:float=24) -> None:
+        if not providers:
+            raise RuntimeError('[Ensemble] At least one provider is required')
+        self.providers = providers
+        self.names = list(providers.keys())
+        self.slot_seconds = slot_seconds
+        self.timeout = timeout
+        self.error_smoothing_seconds = error_smoothing_hours * 3600
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(providers), thread_name_prefix='ensemble')
+        # provider name -> running request
+        self.pending = {}
+        # provider name -> last forecast
+        self.forecasts = {}
+        # smoothed squared error in W^2 per provider, NaN until tracked
+        self.squared_errors = np.full(len(self.names), np.nan)
+        self.last_measurement = None
+
+    @property
+    def weights(self) -> np.ndarray:
+        """ Normalized weights in provider order, providers without
+            tracked error get the mean error of the others
+        """
+        errors = self.squared_errors
+        unknown = np.isnan(errors)
+        if unknown.any():
+            errors = np.where(unknown, 0 if unknown.all() else np.nanmean(errors), errors)
+        weights = 1 / (errors + ERROR_FLOOR ** 2)
+        return weights / weights.sum()
+
+    def get_forecast(self) -> ForecastSeries:
+        """ Weighted average of all available forecasts in slots of slot_seconds """
+        for name in self.names:
+            if name not in self.pending:
+                self.pending[name] = self.executor.submit(self.providers[name].get_forecast)
+        wait(self.pending.values(), timeout=self.timeout)
+
+        for name in self.names:
+            future = self.pending[name]
+            if not future.done():
+                logger.warning('[Ensemble] %s did not answer within %d seconds',
+                               name, self.timeout)
+                continue
+            del self.pending[name]
+            try:
+                self.forecasts[name] = future.result().resample(
+                    self.slot_seconds, RESAMPLE_SUM)
+            except Exception as e:
+                logger.warning('[Ensemble] %s failed: %s', name, e)
+
+        now = time.time()
+        current_slot = now - now % self.slot_seconds
+        available = []
+        for i, name in enumerate(self.names):
+            forecast = self.forecasts.get(name)
+            if forecast is not None and 0 <= forecast.index_of(now) < len(forecast):
+                available.append((i, forecast.align(now)))
+        if not available:
+            raise RuntimeError('[Ensemble] No forecast of any provider available')
+
+        num_slots = max(len(forecast) for _, forecast in available)
+        values = np.zeros((len(available), num_slots))
+        covered = np.zeros((len(available), num_slots), dtype=bool)
+        for row, (_, forecast) in enumerate(available):
+            values[row, :len(forecast)] = forecast.values
+            covered[row, :len(forecast)] = True
+        weights = self.weights[[i for i, _ in available]]
+        # slots beyond the horizon of a provider are averaged from the others
+        prediction = (weights @ values) / (weights @ covered)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('[Ensemble] Weights %s', ', '.join(
+                f'{self.names[i]}: {self.weights[i]:.2f}' for i, _ in available))
+        return ForecastSeries(current_slot, self.slot_seconds, prediction)
+
+    def record_pv_power(self, timestamp:float, power:float) -> None:
+        """ Track the error of every provider against the measured PV power """
+        for provider in self.providers.values():
+            provider.record_pv_power(timestamp, power)
+        if self.last_measurement is None:
+            self.last_measurement = timestamp
+            return
+        elapsed = min(timestamp - self.last_measurement, MAX_SAMPLE_GAP)
+        if elapsed <= 0:
+            return
+        self.last_measurement = timestamp
+
+        forecast_power = np.full(len(self.names), np.nan)
+        for i, name in enumerate(self.names):
+            forecast = self.forecasts.get(name)
+            if forecast is None:
+                continue
+            index = forecast.index_of(timestamp)
+            if 0 <= index < len(forecast):
+                forecast_power[i] = forecast[index] * 3600 / forecast.step
+        known = ~np.isnan(forecast_power)
+        if not known.any() or max(np.nanmax(forecast_power), power) < MIN_POWER:
+            return
+        squared_errors = (forecast_power - power) ** 2
+        # the first error of a provider is taken as is
+        first = known & np.isnan(self.squared_errors)
+        self.squared_errors[first] = squared_errors[first]
+        alpha = 1 - math.exp(-elapsed / self.error_smoothing_seconds)
+        self.squared_errors[known] += alpha * (
+            squared_errors[known] - self.squared_errors[known])
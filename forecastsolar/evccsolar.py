@@ -0,0 +1,91 @@
+""" Solar forecast from the evcc API
+
+evcc publishes its own solar forecast (e.g. from forecast.solar, Solcast or
+open-meteo) at /api/tariff/solar as rates with mean power in W:
+    {"result": {"rates": [
+        {"start": "2024-06-20T08:00:00+02:00", "end": "2024-06-20T09:00:00+02:00",
+         "value": 3500.0}, ...
+    ]}}
+The forecast covers the whole site, the pv installations are not used.
+"""
+import time
+import datetime
+import logging
+import numpy as np
+from metrics import metrics
+from httpclient.httpclient import HttpClient, NOT_MODIFIED
+from forecastseries.forecastseries import ForecastSeries
+from .forecastsolar_interface import ForecastSolarInterface
+
+logger = logging.getLogger('__main__')
+logger.info('[EvccSolar] loading module')
+
+
+class EvccSolar(ForecastSolarInterface):
+    """ Provider to get the solar forecast of an evcc instance """
+    def __init__(self, pvinstallations, timezone, api_delay=0, slot_seconds=3600,
+                 url=None, timeout=30, min_time_between_api_calls=300) -> None:
+        if not url:
+            raise RuntimeError('[EvccSolar] url of the evcc solar forecast is required')
+        self.timezone = timezone
+        self.slot_seconds = slot_seconds
+        self.url = url
+        self.client = HttpClient('evccsolar', read_timeout=timeout)
+        self.min_time_between_api_calls = min_time_between_api_calls
+        # rate boundaries and cumulative energy in Wh
+        self.times = np.zeros(0)
+        self.cumulative_energy = np.zeros(0)
+        self.last_update = 0
+
+    def get_forecast(self) -> ForecastSeries:
+        """ Get forecast from provider in slots of slot_seconds """
+        now = time.time()
+        if now - self.last_update > self.min_time_between_api_calls:
+            try:
+                self.__fetch(now)
+            except Exception as e:
+                logger.error('[EvccSolar] Error getting forecast: %s', e)
+                if len(self.times) == 0:
+                    raise
+                logger.warning('[EvccSolar] Using cached values')
+        else:
+            metrics.PROVIDER_CACHE_HITS.inc(provider='evccsolar')
+
+        current_slot = now - now % self.slot_seconds
+        num_slots = int(np.ceil((self.times[-1] - current_slot) / self.slot_seconds)) \
+            if len(self.times) > 0 else 0
+        if num_slots <= 0:
+            raise RuntimeError('[EvccSolar] No forecast data for the upcoming hours.')
+        slot_edges = current_slot + np.arange(num_slots + 1) * self.slot_seconds
+        prediction = np.diff(np.interp(slot_edges, self.times, self.cumulative_energy))
+        return ForecastSeries(current_slot, self.slot_seconds, prediction)
+
+    def __fetch(self, now:float) -> None:
+        response = self.client.get(self.url, conditional=len(self.times) > 0)
+        if response.status_code == NOT_MODIFIED:
+            # the parsed forecast is still up to date
+            self.last_update = now
+            return
+        if response.status_code != 200:
+            raise RuntimeError(f'[EvccSolar] API returned {response}')
+        data = response.json()
+        # evcc before 0.203 wraps the response in "result"
+        rates = data.get('result', data)['rates']
+        if not rates:
+            raise RuntimeError('[EvccSolar] API returned no rates')
+        starts = np.array([
+            datetime.datetime.fromisoformat(rate['start']).timestamp() for rate in rates])
+        ends = np.array([
+            datetime.datetime.fromisoformat(rate['end']).timestamp() for rate in rates])
+        power = np.array([rate.get('value', rate.get('price', 0)) for rate in rates],
+                         dtype=np.float64)
+        order = np.argsort(starts)
+        starts, ends, power = starts[order], ends[order], power[order]
+        # rates are contiguous, a gap ends the forecast
+        gaps = np.flatnonzero(starts[1:] != ends[:-1])
+        if len(gaps) > 0:
+            starts, ends, power = starts[:gaps[0] + 1], ends[:gaps[0] + 1], power[:gaps[0] + 1]
+        energies = power * (ends - starts) / 3600
+        self.times = np.concatenate((starts[:1], ends))
+        self.cumulative_energy = np.concatenate(([0], np.cumsum(energies)))
+        self.last_update = now
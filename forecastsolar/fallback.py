@@ -0,0 +1,34 @@
+""" Solar provider with an automatic fallback
+
+If the primary provider raises (no data, network down, rate limited without
+cache), the forecast of the fallback provider is used for this evaluation.
+The primary provider is asked again on the next evaluation.
+"""
+import logging
+from forecastseries.forecastseries import ForecastSeries
+from .forecastsolar_interface import ForecastSolarInterface
+
+logger = logging.getLogger('__main__')
+
+
+class FallbackSolar(ForecastSolarInterface):
+    """ Use the fallback provider if the primary provider fails """
+    def __init__(self, primary:ForecastSolarInterface, fallback:ForecastSolarInterface) -> None:
+        self.primary = primary
+        self.fallback = fallback
+
+    def get_forecast(self) -> ForecastSeries:
+        try:
+            return self.primary.get_forecast()
+        except Exception as e:
+            logger.warning(
+                '[ForecastSolar] %s failed, using %s as fallback: %s',
+                type(self.primary).__name__,
+                type(self.fallback).__name__,
+                e
+            )
+            return self.fallback.get_forecast()
+
+    def record_pv_power(self, timestamp:float, power:float) -> None:
+        self.primary.record_pv_power(timestamp, power)
+        self.fallback.record_pv_power(timestamp, power)
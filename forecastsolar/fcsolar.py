@@ -7,33 +7,59 @@ See https://forecast.solar/ for more information
 import datetime
 import random
 import time
-import math
 import json
 import logging
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from metrics import metrics
+from forecastseries.forecastseries import ForecastSeries
+from httpclient.httpclient import HttpClient, NOT_MODIFIED
 from .forecastsolar_interface import ForecastSolarInterface
+from .requestbudget import RequestBudget
 
 logger = logging.getLogger('__main__')
 logger.info('[FCSolar] loading module')
 
+# Parallel requests for sites with several PV installations
+MAX_WORKERS = 4
+# Requests per hour of the forecast.solar free tier, updated from the response headers
+DEFAULT_RATE_LIMIT = 12
+# No refresh at night if the cached forecast covers at least the next 12 hours
+NIGHT_MIN_HORIZON = 12 * 3600
+DEFAULT_URL = 'https://api.forecast.solar/'
+
 class FCSolar(ForecastSolarInterface):
     """ Provider to get data from https://forecast.solar/ """
     def __init__(self, pvinstallations, timezone,
-                 delay_evaluation_by_seconds) -> None:
+                 delay_evaluation_by_seconds, slot_seconds=3600, url=DEFAULT_URL) -> None:
         self.pvinstallations = pvinstallations
+        self.url = url if url.endswith('/') else url + '/'
+        self.slot_seconds = slot_seconds
+        # per installation: period end epochs and cumulative energy in Wh
         self.results = {}
+        # sum of all installations on the union of their timestamps
+        self.combined_times = np.zeros(0)
+        self.combined_energy = np.zeros(0)
         self.last_update = 0
+        # last successful request per installation
+        self.refresh_times = {}
+        self.budget = RequestBudget(DEFAULT_RATE_LIMIT, 3600)
         self.seconds_between_updates = 900
         self.timezone=timezone
         self.rate_limit_blackout_window = 0
         self.delay_evaluation_by_seconds=delay_evaluation_by_seconds
+        # protects results and rate_limit_blackout_window in the worker threads
+        self.lock = threading.Lock()
+        # no retries, a failed installation is requested again within the budget
+        self.client = HttpClient('fcsolar', retries=0, read_timeout=60)
 
-    def get_forecast(self) -> dict:
-        """ Get hourly forecast from provider """
+    def get_forecast(self) -> ForecastSeries:
+        """ Get forecast from provider in slots of slot_seconds """
         got_error = False
         t0 = time.time()
-        dt = t0-self.last_update
-        if dt > self.seconds_between_updates:
+        due_installations = self.__get_due_installations(t0)
+        if due_installations:
             if self.rate_limit_blackout_window < t0:
                 try:
                     if self.last_update > 0 and self.delay_evaluation_by_seconds > 0:
@@ -42,7 +68,7 @@ class FCSolar(ForecastSolarInterface):
                             '[FCSolar] Waiting for %d seconds before requesting new data',
                             sleeptime)
                         time.sleep(sleeptime)
-                    self.__get_raw_forecast()
+                    self.__get_raw_forecast(due_installations)
                     self.last_update = t0
                 except Exception as e:
                     # Catch error here.
@@ -52,110 +78,224 @@ class FCSolar(ForecastSolarInterface):
                     got_error = True
             else:
                 remaining_time = self.rate_limit_blackout_window - t0
+                metrics.PROVIDER_CACHE_HITS.inc(provider='fcsolar')
                 logger.info(
                     '[FCSolar] Rate limit blackout window in place until %s (another %d seconds)',
                       self.rate_limit_blackout_window,
                       remaining_time
                 )
-        prediction = {}
-        for hour in range(48+1):
-            prediction[hour] = 0
-
+        else:
+            metrics.PROVIDER_CACHE_HITS.inc(provider='fcsolar')
         # return empty prediction if results have not been obtained
-        if not self.results:
+        if len(self.combined_times) == 0:
             logger.warning('[FCSolar] No results from FC Solar API available')
             raise RuntimeWarning('[FCSolar] No results from FC Solar API available')
 
-        prediction={}
-        now = datetime.datetime.now().astimezone(self.timezone)
-        current_hour = datetime.datetime(
-            now.year, now.month, now.day, now.hour).astimezone(self.timezone)
-        result = next(iter(self.results.values()))
-        response_time_string = result['message']['info']['time']
-        response_time = datetime.datetime.fromisoformat(response_time_string)
-        response_timezone = response_time.tzinfo
-        for _, result in self.results.items():
-            for isotime, value in result['result'].items():
-                timestamp = datetime.datetime.fromisoformat(
-                    isotime).astimezone(response_timezone)
-                diff = timestamp-current_hour
-                rel_hour = math.ceil(diff.total_seconds()/3600)-1
-                if rel_hour >= 0:
-                    if rel_hour in prediction.keys():
-                        prediction[rel_hour] += value
-                    else:
-                        prediction[rel_hour] = value
-
-        max_hour=max(prediction.keys())
+        now = time.time()
+        current_slot = now - now % self.slot_seconds
+        num_slots = int(np.ceil((self.combined_times[-1] - current_slot) / self.slot_seconds))
+        if num_slots <= 0:
+            raise RuntimeError('[FCSolar] No forecast data for the upcoming hours.')
+        # The cumulative energy is interpolated at the slot boundaries,
+        # which splits the hourly periods into shorter slots.
+        slot_edges = current_slot + np.arange(num_slots + 1) * self.slot_seconds
+        #slots without production get 0 values
+        prediction = np.diff(np.interp(slot_edges, self.combined_times, self.combined_energy))
+
+        max_hour = len(prediction) * self.slot_seconds / 3600 - 1
         if max_hour < 18 and got_error:
             logger.error('[FCSolar] Less than 18 hours of forecast data. Stopping.')
             raise RuntimeError('[FCSolar] Less than 18 hours of forecast data.')
-        #complete hours without production with 0 values
-        for h in range(max_hour+1):
-            if h not in prediction.keys():
-                prediction[h]=0
-        #sort output
-        output=dict(sorted(prediction.items()))
-
-        return output
-
-    def __get_raw_forecast(self):
-        unit: dict
-        for unit in self.pvinstallations:
-            name = unit['name']
-            lat = unit['lat']
-            lon = unit['lon']
-            dec = unit['declination']  # declination
-            az = unit['azimuth']  # 90 =W -90 = E
-            kwp = unit['kWp']
-
-            apikey_urlmod=''
-            if 'apikey' in unit.keys() and unit['apikey'] is not None:
-                apikey_urlmod = unit['apikey'] +"/"# ForecastSolar api
-            #legacy naming in config file
-            elif 'api' in unit.keys() and unit['api'] is not None:
-                apikey_urlmod = unit['api'] +"/" # ForecastSolar api
-
-            horizon_querymod = ''
-            if 'horizon' in unit.keys() and unit['horizon'] is not None:
-                horizon_querymod = "?horizon=" + unit['horizon']  # ForecastSolar api
-
-            url = (f"https://api.forecast.solar/{apikey_urlmod}estimate/"
-                   f"watthours/period/{lat}/{lon}/{dec}/{az}/{kwp}{horizon_querymod}")
+
+        return ForecastSeries(current_slot, self.slot_seconds, prediction)
+
+    @staticmethod
+    def __parse_result(result:dict) -> tuple:
+        """ Convert a response to sorted period end epochs and cumulative energy in Wh """
+        response_time = datetime.datetime.fromisoformat(result['message']['info']['time'])
+        response_timezone = response_time.tzinfo
+        period_ends = np.array([
+            datetime.datetime.fromisoformat(isotime).astimezone(response_timezone).timestamp()
+            for isotime in result['result'].keys()
+        ], dtype=np.float64)
+        energies = np.array(list(result['result'].values()), dtype=np.float64)
+        if len(period_ends) == 0:
+            return period_ends, energies
+        order = np.argsort(period_ends)
+        period_ends = period_ends[order]
+        # the first period is assumed to start one hour before its end
+        times = np.concatenate((period_ends[:1] - 3600, period_ends))
+        cumulative_energy = np.concatenate(([0], np.cumsum(energies[order])))
+        return times, cumulative_energy
+
+    def __combine_results(self) -> None:
+        """ Sum the cumulative energy of all installations on a common time axis """
+        results = [result for result in self.results.values() if len(result[0]) > 0]
+        if not results:
+            return
+        times = np.unique(np.concatenate([times for times, _ in results]))
+        self.combined_energy = np.vstack([
+            np.interp(times, installation_times, energy)
+            for installation_times, energy in results
+        ]).sum(axis=0)
+        self.combined_times = times
+
+    def __get_refresh_spacing(self) -> float:
+        """ Seconds between two refreshes, so each installation is refreshed
+            every seconds_between_updates, or less often if the budget is too small.
+        """
+        num_installations = max(1, len(self.pvinstallations))
+        interval = max(self.seconds_between_updates, num_installations * self.budget.interval)
+        return interval / num_installations
+
+    def __is_night(self, now:float) -> bool:
+        """ No production in the last and the next hour and the cached
+            forecast covers the next day, so a refresh would not change anything.
+        """
+        if len(self.combined_times) == 0 or self.combined_times[-1] < now + NIGHT_MIN_HORIZON:
+            return False
+        energy = np.interp([now - 3600, now + 3600], self.combined_times, self.combined_energy)
+        return energy[1] == energy[0]
+
+    def __get_due_installations(self, now:float) -> list:
+        """ Installations to request now, limited by the request budget.
+
+            Installations without results are always due. Otherwise the
+            installation with the oldest result is refreshed, one at a time,
+            so the requests are spread evenly over the hour.
+        """
+        candidates = [unit for unit in self.pvinstallations if unit['name'] not in self.results]
+        if now - self.last_update >= self.__get_refresh_spacing() and not self.__is_night(now):
+            cached = [unit for unit in self.pvinstallations if unit['name'] in self.results]
+            if cached:
+                candidates.append(
+                    min(cached, key=lambda unit: self.refresh_times.get(unit['name'], 0)))
+
+        # the tokens are taken right before each request in __fetch_installation
+        available = self.budget.available(now)
+        for unit in candidates[available:]:
+            self.__log_budget_used_up(unit['name'])
+        return candidates[:available]
+
+    def __log_budget_used_up(self, name:str) -> None:
+        logger.info('[FCSolar] Request budget of %d requests per %d seconds used up, '
+                    'postponing refresh of %s',
+                    self.budget.limit, self.budget.period, name)
+
+    def __get_raw_forecast(self, installations:list):
+        try:
+            self.__fetch_installations(installations)
+        finally:
+            # also keep results of installations fetched before an error
+            self.__combine_results()
+
+    def __fetch_installations(self, installations:list):
+        """ Request installations concurrently, failed installations keep
+            their cached results.
+        """
+        workers = min(MAX_WORKERS, len(installations))
+        if workers == 0:
+            return
+        errors = []
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fcsolar') as executor:
+            futures = {
+                executor.submit(self.__fetch_installation, unit): unit['name']
+                for unit in installations
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error('[FCSolar] Error getting forecast for %s: %s',
+                                 futures[future], e)
+                    errors.append(futures[future])
+        if errors:
+            raise RuntimeError(
+                f'[FCSolar] Requests failed for PV Installations {", ".join(errors)}')
+
+    def __get_url(self, unit:dict) -> str:
+        lat = unit['lat']
+        lon = unit['lon']
+        dec = unit['declination']  # declination
+        az = unit['azimuth']  # 90 =W -90 = E
+        kwp = unit['kWp']
+
+        apikey_urlmod=''
+        if 'apikey' in unit.keys() and unit['apikey'] is not None:
+            apikey_urlmod = unit['apikey'] +"/"# ForecastSolar api
+        #legacy naming in config file
+        elif 'api' in unit.keys() and unit['api'] is not None:
+            apikey_urlmod = unit['api'] +"/" # ForecastSolar api
+
+        horizon_querymod = ''
+        if 'horizon' in unit.keys() and unit['horizon'] is not None:
+            horizon_querymod = "?horizon=" + unit['horizon']  # ForecastSolar api
+
+        return (f"{self.url}{apikey_urlmod}estimate/"
+                f"watthours/period/{lat}/{lon}/{dec}/{az}/{kwp}{horizon_querymod}")
+
+    def __fetch_installation(self, unit:dict):
+        """ Request one installation, runs in a worker thread """
+        name = unit['name']
+        # another worker may have hit the rate limit in the meantime
+        with self.lock:
+            rate_limited = self.rate_limit_blackout_window > time.time()
+        if rate_limited:
             logger.info(
-                '[FCSolar] Requesting Information for PV Installation %s', name)
-
-
-            response = requests.get(url, timeout=60)
-            if response.status_code == 200:
-                self.results[name] = json.loads(response.text)
-            elif response.status_code == 429:
-                retry_after = response.headers.get('X-Ratelimit-Retry-At')
-                if retry_after:
-                    retry_after_timestamp = datetime.datetime.fromisoformat(retry_after)
-                    now = datetime.datetime.now().astimezone(self.timezone)
-                    retry_seconds = (retry_after_timestamp - now).total_seconds()
-                    self.rate_limit_blackout_window = retry_after_timestamp.timestamp()
-                    logger.warning(
-                      '[ForecastSolar] forecast solar API rate limit exceeded [%s]. '
-                      'Retry after %d seconds at %s',
-                      response.text,
-                      retry_seconds,
-                      retry_after_timestamp
-                    )
-                else:
-                    logger.warning(
-                        '[ForecastSolar] forecast solar API rate limit exceeded [%s]. '
-                        'No retry after information available, dumping headers',
-                        response.text
-                    )
-                    for header, value in response.headers.items():
-                        logger.debug('[ForecastSolar 429] Header: %s = %s', header, value)
+                '[FCSolar] Skipping PV Installation %s, rate limit blackout window in place',
+                name)
+            return
+        if not self.budget.acquire():
+            self.__log_budget_used_up(name)
+            return
 
+        url = self.__get_url(unit)
+        logger.info(
+            '[FCSolar] Requesting Information for PV Installation %s', name)
+
+        with self.lock:
+            has_result = name in self.results
+        response = self.client.get(url, conditional=has_result)
+        self.budget.update(response.headers)
+        if response.status_code == 200:
+            result = self.__parse_result(json.loads(response.text))
+            with self.lock:
+                self.results[name] = result
+                self.refresh_times[name] = time.time()
+        elif response.status_code == NOT_MODIFIED:
+            # the parsed result is still up to date
+            with self.lock:
+                self.refresh_times[name] = time.time()
+        elif response.status_code == 429:
+            self.budget.exhaust()
+            retry_after = response.headers.get('X-Ratelimit-Retry-At')
+            if retry_after:
+                retry_after_timestamp = datetime.datetime.fromisoformat(retry_after)
+                now = datetime.datetime.now().astimezone(self.timezone)
+                retry_seconds = (retry_after_timestamp - now).total_seconds()
+                with self.lock:
+                    self.rate_limit_blackout_window = max(
+                        self.rate_limit_blackout_window, retry_after_timestamp.timestamp())
+                logger.warning(
+                  '[ForecastSolar] forecast solar API rate limit exceeded [%s]. '
+                  'Retry after %d seconds at %s',
+                  response.text,
+                  retry_seconds,
+                  retry_after_timestamp
+                )
             else:
                 logger.warning(
-                    '[ForecastSolar] forecast solar API returned %s - %s',
-                      response.status_code, response.text)
+                    '[ForecastSolar] forecast solar API rate limit exceeded [%s]. '
+                    'No retry after information available, dumping headers',
+                    response.text
+                )
+                for header, value in response.headers.items():
+                    logger.debug('[ForecastSolar 429] Header: %s = %s', header, value)
+
+        else:
+            # e.g. 500 or 503, counted as failed installation by the caller
+            raise RuntimeError(
+                f'[FCSolar] API returned {response.status_code} - {response.text}')
 
 if __name__ == '__main__':
     test_pvinstallations = [{'name': 'Nordhalle',
@@ -171,4 +311,4 @@ if __name__ == '__main__':
                            'azimuth': '7',
                            'kWp': '25.030'}]
     fcs=FCSolar( test_pvinstallations, 'Europe/Berlin' , 10)
-    print (fcs.get_forecast())
+    print (fcs.get_forecast().to_dict())
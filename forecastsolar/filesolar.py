@@ -0,0 +1,38 @@
+""" Solar forecast from a file with historical production
+
+Reads the production in Wh per slot from a CSV or NPZ file (see
+ForecastSeries.from_file) for replays and benchmarks without network access.
+A file with the measured production gives a perfect forecast, a file with
+archived forecasts replays the real forecast quality.
+
+The file is loaded and resampled to slot_seconds once. get_forecast()
+returns the next HORIZON_HOURS from the time of the clock, which defaults to
+time.time and can be replaced by a simulated clock.
+"""
+import time
+import logging
+from forecastseries.forecastseries import ForecastSeries, RESAMPLE_SUM
+from .forecastsolar_interface import ForecastSolarInterface
+
+logger = logging.getLogger('__main__')
+logger.info('[FileSolar] loading module')
+
+HORIZON_HOURS = 48
+
+
+class FileSolar(ForecastSolarInterface):
+    """ Production from a CSV or NPZ file, indexed by the clock """
+    def __init__(self, pvinstallations, timezone, api_delay=0, slot_seconds=3600,
+                 path:str=None, clock=None) -> None:
+        if not path:
+            raise RuntimeError('[FileSolar] file_path of the production file is required')
+        self.slot_seconds = slot_seconds
+        self.clock = clock
+        self.production = ForecastSeries.from_file(path).resample(slot_seconds, RESAMPLE_SUM)
+        logger.info('[FileSolar] Loaded %d slots of production from %s',
+                    len(self.production), path)
+
+    def get_forecast(self) -> ForecastSeries:
+        """ Production of the next HORIZON_HOURS in Wh per slot """
+        now = self.clock() if self.clock is not None else time.time()
+        return self.production.align(now, int(HORIZON_HOURS * 3600 / self.slot_seconds))
@@ -1,6 +1,7 @@
 """ Interface for solar forecast classes """
 
 from abc import ABC, abstractmethod
+from forecastseries.forecastseries import ForecastSeries
 
 class ForecastSolarInterface(ABC):
     """ Interface for SolarAPI classes """
@@ -9,5 +10,9 @@ class ForecastSolarInterface(ABC):
         """ Initialize the SolarAPI class """
 
     @abstractmethod
-    def get_forecast(self) -> dict[int, float]:
-        """ Get solar production of all installations up to next 48 hours """
\ No newline at end of file
+    def get_forecast(self) -> ForecastSeries:
+        """ Get solar production of all installations in Wh per slot,
+            starting with the current slot, up to next 48 hours """
+
+    def record_pv_power(self, timestamp: float, power: float) -> None:
+        """ Measured PV power in W, used by providers which track their error """
@@ -0,0 +1,77 @@
+""" Nowcast correction of the solar forecast with the measured PV power
+
+The forecast providers are refreshed only a few times per hour and do not
+know about today's clouds, fog or snow. The correction compares the PV power
+measured by the inverter with the forecast for the elapsed time:
+
+- Measured and forecast energy between two evaluations are added to
+  exponentially decaying sums (time constant smoothing_seconds). Each update
+  is O(1), no samples are stored.
+- The ratio of both sums is applied to the upcoming slots and fades out to
+  1 with the time constant horizon_seconds, later slots keep the forecast.
+
+Until enough forecast energy is accumulated (e.g. in the morning), the
+ratio stays at 1.
+"""
+import math
+import logging
+import numpy as np
+from forecastseries.forecastseries import ForecastSeries
+
+logger = logging.getLogger('__main__')
+logger.info('[Nowcast] loading module')
+
+MIN_FORECAST_ENERGY = 50  # Wh, smoothed forecast energy required to trust the ratio
+MAX_RATIO = 2.0
+MAX_SAMPLE_GAP = 900  # seconds, longer gaps between measurements are not integrated
+
+
+class NowcastCorrection:
+    """ Exponentially smoothed ratio of measured and forecast PV energy """
+    def __init__(self, smoothing_seconds:float=3600, horizon_seconds:float=3 * 3600):
+        self.smoothing_seconds = smoothing_seconds
+        self.horizon_seconds = horizon_seconds
+        self.measured_energy = 0.0
+        self.forecast_energy = 0.0
+        self.last_time = None
+        self.last_measured_power = None
+        self.last_forecast_power = None
+
+    @property
+    def ratio(self) -> float:
+        """ Measured / forecast production, 1 without enough data """
+        if self.forecast_energy < MIN_FORECAST_ENERGY:
+            return 1.0
+        return min(self.measured_energy / self.forecast_energy, MAX_RATIO)
+
+    def update(self, timestamp:float, measured_power:float, forecast:ForecastSeries) -> None:
+        """ Add a measurement in W, compared with the forecast at timestamp """
+        index = forecast.index_of(timestamp)
+        if index < 0 or index >= len(forecast):
+            return
+        # mean forecast power of the current slot in W
+        forecast_power = forecast[index] * 3600 / forecast.step
+
+        if self.last_time is not None:
+            elapsed = timestamp - self.last_time
+            if 0 < elapsed <= MAX_SAMPLE_GAP:
+                decay = math.exp(-elapsed / self.smoothing_seconds)
+                # trapezoidal energy of the interval in Wh
+                self.measured_energy = self.measured_energy * decay + \
+                    (self.last_measured_power + measured_power) / 2 * elapsed / 3600
+                self.forecast_energy = self.forecast_energy * decay + \
+                    (self.last_forecast_power + forecast_power) / 2 * elapsed / 3600
+        self.last_time = timestamp
+        self.last_measured_power = measured_power
+        self.last_forecast_power = forecast_power
+
+    def apply(self, timestamp:float, forecast:ForecastSeries) -> ForecastSeries:
+        """ Corrected copy of the forecast, the correction fades out over the horizon """
+        ratio = self.ratio
+        if ratio == 1.0:
+            return forecast
+        slot_centers = forecast.start + (np.arange(len(forecast)) + 0.5) * forecast.step
+        weights = np.exp(-np.maximum(slot_centers - timestamp, 0) / self.horizon_seconds)
+        logger.debug('[Nowcast] Correcting production forecast with ratio %.2f', ratio)
+        return ForecastSeries(
+            forecast.start, forecast.step, forecast.values * (1 + (ratio - 1) * weights))
@@ -0,0 +1,145 @@
+""" Solar forecast from the Open-Meteo irradiance API
+
+Open-Meteo provides the global tilted irradiance for the plane of each
+installation (tilt and azimuth like forecast.solar: 0 = south, 90 = west).
+The hourly values are means of the preceding hour, they are converted to
+energy with the peak power and a fixed performance ratio.
+
+See https://open-meteo.com/en/docs for more information
+"""
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from metrics import metrics
+from httpclient.httpclient import HttpClient, NOT_MODIFIED
+from forecastseries.forecastseries import ForecastSeries
+from .forecastsolar_interface import ForecastSolarInterface
+
+logger = logging.getLogger('__main__')
+logger.info('[OpenMeteo] loading module')
+
+DEFAULT_URL = 'https://api.open-meteo.com/v1/forecast'
+PERFORMANCE_RATIO = 0.85  # inverter, cable and temperature losses
+FORECAST_DAYS = 2
+# Parallel requests for sites with several PV installations
+MAX_WORKERS = 4
+
+
+class OpenMeteo(ForecastSolarInterface):
+    """ Provider to get irradiance forecasts from https://open-meteo.com/ """
+    def __init__(self, pvinstallations, timezone, api_delay=0, slot_seconds=3600,
+                 url=DEFAULT_URL, timeout=30, min_time_between_api_calls=900) -> None:
+        self.pvinstallations = pvinstallations
+        self.timezone = timezone
+        self.slot_seconds = slot_seconds
+        self.url = url
+        self.client = HttpClient('openmeteo', read_timeout=timeout)
+        self.min_time_between_api_calls = min_time_between_api_calls
+        # per installation: period boundaries and cumulative energy in Wh
+        self.results = {}
+        # protects results in the worker threads
+        self.lock = threading.Lock()
+        # period boundaries and cumulative energy in Wh of all installations
+        self.times = np.zeros(0)
+        self.cumulative_energy = np.zeros(0)
+        self.last_update = 0
+
+    def get_forecast(self) -> ForecastSeries:
+        """ Get forecast from provider in slots of slot_seconds """
+        now = time.time()
+        if now - self.last_update > self.min_time_between_api_calls:
+            try:
+                self.__fetch(now)
+            except Exception as e:
+                logger.error('[OpenMeteo] Error getting forecast: %s', e)
+                if len(self.times) == 0:
+                    raise
+                logger.warning('[OpenMeteo] Using cached values')
+        else:
+            metrics.PROVIDER_CACHE_HITS.inc(provider='openmeteo')
+
+        current_slot = now - now % self.slot_seconds
+        num_slots = int(np.ceil((self.times[-1] - current_slot) / self.slot_seconds)) \
+            if len(self.times) > 0 else 0
+        if num_slots <= 0:
+            raise RuntimeError('[OpenMeteo] No forecast data for the upcoming hours.')
+        slot_edges = current_slot + np.arange(num_slots + 1) * self.slot_seconds
+        prediction = np.diff(np.interp(slot_edges, self.times, self.cumulative_energy))
+        return ForecastSeries(current_slot, self.slot_seconds, prediction)
+
+    def __fetch(self, now:float) -> None:
+        """ Request all installations concurrently, failed installations
+            keep their cached results.
+        """
+        errors = []
+        workers = min(MAX_WORKERS, len(self.pvinstallations))
+        if workers > 0:
+            with ThreadPoolExecutor(max_workers=workers,
+                                    thread_name_prefix='openmeteo') as executor:
+                futures = {
+                    executor.submit(self.__fetch_installation, unit): unit['name']
+                    for unit in self.pvinstallations
+                }
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error('[OpenMeteo] Error getting forecast for %s: %s',
+                                     futures[future], e)
+                        errors.append(futures[future])
+        # also combine the results of installations fetched before an error
+        self.__combine_results()
+        if errors:
+            raise RuntimeError(
+                f'[OpenMeteo] Requests failed for PV Installations {", ".join(errors)}')
+        self.last_update = now
+
+    def __combine_results(self) -> None:
+        """ Sum the cumulative energy of all installations on a common time axis """
+        with self.lock:
+            results = list(self.results.values())
+        if not results:
+            return
+        times = np.unique(np.concatenate([result_times for result_times, _ in results]))
+        self.cumulative_energy = np.vstack([
+            np.interp(times, result_times, energy) for result_times, energy in results
+        ]).sum(axis=0)
+        self.times = times
+
+    def __fetch_installation(self, unit:dict) -> tuple:
+        """ Period boundaries and cumulative energy in Wh of one installation,
+            runs in a worker thread
+        """
+        params = {
+            'latitude': unit['lat'],
+            'longitude': unit['lon'],
+            'tilt': unit['declination'],
+            'azimuth': unit['azimuth'],
+            'hourly': 'global_tilted_irradiance',
+            'timeformat': 'unixtime',
+            'forecast_days': FORECAST_DAYS,
+        }
+        logger.info('[OpenMeteo] Requesting Information for PV Installation %s', unit['name'])
+        with self.lock:
+            cached = self.results.get(unit['name'])
+        response = self.client.get(self.url, params=params, conditional=cached is not None)
+        if response.status_code == NOT_MODIFIED:
+            return cached
+        if response.status_code != 200:
+            raise RuntimeError(
+                f'[OpenMeteo] API returned {response.status_code} - {response.text}')
+        hourly = response.json()['hourly']
+        period_ends = np.array(hourly['time'], dtype=np.float64)
+        # W/m2 are converted to W with the peak power at 1000 W/m2
+        power = np.array(hourly['global_tilted_irradiance'], dtype=np.float64)
+        energies = np.nan_to_num(power) * float(unit['kWp']) * PERFORMANCE_RATIO
+        if len(period_ends) == 0:
+            raise RuntimeError(f'[OpenMeteo] No forecast for PV Installation {unit["name"]}')
+        # values are means of the preceding hour
+        times = np.concatenate((period_ends[:1] - 3600, period_ends))
+        result = (times, np.concatenate(([0], np.cumsum(energies))))
+        with self.lock:
+            self.results[unit['name']] = result
+        return result
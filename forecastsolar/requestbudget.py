@@ -0,0 +1,72 @@
+""" Token bucket for rate limited APIs
+
+forecast.solar allows a number of requests per period and IP (12 per hour
+on the free tier) and reports the state in its response headers:
+    X-Ratelimit-Limit, X-Ratelimit-Period, X-Ratelimit-Remaining
+The bucket starts with the default limit and follows the headers of every
+response, so a paid plan or requests of other clients on the same IP are
+taken into account.
+"""
+import time
+import threading
+import logging
+
+logger = logging.getLogger('__main__')
+
+
+class RequestBudget:
+    """ Token bucket, refilled continuously with limit tokens per period """
+    def __init__(self, limit:int=12, period:float=3600):
+        self.limit = limit
+        self.period = period
+        self.tokens = float(limit)
+        self.last_refill = time.time()
+        self.lock = threading.Lock()
+
+    def __refill(self, now:float) -> None:
+        elapsed = max(0, now - self.last_refill)
+        self.tokens = min(self.limit, self.tokens + elapsed * self.limit / self.period)
+        self.last_refill = now
+
+    @property
+    def interval(self) -> float:
+        """ Average seconds between requests to stay within the budget """
+        return self.period / self.limit
+
+    def available(self, now:float=None) -> int:
+        """ Number of requests which can be sent now """
+        with self.lock:
+            self.__refill(time.time() if now is None else now)
+            return int(self.tokens)
+
+    def acquire(self, now:float=None) -> bool:
+        """ Take a token for one request, returns False if the budget is exhausted """
+        with self.lock:
+            self.__refill(time.time() if now is None else now)
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def update(self, headers, now:float=None) -> None:
+        """ Follow the X-Ratelimit-* headers of a response """
+        try:
+            limit = headers.get('X-Ratelimit-Limit')
+            period = headers.get('X-Ratelimit-Period')
+            remaining = headers.get('X-Ratelimit-Remaining')
+            with self.lock:
+                self.__refill(time.time() if now is None else now)
+                if limit is not None and int(limit) > 0:
+                    self.limit = int(limit)
+                if period is not None and float(period) > 0:
+                    self.period = float(period)
+                if remaining is not None:
+                    self.tokens = min(self.tokens, float(remaining))
+        except ValueError:
+            logger.debug('[RequestBudget] Could not parse rate limit headers %s', headers)
+
+    def exhaust(self, now:float=None) -> None:
+        """ The API rejected a request, wait for the next refill """
+        with self.lock:
+            self.__refill(time.time() if now is None else now)
+            self.tokens = 0
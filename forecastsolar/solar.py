@@ -1,7 +1,7 @@
 """ Factory for solar forecast providers """
 
 from .forecastsolar_interface import ForecastSolarInterface
-from .fcsolar import FCSolar
+from .ensemble import DEFAULT_TIMEOUT
 
 class ForecastSolar:
     """ Factory for solar forecast providers """
@@ -9,12 +9,65 @@ class ForecastSolar:
     def create_solar_provider(config: dict,
                               timezone,
                               api_delay=0,
-                              requested_provider='fcsolarapi') -> ForecastSolarInterface:
-        """ Select and configure a solar forecast provider based on the given configuration """
+                              requested_provider='fcsolarapi',
+                              slot_seconds=3600,
+                              provider_config: dict = None) -> ForecastSolarInterface:
+        """ Select and configure a solar forecast provider based on the given configuration
+
+            config: list of pv installations
+            provider_config: optional settings of the solar_forecast section,
+                e.g. fallback provider, clearsky_factor, ensemble providers and urls
+        """
+        if provider_config is None:
+            provider_config = {}
 
         provider = None
+        timeout = float(provider_config.get('timeout', DEFAULT_TIMEOUT))
+        # Providers are imported on demand, the HTTP based ones import requests
         if requested_provider.lower() == 'fcsolarapi':
-            provider = FCSolar(config, timezone, api_delay)
+            from .fcsolar import FCSolar, DEFAULT_URL as FCSOLAR_URL
+            provider = FCSolar(config, timezone, api_delay, slot_seconds,
+                               provider_config.get('fcsolar_url', FCSOLAR_URL))
+        elif requested_provider.lower() == 'clearsky':
+            from .clearsky import ClearSky
+            provider = ClearSky(config, timezone, api_delay, slot_seconds,
+                                float(provider_config.get('clearsky_factor', 1.0)))
+        elif requested_provider.lower() == 'openmeteo':
+            from .openmeteo import OpenMeteo, DEFAULT_URL as OPENMETEO_URL
+            provider = OpenMeteo(config, timezone, api_delay, slot_seconds,
+                                 provider_config.get('openmeteo_url', OPENMETEO_URL),
+                                 timeout)
+        elif requested_provider.lower() == 'evcc':
+            from .evccsolar import EvccSolar
+            provider = EvccSolar(config, timezone, api_delay, slot_seconds,
+                                 provider_config.get('evcc_url'), timeout)
+        elif requested_provider.lower() == 'file':
+            from .filesolar import FileSolar
+            provider = FileSolar(config, timezone, api_delay, slot_seconds,
+                                 provider_config.get('file_path'))
+        elif requested_provider.lower() == 'ensemble':
+            member_config = {
+                key: value for key, value in provider_config.items()
+                if key not in ('fallback', 'ensemble')
+            }
+            providers = {
+                name: ForecastSolar.create_solar_provider(
+                    config, timezone, api_delay, name, slot_seconds, member_config)
+                for name in provider_config.get('ensemble', ['fcsolarapi', 'clearsky'])
+            }
+            from .ensemble import EnsembleSolar
+            provider = EnsembleSolar(
+                providers, slot_seconds, timeout,
+                float(provider_config.get('error_smoothing_hours', 24)))
         else:
             raise RuntimeError(f'[ForecastSolar] Unkown provider {requested_provider}')
+
+        fallback_provider = provider_config.get('fallback')
+        if fallback_provider and fallback_provider.lower() != requested_provider.lower():
+            fallback = ForecastSolar.create_solar_provider(
+                config, timezone, api_delay, fallback_provider, slot_seconds,
+                {key: value for key, value in provider_config.items() if key != 'fallback'}
+            )
+            from .fallback import FallbackSolar
+            provider = FallbackSolar(provider, fallback)
         return provider
@@ -0,0 +1,215 @@
+""" Local time-series store for evaluation history
+
+Every evaluation stores its inputs (forecasts, prices), outputs (mode, charge
+rate, reserved energy) and the inverter telemetry (SOC, stored energy) in a
+SQLite database in WAL mode.
+
+- Writes are queued and done in batches by a background thread, so the
+  control loop never waits for the SD card.
+- Raw evaluations are downsampled to hourly averages and removed after
+  raw_retention_days. Hourly values are kept downsampled_retention_days.
+- Queries return NumPy arrays for analytics and backtests. They use their own
+  connection, WAL allows reading while the writer is active.
+"""
+import time
+import queue
+import sqlite3
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger('__main__')
+logger.info('[History] loading module')
+
+# Scalar values of every evaluation, in database column order
+SCALAR_COLUMNS = [
+    'soc',
+    'stored_energy',
+    'stored_usable_energy',
+    'reserved_energy',
+    'mode',
+    'charge_rate',
+    'discharge_blocked',
+    'price',
+    'production',
+    'consumption',
+    'net_consumption',
+]
+# Forecast arrays of every evaluation, stored as float64 blobs
+FORECAST_COLUMNS = [
+    'fc_prices',
+    'fc_production',
+    'fc_consumption',
+    'fc_net_consumption',
+]
+
+RESOLUTION_RAW = 'raw'
+RESOLUTION_HOURLY = 'hourly'
+
+BATCH_SIZE = 100
+DOWNSAMPLE_INTERVAL = 3600  # seconds
+
+
+class HistoryStore:
+    """ SQLite backed store for the evaluation history """
+    def __init__(self, path:str, raw_retention_days:float=7,
+                 downsampled_retention_days:float=365, flush_interval:float=60):
+        self.path = path
+        self.raw_retention = raw_retention_days * 86400
+        self.downsampled_retention = downsampled_retention_days * 86400
+        self.flush_interval = flush_interval
+
+        self.queue = queue.SimpleQueue()
+        self.stop_event = threading.Event()
+        self.last_downsample = 0
+
+        connection = self.__connect()
+        self.__create_tables(connection)
+        connection.close()
+
+        self.thread = threading.Thread(target=self.__writer, name='history-writer', daemon=True)
+        self.thread.start()
+        logger.info('[History] Storing evaluation history in %s', path)
+
+    def __connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        # WAL is consistent with NORMAL, only the last transactions may get lost on power loss
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    @staticmethod
+    def __create_tables(connection:sqlite3.Connection) -> None:
+        scalars = ', '.join(f'{column} REAL' for column in SCALAR_COLUMNS)
+        forecasts = ', '.join(f'{column} BLOB' for column in FORECAST_COLUMNS)
+        with connection:
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS evaluations '
+                f'(ts REAL PRIMARY KEY, {scalars}, {forecasts})'
+            )
+            connection.execute(
+                f'CREATE TABLE IF NOT EXISTS evaluations_hourly '
+                f'(ts REAL PRIMARY KEY, {scalars}, samples INTEGER)'
+            )
+
+    def record(self, timestamp:float, values:dict, forecasts:dict) -> None:
+        """ Queue one evaluation for writing. Does not block.
+
+            values: SCALAR_COLUMNS -> float, missing values are stored as NULL
+            forecasts: FORECAST_COLUMNS -> np.ndarray
+        """
+        row = [timestamp]
+        row.extend(values.get(column) for column in SCALAR_COLUMNS)
+        for column in FORECAST_COLUMNS:
+            forecast = forecasts.get(column)
+            if forecast is None:
+                row.append(None)
+            else:
+                row.append(np.ascontiguousarray(forecast, dtype=np.float64).tobytes())
+        self.queue.put(row)
+
+    def __writer(self) -> None:
+        """ Background thread writing batches and downsampling """
+        connection = self.__connect()
+        columns = ['ts'] + SCALAR_COLUMNS + FORECAST_COLUMNS
+        insert = (
+            f'INSERT OR REPLACE INTO evaluations ({", ".join(columns)}) '
+            f'VALUES ({", ".join("?" * len(columns))})'
+        )
+        while True:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < BATCH_SIZE and not self.stop_event.is_set():
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=min(timeout, 1)))
+                except queue.Empty:
+                    continue
+            # Collect remaining records on shutdown
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if batch:
+                    with connection:
+                        connection.executemany(insert, batch)
+                if time.time() - self.last_downsample > DOWNSAMPLE_INTERVAL:
+                    self.__downsample(connection)
+            except sqlite3.Error as e:
+                logger.error('[History] Writing history failed: %s', e)
+            if self.stop_event.is_set():
+                break
+        connection.close()
+
+    def __downsample(self, connection:sqlite3.Connection) -> None:
+        """ Aggregate completed hours and apply the retention """
+        now = time.time()
+        current_hour = now - now % 3600
+        averages = ', '.join(f'AVG({column})' for column in SCALAR_COLUMNS)
+        with connection:
+            last_hour = connection.execute(
+                'SELECT MAX(ts) FROM evaluations_hourly').fetchone()[0]
+            start = -1 if last_hour is None else last_hour + 3600
+            connection.execute(
+                f'INSERT OR REPLACE INTO evaluations_hourly '
+                f'(ts, {", ".join(SCALAR_COLUMNS)}, samples) '
+                f'SELECT CAST(ts / 3600 AS INTEGER) * 3600 AS hour, {averages}, COUNT(*) '
+                f'FROM evaluations WHERE ts >= ? AND ts < ? GROUP BY hour',
+                (start, current_hour)
+            )
+            connection.execute(
+                'DELETE FROM evaluations WHERE ts < ?', (now - self.raw_retention,))
+            connection.execute(
+                'DELETE FROM evaluations_hourly WHERE ts < ?', (now - self.downsampled_retention,))
+        self.last_downsample = now
+        logger.debug('[History] Downsampled evaluations until %s', current_hour)
+
+    def get_history(self, days:float, columns:list=None, resolution:str=RESOLUTION_RAW) -> dict:
+        """ Scalar values of the last days as dict of NumPy arrays, including 'ts' """
+        if columns is None:
+            columns = SCALAR_COLUMNS
+        for column in columns:
+            if column not in SCALAR_COLUMNS:
+                raise ValueError(f'[History] Unknown column {column}')
+        table = 'evaluations_hourly' if resolution == RESOLUTION_HOURLY else 'evaluations'
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            rows = connection.execute(
+                f'SELECT ts, {", ".join(columns)} FROM {table} WHERE ts >= ? ORDER BY ts',
+                (time.time() - days * 86400,)
+            ).fetchall()
+        finally:
+            connection.close()
+        data = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns) + 1)
+        result = {'ts': data[:, 0]}
+        for i, column in enumerate(columns):
+            result[column] = data[:, i + 1]
+        return result
+
+    def get_forecasts(self, days:float, column:str) -> tuple:
+        """ Forecast arrays of the last days, returns (timestamps, list of arrays) """
+        if column not in FORECAST_COLUMNS:
+            raise ValueError(f'[History] Unknown forecast column {column}')
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            rows = connection.execute(
+                f'SELECT ts, {column} FROM evaluations WHERE ts >= ? ORDER BY ts',
+                (time.time() - days * 86400,)
+            ).fetchall()
+        finally:
+            connection.close()
+        timestamps = np.array([row[0] for row in rows], dtype=np.float64)
+        forecasts = [
+            np.frombuffer(row[1], dtype=np.float64) if row[1] is not None else None
+            for row in rows
+        ]
+        return timestamps, forecasts
+
+    def shutdown(self) -> None:
+        """ Write pending records and stop the writer thread """
+        self.stop_event.set()
+        self.thread.join(timeout=30)
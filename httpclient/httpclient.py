@@ -0,0 +1,138 @@
+""" Shared HTTP client for all providers
+
+- One keep-alive session per host, shared by all clients, so a refresh
+  every 15 minutes reuses the TLS connection instead of a new handshake.
+- Connection errors, timeouts and 5xx responses are retried with
+  exponential backoff and jitter. 429 is returned to the caller, which
+  knows the rate limit of its API.
+- Separate connect and read timeouts, an unreachable host fails fast.
+- Conditional GET requests: if the server sent an ETag or Last-Modified,
+  the next request asks with If-None-Match / If-Modified-Since. Only the
+  validators are kept, not the response. The caller treats a 304 Not
+  Modified as unchanged and keeps its parsed data, it passes
+  conditional=False as long as it has none.
+- Every attempt is recorded in the provider metrics (duration, errors),
+  together with the received bytes.
+"""
+import time
+import random
+import threading
+import logging
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import metrics
+
+logger = logging.getLogger('__main__')
+logger.info('[HttpClient] loading module')
+
+DEFAULT_CONNECT_TIMEOUT = 5  # seconds
+DEFAULT_READ_TIMEOUT = 30  # seconds
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 1  # seconds before the first retry, doubled for every further retry
+MAX_BACKOFF = 30  # seconds
+POOL_MAXSIZE = 4  # parallel connections per host
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+NOT_MODIFIED = 304
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url:str) -> requests.Session:
+    """ Keep-alive session for the host of url, shared by all clients """
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+            session.mount(f'{parts.scheme}://', adapter)
+            _sessions[key] = session
+        return session
+
+
+class HttpClient:
+    """ HTTP client of one provider, e.g. HttpClient('awattar') """
+    def __init__(self, provider:str, retries:int=DEFAULT_RETRIES,
+                 connect_timeout:float=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout:float=DEFAULT_READ_TIMEOUT,
+                 backoff:float=DEFAULT_BACKOFF, conditional:bool=True):
+        self.provider = provider
+        self.retries = retries
+        self.timeout = (connect_timeout, read_timeout)
+        self.backoff = backoff
+        self.conditional = conditional
+        # (url, params) -> request headers with the validators of the last response
+        self.validators = {}
+        self.validators_lock = threading.Lock()
+
+    def get(self, url:str, conditional:bool=True, **kwargs) -> requests.Response:
+        """ GET request, conditional if the server supports it.
+            conditional: False if the caller has no data of a previous response,
+            so the server has to send the content again.
+        """
+        return self.request('GET', url, conditional=conditional, **kwargs)
+
+    def post(self, url:str, data=None, **kwargs) -> requests.Response:
+        """ POST request """
+        return self.request('POST', url, data=data, **kwargs)
+
+    def request(self, method:str, url:str, headers:dict=None, conditional:bool=True,
+                **kwargs) -> requests.Response:
+        """ Send a request with retries, raises the last exception if no
+            response was received at all.
+        """
+        headers = dict(headers or {})
+        kwargs.setdefault('timeout', self.timeout)
+        cache_key = None
+        if self.conditional and method == 'GET':
+            cache_key = (url, repr(sorted((kwargs.get('params') or {}).items())))
+            if conditional:
+                with self.validators_lock:
+                    headers.update(self.validators.get(cache_key, {}))
+        session = get_session(url)
+
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                delay = min(self.backoff * 2 ** (attempt - 1), MAX_BACKOFF)
+                time.sleep(delay * random.uniform(0.5, 1.5))
+            try:
+                response = metrics.timed_request(
+                    self.provider, session.request, method, url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                logger.warning('[HttpClient] %s request %d/%d to %s failed: %s',
+                               self.provider, attempt + 1, self.retries + 1, url, e)
+                if attempt == self.retries:
+                    raise
+                continue
+            metrics.PROVIDER_RESPONSE_BYTES.inc(len(response.content), provider=self.provider)
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.retries:
+                logger.warning('[HttpClient] %s request %d/%d to %s returned %d',
+                               self.provider, attempt + 1, self.retries + 1, url,
+                               response.status_code)
+                continue
+            break
+
+        if cache_key is not None:
+            self.__store_validators(cache_key, response)
+        return response
+
+    def __store_validators(self, cache_key:tuple, response:requests.Response) -> None:
+        """ Remember ETag and Last-Modified of a response for the next request """
+        if response.status_code == NOT_MODIFIED:
+            metrics.PROVIDER_NOT_MODIFIED.inc(provider=self.provider)
+            return
+        if response.status_code != 200:
+            return
+        validators = {}
+        if 'ETag' in response.headers:
+            validators['If-None-Match'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            validators['If-Modified-Since'] = response.headers['Last-Modified']
+        with self.validators_lock:
+            if validators:
+                self.validators[cache_key] = validators
+            else:
+                self.validators.pop(cache_key, None)
@@ -17,6 +17,14 @@ class InverterBaseclass(InverterInterface):
         """ Dummy implementation """
         raise RuntimeWarning("get_capacity not implemented!")
 
+    def get_pv_power(self) -> float:
+        """ Current PV power in W, None if the inverter does not provide it """
+        return None
+
+    def get_load_power(self) -> float:
+        """ Current house consumption in W, None if the inverter does not provide it """
+        return None
+
     def get_designed_capacity(self) -> float:
         """ Returns the designed maximum capacity of the battery in kWh,
             which does not include MIN_SOC , MAX_SOC or other restrictions.
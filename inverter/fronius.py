@@ -10,6 +10,7 @@ import logging
 import json
 import hashlib
 import requests
+from httpclient.httpclient import HttpClient
 from .baseclass import InverterBaseclass
 
 logger = logging.getLogger('__main__')
@@ -37,6 +38,7 @@ def strip_dict(original):
 
 TIMEOFUSE_CONFIG_FILENAME = 'config/timeofuse_config.json'
 BATTERY_CONFIG_FILENAME = 'config/battery_config.json'
+POWERFLOW_CACHE_SECONDS = 10
 
 
 class FroniusWR(InverterBaseclass):
@@ -50,6 +52,10 @@ class FroniusWR(InverterBaseclass):
         self.max_grid_charge_rate = config['max_grid_charge_rate']
         self.max_pv_charge_rate = config['max_pv_charge_rate']
         self.nonce = 0
+        # send_request retries and handles the login itself
+        self.client = HttpClient('fronius', retries=0, conditional=False)
+        self.powerflow = None
+        self.powerflow_time = 0
         self.user = config['user']
         self.password = config['password']
         self.previous_battery_config = self.get_battery_config()
@@ -106,18 +112,50 @@ class FroniusWR(InverterBaseclass):
         self.get_time_of_use()  # save timesofuse
         self.set_allow_grid_charging(True)
 
-    def get_SOC(self):
+    def get_powerflow(self) -> dict:
+        """ Realtime power flow data, cached for POWERFLOW_CACHE_SECONDS.
+
+            SOC, PV and load power of one evaluation are served by a
+            single request.
+        """
+        now = time.time()
+        if self.powerflow is not None and \
+                now - self.powerflow_time < POWERFLOW_CACHE_SECONDS:
+            return self.powerflow
         path = '/solar_api/v1/GetPowerFlowRealtimeData.fcgi'
         response = self.send_request(path)
         if not response:
+            return None
+        self.powerflow = json.loads(response.text)['Body']['Data']
+        self.powerflow_time = now
+        return self.powerflow
+
+    def get_SOC(self):
+        powerflow = self.get_powerflow()
+        if not powerflow:
             logger.error(
                 '[Inverter] Failed to get SOC. Returning default value of 99.0'
                 )
             return 99.0
-        result = json.loads(response.text)
-        soc = result['Body']['Data']['Inverters']['1']['SOC']
+        soc = powerflow['Inverters']['1']['SOC']
         return soc
 
+    def get_pv_power(self) -> float:
+        """ Current PV power in W, None if not available """
+        powerflow = self.get_powerflow()
+        if not powerflow:
+            return None
+        # P_PV is null while the inverter is sleeping at night
+        return float(powerflow['Site'].get('P_PV') or 0)
+
+    def get_load_power(self) -> float:
+        """ Current house consumption in W, None if not available """
+        powerflow = self.get_powerflow()
+        if not powerflow:
+            return None
+        # Fronius reports the consumption as negative value
+        return -float(powerflow['Site'].get('P_Load') or 0)
+
     def get_battery_config(self):
         """ Get battery configuration from inverter and keep a backup."""
         path = '/config/batteries'
@@ -432,13 +470,12 @@ class FroniusWR(InverterBaseclass):
                 headers['Authorization'] = self.get_auth_header(
                     method=method, path=fullpath)
             try:
-                response = requests.request(
-                                        method=method,
-                                        url=url,
+                response = self.client.request(
+                                        method,
+                                        url,
                                         params=params,
                                         headers=headers,
-                                        data=payload,
-                                        timeout=30
+                                        data=payload
                                     )
                 if response.status_code == 200:
                     return response
@@ -66,6 +66,20 @@ class InverterInterface(ABC):
             float: The SOC of the inverter in percentage.
         """
 
+    @abstractmethod
+    def get_pv_power(self) -> float:
+        """ Get the current PV power.
+        Returns:
+            float: The PV power in W or None if not available.
+        """
+
+    @abstractmethod
+    def get_load_power(self) -> float:
+        """ Get the current house consumption.
+        Returns:
+            float: The consumption in W or None if not available.
+        """
+
     @abstractmethod
     def activate_mqtt(self, api_mqtt_api: object):
         """ Activate the MQTT connection for the inverter """
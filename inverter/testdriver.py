@@ -12,6 +12,10 @@ logger.info('[Testdriver] loading module')
 # Following values can be set via MQTT:
 # - SOC (int): State of charge in percent
 #            : <mqtt_topic>/inverters/0/SOC/set
+# - PV power (float): Current PV power in W
+#            : <mqtt_topic>/inverters/0/pv_power/set
+# - Load power (float): Current house consumption in W
+#            : <mqtt_topic>/inverters/0/load_power/set
 
 
 class Testdriver(InverterBaseclass):
@@ -23,6 +27,8 @@ class Testdriver(InverterBaseclass):
         self.min_soc=8 # in percent
         self.max_soc=100 # in percent
         self.mode='allow_discharge'
+        self.pv_power=None # in W, None = not simulated
+        self.load_power=None # in W, None = not simulated
         self.mqtt_api = None
 
     def set_mode_force_charge(self,chargerate=500):
@@ -47,11 +53,33 @@ class Testdriver(InverterBaseclass):
         logger.info(f'[BatCtrl] testdriver API: Setting SOC: {SOC}%')
         self.SOC = SOC
 
+    def get_pv_power(self):
+        return self.pv_power
+
+    def get_load_power(self):
+        return self.load_power
+
+    def api_set_pv_power(self, pv_power:float):
+        if pv_power < 0:
+            logger.warning(f'[BatCtrl] testdriver API: Invalid PV power {pv_power}')
+            return
+        logger.info(f'[BatCtrl] testdriver API: Setting PV power: {pv_power}W')
+        self.pv_power = pv_power
+
+    def api_set_load_power(self, load_power:float):
+        if load_power < 0:
+            logger.warning(f'[BatCtrl] testdriver API: Invalid load power {load_power}')
+            return
+        logger.info(f'[BatCtrl] testdriver API: Setting load power: {load_power}W')
+        self.load_power = load_power
+
     def activate_mqtt(self, api_mqtt_api):  # no type here to prevent the need of loading mqtt_api
         import mqtt_api
         self.mqtt_api = api_mqtt_api
         # /set is appended to the topic
         self.mqtt_api.register_set_callback(self.__get_mqtt_topic() + 'SOC', self.api_set_SOC, int)
+        self.mqtt_api.register_set_callback(self.__get_mqtt_topic() + 'pv_power', self.api_set_pv_power, float)
+        self.mqtt_api.register_set_callback(self.__get_mqtt_topic() + 'load_power', self.api_set_load_power, float)
 
     def refresh_api_values(self):
         super().refresh_api_values()
@@ -1,45 +1,163 @@
 #! /usr/bin/env python
 import os
+import gzip
+import shutil
 import logging
+import tempfile
 logger = logging.getLogger('__main__')
 logger.info(f'[LogFileLimiter] loading module ')
 
+BLOCK_SIZE = 64 * 1024  # Copy files in blocks of 64 KB
+
 
 class LogFileLimiter:
-    def __init__(self, path, maxSize):
+    def __init__(self, path, maxSize, compressedSegments=0):
         """
         Initialize the LogFileLimiter class with the path to the file and the maximum size in kilobytes.
         :param path: Path to the log file.
         :param maxSize: Maximum file size in kilobytes.
+        :param compressedSegments: Number of pruned parts to keep as gzip files, 0 discards them.
         """
         self.path = path
         self.maxSize = maxSize * 1024  # Convert kilobytes to bytes
+        self.compressedSegments = compressedSegments
+        self.handler = None
+        # The size is tracked from the written bytes, see LimitedFileHandler
+        try:
+            self.currentSize = os.path.getsize(self.path)
+        except OSError:
+            self.currentSize = 0
+
+    def attach_handler(self, handler):
+        """
+        Attach the logging.FileHandler writing to the file. It is locked while pruning
+        and reopens the file afterwards.
+        :param handler: logging.FileHandler writing to path.
+        """
+        self.handler = handler
+
+    def add_written_bytes(self, numBytes):
+        """
+        Track the size of the file without asking the filesystem.
+        :param numBytes: Number of bytes appended to the file.
+        """
+        self.currentSize += numBytes
 
     def prune(self, pruneFactor):
         """
         Reduces the file size by deleting the earliest lines.
-        :param pruneFactor: The fraction of total lines to delete.
+        The remaining part is copied block by block to a temporary file, which replaces
+        the log file atomically. A crash while pruning leaves the old file intact.
+        :param pruneFactor: The fraction of the file size to delete.
         """
         if pruneFactor < 0 or pruneFactor > 1:
             raise ValueError("Prune factor must be between 0 and 1.")
 
         logger.info(f'[LogFileLimiter] File {self.path} is too large. File will be pruned by {pruneFactor*100:2.0f} %. ')
-        with open(self.path, 'r+') as file:
-            lines = file.readlines()
-            file.seek(0)
-            file.truncate()
-            file.writelines(lines[int(len(lines) * pruneFactor):])
+        if self.handler is not None:
+            self.handler.acquire()
+        try:
+            fileSize = os.path.getsize(self.path)
+            with open(self.path, 'rb') as source:
+                # cut at the next line ending after the prune offset
+                source.seek(int(fileSize * pruneFactor))
+                source.readline()
+                cutOffset = source.tell()
+
+                if self.compressedSegments > 0:
+                    self.__store_segment(source, cutOffset)
+                    source.seek(cutOffset)
+
+                directory = os.path.dirname(os.path.abspath(self.path))
+                with tempfile.NamedTemporaryFile('wb', dir=directory, delete=False) as target:
+                    try:
+                        shutil.copyfileobj(source, target, BLOCK_SIZE)
+                        # the temporary file is created with mode 0600, keep the
+                        # permissions of the log file for other readers
+                        self.__copy_permissions(self.path, target.name)
+                        target.flush()
+                        os.fsync(target.fileno())
+                    except BaseException:
+                        os.remove(target.name)
+                        raise
+            os.replace(target.name, self.path)
+            self.currentSize = fileSize - cutOffset
+
+            # Let the handler reopen the new file on the next record
+            if self.handler is not None and self.handler.stream is not None:
+                self.handler.stream.close()
+                self.handler.stream = None
+        finally:
+            if self.handler is not None:
+                self.handler.release()
+
+    @staticmethod
+    def __copy_permissions(source, target):
+        """
+        Copy mode and owner of source to target. Changing the owner requires
+        privileges, without them the owner of the process is kept.
+        :param source: Path of the original file.
+        :param target: Path of the file replacing it.
+        """
+        shutil.copymode(source, target)
+        if hasattr(os, 'chown'):
+            stat = os.stat(source)
+            try:
+                os.chown(target, stat.st_uid, stat.st_gid)
+            except PermissionError:
+                logger.debug(f'[LogFileLimiter] Could not keep the owner of {source}')
+
+    def __store_segment(self, source, cutOffset):
+        """
+        Keep the pruned part as compressed segment <path>.1.gz, older segments are shifted.
+        :param source: The opened log file.
+        :param cutOffset: Number of bytes to store from the start of the file.
+        """
+        oldest = f'{self.path}.{self.compressedSegments}.gz'
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for segment in range(self.compressedSegments - 1, 0, -1):
+            name = f'{self.path}.{segment}.gz'
+            if os.path.exists(name):
+                os.replace(name, f'{self.path}.{segment + 1}.gz')
+
+        source.seek(0)
+        remaining = cutOffset
+        with gzip.open(f'{self.path}.1.gz', 'wb') as segmentFile:
+            while remaining > 0:
+                block = source.read(min(BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                segmentFile.write(block)
+                remaining -= len(block)
 
     def run(self):
         """
         Checks the file size and calls the prune method if necessary.
         """
-        fileSize = os.path.getsize(self.path)
-        if fileSize > self.maxSize:
+        if self.currentSize > self.maxSize:
             # Determine the prune factor, at least 10%
-            pruneFactor = max(0.1, 1 - self.maxSize / fileSize)
+            pruneFactor = max(0.1, 1 - self.maxSize / self.currentSize)
             self.prune(pruneFactor)
 
+
+class LimitedFileHandler(logging.FileHandler):
+    """
+    FileHandler which reports the written bytes to a LogFileLimiter,
+    so it does not need to check the file size on every run.
+    """
+    def __init__(self, limiter, encoding=None):
+        super().__init__(limiter.path, encoding=encoding)
+        self.limiter = limiter
+        limiter.attach_handler(self)
+
+    def format(self, record):
+        message = super().format(record)
+        # Characters, not bytes. Good enough, the size is synced on prune.
+        self.limiter.add_written_bytes(len(message) + len(self.terminator))
+        return message
+
+
 # Example usage
 if __name__ == "__main__":
     limiter = LogFileLimiter("test copy.log", 20)  # Maximum size of 20 KB
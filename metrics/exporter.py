@@ -0,0 +1,62 @@
+""" HTTP endpoint serving /metrics for Prometheus
+
+The server runs in a daemon thread and only serves GET /metrics.
+"""
+import threading
+import logging
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from . import metrics
+
+logger = logging.getLogger('__main__')
+logger.info('[Metrics] loading module')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """ Serve the registry in the Prometheus text format """
+    registry = metrics.REGISTRY
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ Handle GET requests """
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """ Do not log every scrape to stderr """
+        logger.debug('[Metrics] ' + format, *args)
+
+
+class MetricsExporter:
+    """ Serve metrics on http://<address>:<port>/metrics """
+    def __init__(self, config:dict):
+        self.address = config.get('address', '0.0.0.0')
+        self.port = int(config.get('port', 9977))
+        self.server = None
+        self.thread = None
+
+    def start(self) -> None:
+        """ Start the HTTP server in a background thread """
+        self.server = ThreadingHTTPServer((self.address, self.port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(
+            target=self.server.serve_forever,
+            name='metrics-exporter',
+            daemon=True
+        )
+        self.thread.start()
+        logger.info('[Metrics] Serving metrics on http://%s:%d/metrics', self.address, self.port)
+
+    def shutdown(self) -> None:
+        """ Stop the HTTP server """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,289 @@
+""" Lightweight metrics in Prometheus/OpenMetrics text format
+
+Only the standard library is used, so no additional dependency is needed.
+Metrics are always recorded, which is cheap. They are only exposed if the
+MetricsExporter is enabled in the configuration.
+
+All metrics of batcontrol are defined in this module, so the names stay
+consistent between the different modules recording them.
+"""
+import os
+import time
+import threading
+import resource
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labelnames, labelvalues, extra=None) -> str:
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [
+        name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in pairs
+    ]
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value:float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric:
+    """ Parent class for all metric types """
+    metric_type = 'untyped'
+
+    def __init__(self, name:str, documentation:str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels:dict) -> tuple:
+        if set(labels.keys()) != set(self.labelnames):
+            raise ValueError(f'[Metrics] {self.name} requires labels {self.labelnames}')
+        return tuple(labels[name] for name in self.labelnames)
+
+    def expose(self) -> list:
+        """ Return the lines of the text format """
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.metric_type}'
+        ]
+        with self.lock:
+            items = list(self.values.items())
+        for labelvalues, value in items:
+            lines.append(
+                f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}'
+            )
+        return lines
+
+
+class Counter(Metric):
+    """ Monotonic counter """
+    metric_type = 'counter'
+
+    def inc(self, amount:float=1, **labels) -> None:
+        """ Increase the counter """
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def expose(self) -> list:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.metric_type}'
+        ]
+        with self.lock:
+            items = list(self.values.items())
+        for labelvalues, value in items:
+            lines.append(
+                f'{self.name}_total{_format_labels(self.labelnames, labelvalues)} '
+                f'{_format_value(value)}'
+            )
+        return lines
+
+
+class Gauge(Metric):
+    """ Value which can go up and down, or is calculated on scrape """
+    metric_type = 'gauge'
+
+    def __init__(self, name:str, documentation:str, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value:float, **labels) -> None:
+        """ Set the gauge """
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def expose(self) -> list:
+        if self.function is not None:
+            with self.lock:
+                self.values[()] = self.function()
+        return super().expose()
+
+
+class Histogram(Metric):
+    """ Distribution of values in cumulative buckets """
+    metric_type = 'histogram'
+
+    def __init__(self, name:str, documentation:str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value:float, **labels) -> None:
+        """ Add an observation """
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # bucket counts, sum, count
+                state = [[0] * len(self.buckets), 0.0, 0]
+                self.values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """ Observe the duration of a with block in seconds """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def expose(self) -> list:
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.metric_type}'
+        ]
+        with self.lock:
+            items = [(key, (list(state[0]), state[1], state[2]))
+                     for key, state in self.values.items()]
+        for labelvalues, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    """ Collection of all metrics to expose """
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric:Metric) -> Metric:
+        """ Add a metric and return it """
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        """ Render all metrics in the Prometheus text format """
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+def get_resident_memory() -> float:
+    """ Resident set size of the process in bytes """
+    try:
+        with open('/proc/self/statm', 'r', encoding='utf-8') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # maximum RSS, reported in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+REGISTRY = Registry()
+
+EVALUATION_DURATION = REGISTRY.register(Histogram(
+    'batcontrol_evaluation_duration_seconds',
+    'Duration of the evaluation stages (fetch, decide, actuate, publish, total)',
+    ['stage']
+))
+PROVIDER_REQUEST_DURATION = REGISTRY.register(Histogram(
+    'batcontrol_provider_request_duration_seconds',
+    'Duration of HTTP requests to external providers and the inverter',
+    ['provider']
+))
+PROVIDER_REQUESTS = REGISTRY.register(Counter(
+    'batcontrol_provider_requests',
+    'HTTP requests to external providers and the inverter',
+    ['provider']
+))
+PROVIDER_ERRORS = REGISTRY.register(Counter(
+    'batcontrol_provider_errors',
+    'Failed HTTP requests to external providers and the inverter',
+    ['provider']
+))
+PROVIDER_RATE_LIMITED = REGISTRY.register(Counter(
+    'batcontrol_provider_rate_limited',
+    'HTTP requests answered with 429 Too Many Requests',
+    ['provider']
+))
+PROVIDER_CACHE_HITS = REGISTRY.register(Counter(
+    'batcontrol_provider_cache_hits',
+    'Forecast requests served from the local cache',
+    ['provider']
+))
+PROVIDER_RESPONSE_BYTES = REGISTRY.register(Counter(
+    'batcontrol_provider_response_bytes',
+    'Bytes received from forecast and tariff providers',
+    ['provider']
+))
+PROVIDER_NOT_MODIFIED = REGISTRY.register(Counter(
+    'batcontrol_provider_not_modified',
+    'Conditional requests answered with 304 Not Modified',
+    ['provider']
+))
+INVERTER_WRITES = REGISTRY.register(Counter(
+    'batcontrol_inverter_writes',
+    'Mode changes written to the inverter',
+    ['mode']
+))
+LOOP_DRIFT = REGISTRY.register(Gauge(
+    'batcontrol_loop_drift_seconds',
+    'Delay of the last periodic evaluation against its scheduled tick'
+))
+LOOP_DRIFT_HISTOGRAM = REGISTRY.register(Histogram(
+    'batcontrol_loop_drift_distribution_seconds',
+    'Delay of periodic evaluations against their scheduled tick',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 15, 30, 60)
+))
+STARTUP_DURATION = REGISTRY.register(Gauge(
+    'batcontrol_startup_duration_seconds',
+    'Duration of the startup stages, stages run partly in parallel',
+    ['stage']
+))
+NOWCAST_RATIO = REGISTRY.register(Gauge(
+    'batcontrol_nowcast_ratio',
+    'Smoothed ratio of measured and forecast PV production'
+))
+RESIDENT_MEMORY = REGISTRY.register(Gauge(
+    'process_resident_memory_bytes',
+    'Resident memory size in bytes',
+    function=get_resident_memory
+))
+
+
+def record_request(provider:str, duration:float, status_code:int=None) -> None:
+    """ Record a finished HTTP request. status_code None means that no
+        response was received (connection error, timeout).
+    """
+    PROVIDER_REQUESTS.inc(provider=provider)
+    PROVIDER_REQUEST_DURATION.observe(duration, provider=provider)
+    if status_code is None or status_code >= 400:
+        PROVIDER_ERRORS.inc(provider=provider)
+    if status_code == 429:
+        PROVIDER_RATE_LIMITED.inc(provider=provider)
+
+
+def timed_request(provider:str, request_function:callable, *args, **kwargs):
+    """ Call request_function (e.g. requests.get) and record duration and result """
+    start = time.perf_counter()
+    try:
+        response = request_function(*args, **kwargs)
+    except Exception:
+        record_request(provider, time.perf_counter() - start)
+        raise
+    record_request(provider, time.perf_counter() - start, response.status_code)
+    return response
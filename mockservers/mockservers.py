@@ -0,0 +1,358 @@
+""" Local stand-in servers for the external APIs
+
+Small HTTP servers with the response shapes parsed by the providers, for
+tests and benchmarks without the real services:
+- AwattarServer: /v1/marketdata
+- TibberServer: GraphQL priceInfo with today and tomorrow
+- EvccServer: /api/tariff/grid and /api/tariff/solar as result.rates,
+  for the evcc tariff and the evcc solar forecast
+- ForecastSolarServer: estimate/watthours/period with result and
+  message.info, X-Ratelimit-* headers and 429 with X-Ratelimit-Retry-At
+- OpenMeteoServer: /v1/forecast with hourly global_tilted_irradiance
+
+Prices and production are generated for the time of the request. Tomorrow's
+prices are only returned after the day-ahead publication at 13:00 CET.
+
+Every server has Faults (latency, jitter, error rate) and an optional rate
+limit, which can be changed while the server is running:
+
+    with AwattarServer(Faults(latency=0.05, error_rate=0.1)) as server:
+        config['utility']['api_url'] = server.url + '/v1/marketdata'
+"""
+import json
+import math
+import time
+import random
+import datetime
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import pytz
+from dynamictariff.baseclass import get_expected_end
+
+logger = logging.getLogger('__main__')
+
+DEFAULT_TIMEZONE = 'Europe/Berlin'
+
+
+class Faults:
+    """ Injected failures of a stand-in server """
+    def __init__(self, latency:float=0, jitter:float=0, error_rate:float=0,
+                 error_status:int=503, seed:int=None):
+        self.latency = latency  # seconds before every response
+        self.jitter = jitter  # additional uniformly distributed seconds
+        self.error_rate = error_rate  # share of requests answered with error_status
+        self.error_status = error_status
+        self.random = random.Random(seed)
+
+    def delay(self) -> float:
+        """ Seconds to wait before the next response """
+        return self.latency + self.jitter * self.random.random()
+
+    def fail(self) -> bool:
+        """ True if the next request should fail """
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+
+def market_price(timestamp:float) -> float:
+    """ Deterministic day-ahead price in EUR/MWh with morning and evening peaks """
+    hour = (timestamp % 86400) / 3600
+    return 90 + 40 * math.sin((hour - 5) / 24 * 4 * math.pi) + 10 * math.sin(timestamp / 86400)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately, avoid the delayed ACK of keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.__handle('GET')
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        self.__handle('POST')
+
+    def __handle(self, method:str):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        status, headers, payload = self.server.owner.dispatch(method, self.path, body)
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StandInServer:
+    """ Base class of the stand-in servers, listens on a free local port """
+    def __init__(self, faults:Faults=None, rate_limit:tuple=None,
+                 timezone:str=DEFAULT_TIMEZONE):
+        self.faults = faults or Faults()
+        # (requests, period in seconds) or None
+        self.rate_limit = rate_limit
+        self.timezone = pytz.timezone(timezone)
+        self.request_count = 0
+        self.request_times = []
+        self.lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        """ Base url without trailing slash """
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'StandInServer':
+        """ Serve in a background thread """
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.owner = self
+        self.thread = threading.Thread(
+            target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        """ Stop serving and close the socket """
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def dispatch(self, method:str, path:str, body:bytes) -> tuple:
+        """ Apply faults and rate limit, then create the response """
+        now = time.time()
+        with self.lock:
+            self.request_count += 1
+            remaining = None
+            if self.rate_limit is not None:
+                limit, period = self.rate_limit
+                self.request_times = [t for t in self.request_times if t > now - period]
+                if len(self.request_times) >= limit:
+                    retry_at = self.request_times[0] + period
+                    remaining = -1
+                else:
+                    self.request_times.append(now)
+                    remaining = limit - len(self.request_times)
+        delay = self.faults.delay()
+        if delay > 0:
+            time.sleep(delay)
+        if remaining == -1:
+            return self.rate_limited(now, retry_at)
+        if self.faults.fail():
+            return self.faults.error_status, {}, {'error': 'injected failure'}
+        status, headers, payload = self.respond(method, urlsplit(path).path, body, now)
+        if remaining is not None:
+            headers.update(self.rate_limit_headers(remaining))
+        return status, headers, payload
+
+    def rate_limit_headers(self, remaining:int) -> dict:
+        """ Headers of a response within the rate limit """
+        return {}
+
+    def rate_limited(self, now:float, retry_at:float) -> tuple:
+        """ Response if the rate limit is exceeded """
+        return 429, {'Retry-After': str(int(math.ceil(retry_at - now)))}, \
+            {'error': 'rate limit exceeded'}
+
+    def respond(self, method:str, path:str, body:bytes, now:float) -> tuple:
+        """ (status, headers, json payload) of a request """
+        raise NotImplementedError
+
+    def published_hours(self, now:float) -> list:
+        """ Start timestamps of the hours with published prices """
+        local = datetime.datetime.fromtimestamp(now, self.timezone)
+        day_start = self.timezone.localize(
+            datetime.datetime.combine(local.date(), datetime.time())).timestamp()
+        end = get_expected_end(now)
+        return [day_start + i * 3600 for i in range(int((end - day_start) // 3600))]
+
+    def isoformat(self, timestamp:float) -> str:
+        """ Local ISO 8601 time with offset """
+        return datetime.datetime.fromtimestamp(timestamp, self.timezone).isoformat()
+
+
+class AwattarServer(StandInServer):
+    """ Awattar marketdata, url: <server.url>/v1/marketdata """
+    def respond(self, method, path, body, now):
+        if path != '/v1/marketdata':
+            return 404, {}, {'error': 'not found'}
+        current_hour = now - now % 3600
+        data = [{
+            'start_timestamp': int(start * 1000),
+            'end_timestamp': int((start + 3600) * 1000),
+            'marketprice': round(market_price(start), 2),
+            'unit': 'Eur/MWh',
+        } for start in self.published_hours(now) if start >= current_hour]
+        return 200, {}, {'object': 'list', 'data': data, 'url': '/v1/marketdata'}
+
+
+class TibberServer(StandInServer):
+    """ Tibber GraphQL priceInfo, url: <server.url>/v1-beta/gql """
+    def respond(self, method, path, body, now):
+        if method != 'POST' or path != '/v1-beta/gql':
+            return 404, {}, {'error': 'not found'}
+        hours = self.published_hours(now)
+
+        def price(start):
+            return {'total': round(market_price(start) / 1000 * 1.19 + 0.15, 4),
+                    'startsAt': self.isoformat(start)}
+        today = [price(start) for start in hours[:24]]
+        tomorrow = [price(start) for start in hours[24:]]
+        current = price(now - now % 3600)
+        price_info = {'current': current, 'today': today, 'tomorrow': tomorrow}
+        return 200, {}, {'data': {'viewer': {'homes': [
+            {'currentSubscription': {'priceInfo': price_info}}
+        ]}}}
+
+
+class EvccServer(StandInServer):
+    """ evcc tariffs, urls: <server.url>/api/tariff/grid and /api/tariff/solar """
+    def __init__(self, faults:Faults=None, rate_limit:tuple=None,
+                 timezone:str=DEFAULT_TIMEZONE, peak_power:float=10000):
+        super().__init__(faults, rate_limit, timezone)
+        self.peak_power = peak_power
+
+    def respond(self, method, path, body, now):
+        current_hour = now - now % 3600
+        if path == '/api/tariff/grid':
+            rates = [{
+                'start': self.isoformat(start),
+                'end': self.isoformat(start + 3600),
+                'price': round(market_price(start) / 1000 + 0.15, 4),
+            } for start in self.published_hours(now) if start >= current_hour]
+        elif path == '/api/tariff/solar':
+            rates = [{
+                'start': self.isoformat(start),
+                'end': self.isoformat(start + 900),
+                'value': round(self.__solar_power(start + 450), 1),
+            } for start in (current_hour + i * 900 for i in range(48 * 4))]
+        else:
+            return 404, {}, {'error': 'not found'}
+        return 200, {}, {'result': {'rates': rates}}
+
+    def __solar_power(self, timestamp:float) -> float:
+        hour = datetime.datetime.fromtimestamp(timestamp, self.timezone).hour \
+            + (timestamp % 3600) / 3600
+        return max(0.0, self.peak_power * math.sin((hour - 6) / 14 * math.pi)) \
+            if 6 < hour < 20 else 0.0
+
+
+class ForecastSolarServer(StandInServer):
+    """ forecast.solar estimate, fcsolar_url: <server.url>/
+
+        Answers /[apikey/]estimate/watthours/period/lat/lon/dec/az/kwp with
+        the energy per hour of the next hours from the start of the day,
+        keyed by the local end of the period.
+    """
+    def __init__(self, faults:Faults=None, rate_limit:tuple=(12, 3600),
+                 timezone:str=DEFAULT_TIMEZONE, hours:int=48):
+        super().__init__(faults, rate_limit, timezone)
+        self.hours = hours
+
+    def rate_limit_headers(self, remaining:int) -> dict:
+        limit, period = self.rate_limit
+        return {
+            'X-Ratelimit-Limit': str(limit),
+            'X-Ratelimit-Period': str(period),
+            'X-Ratelimit-Remaining': str(remaining),
+        }
+
+    def rate_limited(self, now, retry_at):
+        limit, period = self.rate_limit
+        headers = self.rate_limit_headers(0)
+        headers['X-Ratelimit-Retry-At'] = self.isoformat(retry_at)
+        return 429, headers, {
+            'result': None,
+            'message': {
+                'code': 429,
+                'type': 'error',
+                'text': 'Rate limit for API calls reached.',
+                'ratelimit': {'period': period, 'limit': limit, 'retry-at': headers[
+                    'X-Ratelimit-Retry-At']},
+            }
+        }
+
+    def respond(self, method, path, body, now):
+        parts = path.strip('/').split('/')
+        if 'estimate' not in parts:
+            return 404, {}, {'error': 'not found'}
+        try:
+            kwp = float(parts[-1])
+        except ValueError:
+            return 400, {}, {'message': {'code': 400, 'type': 'error', 'text': 'Bad request'}}
+
+        local = datetime.datetime.fromtimestamp(now, self.timezone)
+        day_start = self.timezone.localize(
+            datetime.datetime.combine(local.date(), datetime.time())).timestamp()
+        result = {}
+        for i in range(1, self.hours):
+            period_end = day_start + i * 3600
+            hour = datetime.datetime.fromtimestamp(period_end, self.timezone).hour
+            energy = max(0.0, kwp * 700 * math.sin((hour - 6.5) / 14 * math.pi)) \
+                if 6 < hour < 21 else 0.0
+            key = datetime.datetime.fromtimestamp(period_end, self.timezone) \
+                .strftime('%Y-%m-%d %H:%M:%S')
+            result[key] = round(energy)
+        return 200, {}, {
+            'result': result,
+            'message': {
+                'code': 0,
+                'type': 'success',
+                'text': '',
+                'info': {
+                    'place': 'stand-in',
+                    'timezone': self.timezone.zone,
+                    'time': local.isoformat(),
+                    'time_utc': datetime.datetime.fromtimestamp(
+                        now, datetime.timezone.utc).isoformat(),
+                },
+            }
+        }
+
+
+class OpenMeteoServer(StandInServer):
+    """ Open-Meteo irradiance forecast, openmeteo_url: <server.url>/v1/forecast
+
+        Answers every installation with the global tilted irradiance in W/m2
+        of the hours from the start of the day, as means of the preceding
+        hour with unixtime timestamps.
+    """
+    def __init__(self, faults:Faults=None, rate_limit:tuple=None,
+                 timezone:str=DEFAULT_TIMEZONE, days:int=2, peak_irradiance:float=900):
+        super().__init__(faults, rate_limit, timezone)
+        self.days = days
+        self.peak_irradiance = peak_irradiance
+
+    def respond(self, method, path, body, now):
+        if path != '/v1/forecast':
+            return 404, {}, {'error': True, 'reason': 'not found'}
+        local = datetime.datetime.fromtimestamp(now, self.timezone)
+        day_start = self.timezone.localize(
+            datetime.datetime.combine(local.date(), datetime.time())).timestamp()
+        times = [int(day_start + i * 3600) for i in range(1, self.days * 24 + 1)]
+        irradiance = []
+        for period_end in times:
+            # mean of the preceding hour, taken at its middle
+            hour = datetime.datetime.fromtimestamp(period_end - 1800, self.timezone).hour + 0.5
+            irradiance.append(round(
+                max(0.0, self.peak_irradiance * math.sin((hour - 6) / 14 * math.pi))
+                if 6 < hour < 20 else 0.0, 1))
+        return 200, {}, {
+            'timezone': 'GMT',
+            'hourly_units': {'time': 'unixtime', 'global_tilted_irradiance': 'W/m²'},
+            'hourly': {'time': times, 'global_tilted_irradiance': irradiance},
+        }
@@ -33,14 +33,17 @@ Implemented Input-API:
 - /always_allow_discharge_limit/set: set always discharge limit in 0.1-1
 - /max_charging_from_grid_limit/set: set charge limit in 0-1
 - /min_price_difference/set: set minimum price difference in EUR
+- /profile/set: profile the next n evaluations with cProfile, results in the logs directory
+- /profile_memory/set: trace memory growth over the next n evaluations
 
 The module uses the paho-mqtt library for MQTT communication and numpy for handling arrays.
+The MQTT client is provided by mqtt_connection and shared with EvccApi, if both are
+configured for the same broker.
 """
-import time
 import json
 import logging
-import paho.mqtt.client as mqtt
 import numpy as np
+import mqtt_connection
 
 logger = logging.getLogger('__main__')
 logger.info('[MQTT] loading module ')
@@ -54,67 +57,24 @@ class MqttApi:
 
         self.callbacks = {}
 
-        self.client = mqtt.Client()
-        if 'logger' in config and config['logger'] is True:
-            self.client.enable_logger(logger)
+        # Shared with EvccApi if both use the same broker and credentials
+        self.connection = mqtt_connection.get_connection(config)
+        self.client = self.connection.client
 
-        if 'username' in config and 'password' in config:
-            self.client.username_pw_set(config['username'], config['password'])
+        self.connection.set_will(self.base_topic + '/status', 'offline', retain=True)
+        self.connection.add_on_connect_callback(self.on_connect)
+        self.connection.connect()
 
-        self.client.will_set(self.base_topic + '/status', 'offline', retain=True)
-
-        # TLS , not tested yet
-        if config['tls'] is True:
-            self.client.tls_set(
-                config['tls']['ca_certs'],
-                config['tls']['certfile'],
-                config['tls']['keyfile'],
-                cert_reqs=config['tls']['cert_reqs'],
-                tls_version=config['tls']['tls_version'],
-                ciphers=config['tls']['ciphers']
-            )
-
-        self.client.on_connect = self.on_connect
-        self.client.loop_start()
-        retry_attempts = config.get('retry_attempts', 5)
-        retry_delay = config.get('retry_delay', 10)
-        while retry_attempts > 0:
-            try:
-                self.client.connect(config['broker'], config['port'], 60)
-                break
-            except Exception as e:
-                logger.error('[MQTT] Connection failed: %s, retrying[%d]x in [%d] seconds', e, retry_attempts, retry_delay)
-                retry_attempts -= 1
-                if retry_attempts == 0:
-                    logger.error('[MQTT] All retry attempts failed')
-                    raise
-                logger.info('[MQTT] Retrying connection in %d seconds...', retry_delay)
-                time.sleep(retry_delay)
-
-    def on_connect(self, client, userdata, flags, rc):
-        """ Callback for MQTT connection to serve /status"""
-        logger.info('[MQTT] Connected with result code %s', rc)
+    def on_connect(self, client):
+        """ Callback for MQTT connection to serve /status
+            Subscriptions are restored by the shared connection.
+        """
         # Make public, that we are running.
         client.publish(self.base_topic + '/status', 'online', retain=True)
-        # Handle reconnect case
-        for topic in self.callbacks:
-            logger.debug('[MQTT] Subscribing topic: %s', topic)
-            for topic in self.callbacks:
-                client.subscribe(topic)
 
     def wait_ready(self) -> bool:
         """ Wait for MQTT connection to be ready"""
-        retry = 30
-        # Check if we are connected and wait for it
-        while self.client.is_connected() is False:
-            retry -= 1
-            if retry == 0:
-                logger.error('[MQTT] Could not connect to MQTT Broker')
-                return False
-            logger.info('[MQTT] Waiting for connection')
-            time.sleep(1)
-
-        return True
+        return self.connection.wait_ready()
 
     def _handle_message(self, client, userdata, message):  # pylint: disable=unused-argument
         """ Handle and dispatch incoming messages"""
@@ -137,8 +97,7 @@ class MqttApi:
         logger.debug('[MQTT] Registering callback for %s', topic_string)
                 # set api endpoints, generic subscription
         self.callbacks[topic_string] = { 'function' : callback , 'convert' : convert }
-        self.client.subscribe(topic_string)
-        self.client.message_callback_add(topic_string , self._handle_message)
+        self.connection.subscribe(topic_string, self._handle_message)
 
     def publish_mode(self, mode:int) -> None:
         """ Publish the mode (charge, lock, discharge) to MQTT
@@ -154,7 +113,7 @@ class MqttApi:
         if self.client.is_connected():
             self.client.publish(self.base_topic + '/charge_rate', rate)
 
-    def publish_production(self, production:np.ndarray, timestamp:float) -> None:
+    def publish_production(self, production:np.ndarray, timestamp:float, step:int=3600) -> None:
         """ Publish the production to MQTT
             /FCST/production
             The value is in W and based of solar forecast API.
@@ -163,24 +122,24 @@ class MqttApi:
         if self.client.is_connected():
             self.client.publish(
                 self.base_topic + '/FCST/production',
-                json.dumps(self._create_forecast(production, timestamp))
+                json.dumps(self._create_forecast(production, timestamp, step))
             )
 
-    def _create_forecast(self, forecast:np.ndarray, timestamp:float) -> dict:
+    def _create_forecast(self, forecast:np.ndarray, timestamp:float, step:int=3600) -> dict:
         """ Create a forecast JSON object
-            from a numpy array and a timestamp
+            from a numpy array and a timestamp, with slots of step seconds
         """
-        # Take timestamp and reduce it to the first second of the hour
-        now = timestamp - (timestamp % 3600)
+        # Take timestamp and reduce it to the first second of the slot
+        now = timestamp - (timestamp % step)
 
         data_list = []
         for h, value in enumerate(forecast):
-            # next hour after now
+            # next slot after now
             data_list.append(
             {
-                'time_start': now + h * 3600,
+                'time_start': now + h * step,
                 'value': value,
-                'time_end': now - h + (h + 1) * 3600
+                'time_end': now - h + (h + 1) * step
             }
             )
 
@@ -188,7 +147,7 @@ class MqttApi:
         return data
 
 
-    def publish_consumption(self, consumption:np.ndarray, timestamp:float) -> None:
+    def publish_consumption(self, consumption:np.ndarray, timestamp:float, step:int=3600) -> None:
         """ Publish the consumption to MQTT
             /FCST/consumption
             The value is in W and based of load profile and multiplied with
@@ -198,10 +157,10 @@ class MqttApi:
         if self.client.is_connected():
             self.client.publish(
                 self.base_topic + '/FCST/consumption',
-                json.dumps(self._create_forecast(consumption,timestamp))
+                json.dumps(self._create_forecast(consumption, timestamp, step))
             )
 
-    def publish_prices(self, price:np.ndarray ,timestamp:float) -> None:
+    def publish_prices(self, price:np.ndarray ,timestamp:float, step:int=3600) -> None:
         """ Publish the prices to MQTT
             /FCST/prices
             The length is the same as used in internal arrays.
@@ -209,10 +168,10 @@ class MqttApi:
         if self.client.is_connected():
             self.client.publish(
                 self.base_topic + '/FCST/prices',
-                json.dumps(self._create_forecast(price,timestamp))
+                json.dumps(self._create_forecast(price, timestamp, step))
             )
 
-    def publish_net_consumption(self, net_consumption:np.ndarray, timestamp:float) -> None:
+    def publish_net_consumption(self, net_consumption:np.ndarray, timestamp:float, step:int=3600) -> None:
         """ Publish the net consumption in W to MQTT
             /FCST/net_consumption
             The length is the same as used in internal arrays.
@@ -221,7 +180,7 @@ class MqttApi:
         if self.client.is_connected():
             self.client.publish(
                 self.base_topic + '/FCST/net_consumption',
-                json.dumps(self._create_forecast(net_consumption,timestamp))
+                json.dumps(self._create_forecast(net_consumption, timestamp, step))
             )
 
     def publish_SOC(self, soc:float) -> None:       # pylint: disable=invalid-name
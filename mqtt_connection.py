@@ -0,0 +1,208 @@
+"""
+This module provides shared MQTT connections for MqttApi and EvccApi.
+
+If both APIs are configured against the same broker with the same
+credentials, they share one paho client, one network thread and one socket.
+Connections are identified by broker, port, username, password and TLS
+settings.
+
+Subscriptions of all users are routed through a single dispatcher:
+- exact topics are resolved with a dict lookup
+- wildcard subscriptions are matched once per topic and the result is cached
+
+On (re-)connect all registered subscriptions are restored in a single
+SUBSCRIBE packet.
+"""
+import time
+import threading
+import logging
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger('__main__')
+logger.info('[MQTT] loading connection module')
+
+WAIT_READY_TIMEOUT = 30  # seconds
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def get_connection(config:dict) -> 'MqttConnection':
+    """ Return the shared connection for the broker and credentials
+        in config. Creates a new one, if none exists yet.
+    """
+    key = MqttConnection.get_key(config)
+    with _connections_lock:
+        connection = _connections.get(key)
+        if connection is None:
+            logger.info('[MQTT] Creating connection to %s:%s', key[0], key[1])
+            connection = MqttConnection(config)
+            _connections[key] = connection
+        else:
+            logger.info('[MQTT] Reusing connection to %s:%s', key[0], key[1])
+    return connection
+
+
+class MqttConnection:
+    """ A single MQTT client shared by multiple APIs """
+    def __init__(self, config:dict):
+        self.config = config
+        self.started = False
+        self.start_lock = threading.Lock()
+        self.connected = threading.Event()
+
+        # topic filter -> list of callbacks(client, userdata, message)
+        self.subscriptions = {}
+        self.wildcard_filters = []
+        # topic -> list of callbacks, resolved wildcards are cached here
+        self.dispatch_cache = {}
+        self.subscription_lock = threading.Lock()
+
+        self.on_connect_callbacks = []
+
+        self.client = mqtt.Client()
+        if 'logger' in config and config['logger'] is True:
+            self.client.enable_logger(logger)
+
+        if 'username' in config and 'password' in config:
+            self.client.username_pw_set(config['username'], config['password'])
+
+        # TLS , not tested yet
+        if config['tls'] is True:
+            self.client.tls_set(
+                config['tls']['ca_certs'],
+                config['tls']['certfile'],
+                config['tls']['keyfile'],
+                cert_reqs=config['tls']['cert_reqs'],
+                tls_version=config['tls']['tls_version'],
+                ciphers=config['tls']['ciphers']
+            )
+
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+
+    @staticmethod
+    def get_key(config:dict) -> tuple:
+        """ Identify a connection by broker and credentials """
+        return (
+            config['broker'],
+            int(config['port']),
+            config.get('username'),
+            config.get('password'),
+            config.get('tls') is True
+        )
+
+    def set_will(self, topic:str, payload:str, retain:bool=False) -> None:
+        """ Set the last will, needs to be called before connect() """
+        if self.started:
+            logger.warning('[MQTT] Connection already started, can not set will for %s', topic)
+            return
+        self.client.will_set(topic, payload, retain=retain)
+
+    def add_on_connect_callback(self, callback:callable) -> None:
+        """ Register a function(client) called on every (re-)connect """
+        self.on_connect_callbacks.append(callback)
+        if self.connected.is_set():
+            callback(self.client)
+
+    def connect(self) -> None:
+        """ Connect to the broker. Only the first call connects,
+            later calls of other users of this connection return immediately.
+        """
+        with self.start_lock:
+            if self.started:
+                return
+            self.started = True
+            self.client.loop_start()
+            retry_attempts = self.config.get('retry_attempts', 5)
+            retry_delay = self.config.get('retry_delay', 10)
+            while retry_attempts > 0:
+                try:
+                    self.client.connect(self.config['broker'], self.config['port'], 60)
+                    break
+                except Exception as e:
+                    logger.error(
+                        '[MQTT] Connection failed: %s, retrying[%d]x in [%d] seconds',
+                        e, retry_attempts, retry_delay
+                    )
+                    retry_attempts -= 1
+                    if retry_attempts == 0:
+                        logger.error('[MQTT] All retry attempts failed')
+                        raise
+                    logger.info('[MQTT] Retrying connection in %d seconds...', retry_delay)
+                    time.sleep(retry_delay)
+
+    def wait_ready(self, timeout:float=WAIT_READY_TIMEOUT) -> bool:
+        """ Wait for the connection to be established """
+        if self.connected.wait(timeout):
+            return True
+        logger.error('[MQTT] Could not connect to MQTT Broker')
+        return False
+
+    def is_connected(self) -> bool:
+        """ Check if the connection is established """
+        return self.client.is_connected()
+
+    def subscribe(self, topic:str, callback:callable) -> None:
+        """ Subscribe callback(client, userdata, message) to a topic filter.
+            The subscription survives reconnects.
+        """
+        with self.subscription_lock:
+            new_topic = topic not in self.subscriptions
+            if new_topic:
+                self.subscriptions[topic] = []
+                if '+' in topic or '#' in topic:
+                    self.wildcard_filters.append(topic)
+            if callback not in self.subscriptions[topic]:
+                self.subscriptions[topic].append(callback)
+            self.dispatch_cache = {}
+        if new_topic and self.connected.is_set():
+            logger.debug('[MQTT] Subscribing topic: %s', topic)
+            self.client.subscribe(topic)
+
+    def _on_connect(self, client, userdata, flags, rc):  # pylint: disable=unused-argument
+        """ Restore subscriptions and notify users of this connection """
+        if rc != 0:
+            # paho retries in the network loop, wait_ready() keeps waiting
+            logger.error('[MQTT] Connection refused with result code %s', rc)
+            return
+        logger.info('[MQTT] Connected with result code %s', rc)
+        with self.subscription_lock:
+            topics = list(self.subscriptions.keys())
+        if topics:
+            logger.debug('[MQTT] Subscribing topics: %s', topics)
+            client.subscribe([(topic, 0) for topic in topics])
+        self.connected.set()
+        for callback in self.on_connect_callbacks:
+            callback(client)
+
+    def _on_disconnect(self, client, userdata, rc):  # pylint: disable=unused-argument
+        """ Track connection state for wait_ready() """
+        logger.warning('[MQTT] Disconnected with result code %s', rc)
+        self.connected.clear()
+
+    def __resolve_callbacks(self, topic:str) -> list:
+        """ Find all callbacks for a topic, cached per topic """
+        callbacks = self.dispatch_cache.get(topic)
+        if callbacks is not None:
+            return callbacks
+        with self.subscription_lock:
+            callbacks = list(self.subscriptions.get(topic, []))
+            for topic_filter in self.wildcard_filters:
+                if mqtt.topic_matches_sub(topic_filter, topic):
+                    callbacks.extend(self.subscriptions[topic_filter])
+            self.dispatch_cache[topic] = callbacks
+        return callbacks
+
+    def _on_message(self, client, userdata, message):
+        """ Dispatch incoming messages to the subscribed callbacks """
+        callbacks = self.__resolve_callbacks(message.topic)
+        if not callbacks:
+            logger.warning('[MQTT] No callback registered for %s', message.topic)
+            return
+        for callback in callbacks:
+            try:
+                callback(client, userdata, message)
+            except Exception as e:
+                logger.error('[MQTT] Error in callback %s : %s', message.topic, e)
@@ -0,0 +1,144 @@
+""" On-demand profiling of the running service
+
+A profiling request (SIGUSR1 or MQTT) wraps the next N evaluation cycles:
+- mode 'cpu': cProfile, writes profile_<time>.prof and a summary
+  profile_<time>.txt with the top functions.
+- mode 'memory': tracemalloc, compares a snapshot before the first and
+  after the last cycle and writes memory_<time>.txt.
+
+The .prof file can be inspected with e.g. snakeviz or python -m pstats.
+"""
+import io
+import os
+import time
+import pstats
+import cProfile
+import tracemalloc
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger('__main__')
+logger.info('[Profiler] loading module')
+
+MODE_CPU = 'cpu'
+MODE_MEMORY = 'memory'
+SUMMARY_LINES = 30
+TRACEMALLOC_FRAMES = 10
+
+
+class RunProfiler:
+    """ Profile the next N evaluation cycles on request """
+    def __init__(self, output_dir:str, default_cycles:int=5):
+        self.output_dir = output_dir
+        self.default_cycles = default_cycles
+        # reentrant, request() may be called by a signal handler on the main thread
+        self.lock = threading.RLock()
+        self.mode = None
+        self.remaining_cycles = 0
+        self.total_cycles = 0
+        self.profile = None
+        self.start_snapshot = None
+
+    def request(self, cycles:int=0, mode:str=MODE_CPU) -> None:
+        """ Profile the next cycles. Thread safe and usable from a signal handler. """
+        if cycles <= 0:
+            cycles = self.default_cycles
+        if mode not in (MODE_CPU, MODE_MEMORY):
+            logger.warning('[Profiler] Unknown profiling mode %s', mode)
+            return
+        with self.lock:
+            if self.remaining_cycles > 0:
+                logger.warning('[Profiler] Profiling already active, ignoring request')
+                return
+            self.mode = mode
+            self.remaining_cycles = cycles
+            self.total_cycles = cycles
+        logger.info('[Profiler] %s profiling of the next %d evaluations requested', mode, cycles)
+
+    def request_cpu(self, cycles:int) -> None:
+        """ API callback for cpu profiling """
+        self.request(cycles, MODE_CPU)
+
+    def request_memory(self, cycles:int) -> None:
+        """ API callback for memory profiling """
+        self.request(cycles, MODE_MEMORY)
+
+    @contextmanager
+    def cycle(self):
+        """ Wrap one evaluation cycle, profiles it if requested """
+        with self.lock:
+            mode = self.mode if self.remaining_cycles > 0 else None
+        if mode is None:
+            yield
+            return
+
+        if mode == MODE_CPU:
+            if self.profile is None:
+                self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif self.start_snapshot is None:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.start_snapshot = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            if mode == MODE_CPU:
+                self.profile.disable()
+            with self.lock:
+                self.remaining_cycles -= 1
+                finished = self.remaining_cycles <= 0
+            if finished:
+                self.__write_results(mode)
+
+    def __get_filename(self, prefix:str, extension:str) -> str:
+        name = f'{prefix}_{time.strftime("%Y%m%d_%H%M%S")}.{extension}'
+        return os.path.join(self.output_dir, name)
+
+    def __write_results(self, mode:str) -> None:
+        """ Write the result files and reset the profiler """
+        try:
+            if mode == MODE_CPU:
+                self.__write_cpu_results()
+            else:
+                self.__write_memory_results()
+        except OSError as e:
+            logger.error('[Profiler] Could not write profiling results: %s', e)
+        finally:
+            self.profile = None
+            self.start_snapshot = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    def __write_cpu_results(self) -> None:
+        prof_file = self.__get_filename('profile', 'prof')
+        self.profile.dump_stats(prof_file)
+
+        summary = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=summary)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(SUMMARY_LINES)
+        summary_file = self.__get_filename('profile', 'txt')
+        with open(summary_file, 'w', encoding='utf-8') as f:
+            f.write(f'Profile of {self.total_cycles} evaluations\n')
+            f.write(summary.getvalue())
+        logger.info('[Profiler] Wrote cpu profile of %d evaluations to %s and %s',
+                    self.total_cycles, prof_file, summary_file)
+
+    def __write_memory_results(self) -> None:
+        end_snapshot = tracemalloc.take_snapshot()
+        filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ]
+        differences = end_snapshot.filter_traces(filters).compare_to(
+            self.start_snapshot.filter_traces(filters), 'lineno')
+        current, peak = tracemalloc.get_traced_memory()
+
+        summary_file = self.__get_filename('memory', 'txt')
+        with open(summary_file, 'w', encoding='utf-8') as f:
+            f.write(f'Memory growth over {self.total_cycles} evaluations\n')
+            f.write(f'Traced memory: current {current} bytes, peak {peak} bytes\n')
+            for difference in differences[:SUMMARY_LINES]:
+                f.write(f'{difference}\n')
+        logger.info('[Profiler] Wrote memory growth of %d evaluations to %s',
+                    self.total_cycles, summary_file)
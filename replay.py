@@ -0,0 +1,149 @@
+""" Replay batcontrol against historical prices and production
+
+Runs the complete Batcontrol evaluation in a simulated loop at CPU speed,
+e.g. to compare settings or to benchmark changes on months of real data.
+
+The configuration needs:
+    utility: type file, path to a CSV or NPZ file with prices
+    solar_forecast: provider file, file_path to a CSV or NPZ file with production
+    inverter: type testdriver
+
+time.time is replaced by a simulated clock while the replay runs, so every
+component sees the simulated time. The battery of the testdriver is charged
+and discharged with the production and consumption of the current slot and
+the mode chosen by batcontrol.
+
+Usage:
+    python replay.py config/replay.yaml --start 2024-03-01 --days 30
+"""
+import sys
+import time
+import datetime
+import argparse
+import logging
+import batcontrol
+
+logger = logging.getLogger('__main__')
+
+DEFAULT_STEP = batcontrol.TIME_BETWEEN_EVALUATIONS
+
+
+class SimulatedClock:
+    """ Replacement for time.time, advanced by the replay loop """
+    def __init__(self, start:float):
+        self.now = start
+
+    def time(self) -> float:
+        """ Current simulated epoch time """
+        return self.now
+
+    def advance(self, seconds:float) -> None:
+        """ Move the clock forward """
+        self.now += seconds
+
+
+class BatterySimulation:
+    """ Energy flows of the testdriver battery and the grid """
+    def __init__(self, inverter):
+        self.inverter = inverter
+        self.grid_import = 0.0  # Wh
+        self.grid_export = 0.0  # Wh
+        self.cost = 0.0  # EUR
+        self.modes = {}
+
+    def step(self, bc:batcontrol.Batcontrol, seconds:float) -> None:
+        """ Apply the decision of the last evaluation for seconds """
+        if bc.last_production is None or bc.last_consumption is None:
+            return
+        hours = seconds / 3600
+        slot_hours = bc.slot_seconds / 3600
+        surplus = (bc.last_production[0] - bc.last_consumption[0]) / slot_hours * hours
+        capacity = self.inverter.get_capacity()
+        stored = self.inverter.SOC / 100 * capacity
+        min_stored = self.inverter.min_soc / 100 * capacity
+        max_stored = self.inverter.max_soc / 100 * capacity
+        mode = self.inverter.mode
+        self.modes[mode] = self.modes.get(mode, 0) + 1
+
+        grid = 0.0  # positive = import
+        if mode == 'force_charge':
+            grid_charge = max(0, min(bc.last_charge_rate * hours, max_stored - stored))
+            stored += grid_charge
+            grid += grid_charge
+        if surplus > 0:
+            charge = max(0, min(surplus, max_stored - stored))
+            stored += charge
+            grid -= surplus - charge
+        elif mode == 'allow_discharge':
+            discharge = max(0, min(-surplus, stored - min_stored))
+            stored -= discharge
+            grid += -surplus - discharge
+        else:
+            grid += -surplus
+
+        if grid > 0:
+            self.grid_import += grid
+            self.cost += grid / 1000 * bc.last_prices[0]
+        else:
+            self.grid_export -= grid
+        self.inverter.SOC = stored / capacity * 100
+
+
+def replay(configfile:str, start:float, days:float, step:float) -> dict:
+    """ Run batcontrol from start for days, returns a summary """
+    clock = SimulatedClock(start)
+    original_time = time.time
+    time.time = clock.time
+    try:
+        bc = batcontrol.Batcontrol(configfile)
+        if bc.config['inverter']['type'] != 'testdriver':
+            raise RuntimeError('[Replay] The replay requires the testdriver inverter')
+        battery = BatterySimulation(bc.inverter)
+        evaluations = int(days * 86400 // step)
+        wall_start = time.perf_counter()
+        for _ in range(evaluations):
+            bc.run()
+            battery.step(bc, step)
+            clock.advance(step)
+        wall_time = time.perf_counter() - wall_start
+        bc.shutdown()
+    finally:
+        time.time = original_time
+
+    return {
+        'evaluations': evaluations,
+        'wall_seconds': wall_time,
+        'ms_per_evaluation': wall_time / max(evaluations, 1) * 1000,
+        'grid_import_kwh': battery.grid_import / 1000,
+        'grid_export_kwh': battery.grid_export / 1000,
+        'cost_eur': battery.cost,
+        'modes': battery.modes,
+    }
+
+
+def main():
+    """ Command line interface """
+    parser = argparse.ArgumentParser(description='Replay batcontrol against historical data')
+    parser.add_argument('config', help='configuration with file providers and testdriver')
+    parser.add_argument('--start', required=True, help='start date, ISO 8601')
+    parser.add_argument('--days', type=float, default=7, help='simulated days')
+    parser.add_argument('--step', type=float, default=DEFAULT_STEP,
+                        help='seconds between evaluations')
+    args = parser.parse_args()
+
+    start = datetime.datetime.fromisoformat(args.start)
+    if start.tzinfo is None:
+        start = start.astimezone()
+    summary = replay(args.config, start.timestamp(), args.days, args.step)
+
+    print(f'{summary["evaluations"]} evaluations in {summary["wall_seconds"]:.1f} s '
+          f'({summary["ms_per_evaluation"]:.2f} ms per evaluation)')
+    print(f'grid import {summary["grid_import_kwh"]:.1f} kWh, '
+          f'cost {summary["cost_eur"]:.2f} EUR, export {summary["grid_export_kwh"]:.1f} kWh')
+    print('modes: ' + ', '.join(
+        f'{mode} {count}' for mode, count in sorted(summary['modes'].items())))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
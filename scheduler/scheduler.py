@@ -0,0 +1,88 @@
+""" Event driven scheduler for the batcontrol main loop
+
+The main loop evaluates on a fixed clock tick. External events like
+changed parameters via MQTT or an evcc block release should not wait
+for the next tick, so they can request an early evaluation here.
+
+Requests are debounced: after the first request the scheduler waits
+for a short quiet period, so a burst of events (e.g. several MQTT set
+topics sent at once) results in a single evaluation. The wait is bounded
+by max_delay, so a constant stream of events can not starve evaluations.
+The periodic tick stays in place as a fallback.
+"""
+import time
+import threading
+import logging
+
+logger = logging.getLogger('__main__')
+logger.info('[Scheduler] loading module')
+
+REASON_PERIODIC = 'periodic'
+
+class EvaluationScheduler:
+    """ Wakes the main loop either at the periodic tick or early on events """
+    def __init__(self, debounce_seconds:float=1.0, max_delay_seconds:float=5.0):
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max(max_delay_seconds, debounce_seconds)
+
+        self.condition = threading.Condition()
+        self.pending_reasons = []
+        self.first_request_time = 0
+        self.last_request_time = 0
+
+    def request_evaluation(self, reason:str) -> None:
+        """ Request an early evaluation. Thread safe, can be called from
+            MQTT callbacks or other threads.
+        """
+        with self.condition:
+            now = time.monotonic()
+            if not self.pending_reasons:
+                self.first_request_time = now
+            self.last_request_time = now
+            if reason not in self.pending_reasons:
+                self.pending_reasons.append(reason)
+            logger.debug('[Scheduler] Evaluation requested: %s', reason)
+            self.condition.notify_all()
+
+    def has_pending_requests(self) -> bool:
+        """ Check if an early evaluation is pending """
+        with self.condition:
+            return len(self.pending_reasons) > 0
+
+    def __get_debounced_deadline(self) -> float:
+        """ Monotonic time at which the pending requests are due """
+        return min(
+            self.last_request_time + self.debounce_seconds,
+            self.first_request_time + self.max_delay_seconds
+        )
+
+    def wait_until(self, timestamp:float) -> list:
+        """ Sleep until the periodic tick at the given wall clock timestamp
+            or until debounced event requests are due.
+
+            Returns the list of reasons which caused the wake up.
+        """
+        # Convert the wall clock deadline to monotonic time once, so clock
+        #  adjustments during the sleep do not extend it.
+        tick_deadline = time.monotonic() + max(0, timestamp - time.time())
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if self.pending_reasons:
+                    deadline = self.__get_debounced_deadline()
+                    if now >= deadline:
+                        return self.__take_reasons()
+                    timeout = min(deadline, tick_deadline) - now
+                else:
+                    timeout = tick_deadline - now
+
+                if now >= tick_deadline:
+                    return self.__take_reasons() + [REASON_PERIODIC]
+
+                self.condition.wait(timeout)
+
+    def __take_reasons(self) -> list:
+        """ Return and reset the pending reasons, lock is held by caller """
+        reasons = self.pending_reasons
+        self.pending_reasons = []
+        return reasons
@@ -0,0 +1,166 @@
+""" Parallel initialization of independent subsystems
+
+Most of the startup time is spent waiting for the network: the inverter
+login with its retries, the wait_ready() loops of the MQTT and evcc
+connections and the first requests of the forecast providers. These steps
+do not depend on each other, so they run concurrently in worker threads.
+
+wait() is the readiness barrier before the first control action. It returns
+the results of all steps and raises the error of a failed required step.
+Callbacks of MQTT and evcc can arrive while the steps are still running.
+They run on the network thread of the MQTT client, which must not block,
+so defer_until_ready() queues them until the caller has stored the results
+and called set_ready(). Failed optional steps, e.g. the forecast prefetch, are
+logged and retried by the regular evaluation. The duration of every stage
+is logged as startup report and exported as metric.
+
+report_process_start() measures the time since the start of the process,
+called from the entry point it covers the interpreter and the imports.
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from metrics import metrics
+
+logger = logging.getLogger('__main__')
+logger.info('[Startup] loading module')
+
+# More workers than steps, so a step waiting for another step can not block it
+MAX_WORKERS = 8
+
+
+def get_process_uptime() -> float:
+    """ Seconds since the start of the process, None without /proc """
+    try:
+        with open('/proc/self/stat', 'rb') as f:
+            stat = f.read()
+        with open('/proc/uptime', 'rb') as f:
+            uptime = float(f.read().split()[0])
+        # starttime is field 22, the fields start after the command name in parentheses
+        start_ticks = int(stat.rpartition(b')')[2].split()[19])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def report_process_start(name:str) -> None:
+    """ Log and export the time since the start of the process as stage name """
+    seconds = get_process_uptime()
+    if seconds is None:
+        return
+    logger.info('[Startup] %s %.2f s after the start of the process', name, seconds)
+    metrics.STARTUP_DURATION.set(seconds, stage=name)
+
+
+class ParallelStartup:
+    """ Runs startup steps concurrently and reports their durations """
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS,
+                                           thread_name_prefix='startup')
+        # name -> (future, required)
+        self.steps = {}
+        # stage name -> seconds, in order of completion
+        self.durations = {}
+        self.lock = threading.Lock()
+        # set by set_ready() once the results of wait() are stored
+        self.ready = threading.Event()
+        # (function, args) deferred until set_ready(), protected by ready_lock
+        self.pending = []
+        self.ready_lock = threading.Lock()
+
+    def __record(self, name:str, seconds:float) -> None:
+        with self.lock:
+            self.durations[name] = seconds
+        metrics.STARTUP_DURATION.set(seconds, stage=name)
+
+    @contextmanager
+    def stage(self, name:str):
+        """ Measure a stage which runs on the calling thread """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.__record(name, time.perf_counter() - start)
+
+    def submit(self, name:str, function:callable, *args, required:bool=True,
+               after:str=None) -> None:
+        """ Run function(*args) in a worker thread.
+
+            required: a failure of the step is raised by wait()
+            after: name of a step which has to finish first
+        """
+        dependency = self.steps[after][0] if after is not None else None
+
+        def run_step():
+            if dependency is not None:
+                # the step runs regardless of the outcome of its dependency
+                dependency.exception()
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                self.__record(name, time.perf_counter() - start)
+
+        self.steps[name] = (self.executor.submit(run_step), required)
+
+    def wait(self) -> dict:
+        """ Readiness barrier: wait for all steps, returns their results by name.
+            The caller has to store the results before calling set_ready().
+        """
+        results = {}
+        error = None
+        for name, (future, required) in self.steps.items():
+            exception = future.exception()
+            if exception is None:
+                results[name] = future.result()
+            elif required:
+                logger.error('[Startup] %s failed: %s', name, exception)
+                if error is None:
+                    error = exception
+            else:
+                logger.warning('[Startup] %s failed, continuing without: %s', name, exception)
+                results[name] = None
+        self.executor.shutdown(wait=False)
+        self.steps = {}
+        self.__record('total', time.perf_counter() - self.start_time)
+        if error is not None:
+            # drop deferred callbacks, the process is going to stop
+            with self.ready_lock:
+                self.pending = []
+                self.ready.set()
+            raise error
+        self.report()
+        return results
+
+    def set_ready(self) -> None:
+        """ Run the deferred callbacks in order of arrival on the calling thread """
+        with self.ready_lock:
+            pending = self.pending
+            self.pending = []
+            self.ready.set()
+        for function, args in pending:
+            logger.info('[Startup] Running deferred %s', function.__name__)
+            function(*args)
+
+    def defer_until_ready(self, function:callable, *args) -> bool:
+        """ Queue function(*args) for set_ready(), if the startup has not finished.
+            Returns True if queued, the caller has to return without action.
+            Never blocks, so it is safe on the MQTT network thread.
+        """
+        with self.ready_lock:
+            if self.ready.is_set():
+                return False
+            self.pending.append((function, args))
+        return True
+
+    def report(self) -> None:
+        """ Log the duration of all stages """
+        with self.lock:
+            durations = dict(self.durations)
+        total = durations.pop('total', time.perf_counter() - self.start_time)
+        logger.info('[Startup] Ready after %.2f s: %s', total, ', '.join(
+            f'{name} {seconds:.2f} s' for name, seconds in durations.items()))
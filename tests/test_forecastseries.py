@@ -0,0 +1,119 @@
+""" Tests of ForecastSeries: alignment, resampling, intersection and files """
+import numpy as np
+import pytest
+from forecastseries.forecastseries import ForecastSeries, intersect, \
+    RESAMPLE_MEAN, RESAMPLE_SUM
+
+
+def test_align_starts_with_the_slot_containing_the_timestamp():
+    series = ForecastSeries(3600, 3600, [1, 2, 3, 4])
+    aligned = series.align(3600 * 2 + 100)
+    assert aligned.start == 7200
+    assert aligned.values.tolist() == [2, 3, 4]
+    assert series.align(7200, length=2).values.tolist() == [2, 3]
+    assert series.align(7200, length=10).values.tolist() == [2, 3, 4]
+
+
+def test_align_returns_a_view():
+    series = ForecastSeries(0, 3600, [1, 2, 3])
+    assert np.shares_memory(series.align(3600).values, series.values)
+
+
+@pytest.mark.parametrize('timestamp', [3599, 3600 * 5])
+def test_align_outside_the_series_raises(timestamp):
+    series = ForecastSeries(3600, 3600, [1, 2, 3, 4])
+    with pytest.raises(RuntimeError):
+        series.align(timestamp)
+
+
+def test_from_timestamps_sorts_and_detects_the_step():
+    series = ForecastSeries.from_timestamps([1800, 0, 900, 2700], [3, 1, 2, 4])
+    assert series.start == 0
+    assert series.step == 900
+    assert series.values.tolist() == [1, 2, 3, 4]
+
+
+def test_from_timestamps_stops_at_the_first_gap():
+    series = ForecastSeries.from_timestamps([0, 3600, 10800, 14400], [1, 2, 3, 4])
+    assert series.step == 3600
+    assert series.values.tolist() == [1, 2]
+
+
+def test_from_timestamps_without_values():
+    series = ForecastSeries.from_timestamps([], [])
+    assert len(series) == 0
+
+
+def test_upsample_repeats_mean_and_splits_sum():
+    series = ForecastSeries(0, 3600, [4, 8])
+    assert series.resample(900, RESAMPLE_MEAN).values.tolist() == [4] * 4 + [8] * 4
+    assert series.resample(900, RESAMPLE_SUM).values.tolist() == [1] * 4 + [2] * 4
+
+
+def test_downsample_pads_the_partial_first_slot_and_drops_the_last():
+    series = ForecastSeries(1800, 900, [1, 2, 3, 4, 5, 6, 7])
+    mean = series.resample(3600, RESAMPLE_MEAN)
+    assert mean.start == 0
+    assert mean.values.tolist() == [1.5, 4.5]
+    assert series.resample(3600, RESAMPLE_SUM).values.tolist() == [3, 18]
+
+
+def test_downsample_shorter_than_one_slot():
+    series = ForecastSeries(900, 900, [1, 2])
+    assert len(series.resample(3600)) == 0
+
+
+def test_resample_to_the_same_step_returns_the_series():
+    series = ForecastSeries(0, 3600, [1])
+    assert series.resample(3600) is series
+
+
+def test_resample_invalid_step_or_method_raises():
+    series = ForecastSeries(0, 3600, [1, 2])
+    with pytest.raises(RuntimeError):
+        series.resample(2400)
+    with pytest.raises(RuntimeError):
+        series.resample(5400)
+    with pytest.raises(ValueError):
+        series.resample(900, 'median')
+
+
+def test_intersect_returns_the_common_range():
+    first = ForecastSeries(0, 3600, [1, 2, 3, 4])
+    second = ForecastSeries(7200, 3600, [5, 6, 7, 8])
+    first, second = intersect(first, second)
+    assert first.start == second.start == 7200
+    assert first.values.tolist() == [3, 4]
+    assert second.values.tolist() == [5, 6]
+
+
+def test_intersect_different_steps_or_no_overlap_raises():
+    with pytest.raises(RuntimeError):
+        intersect(ForecastSeries(0, 3600, [1, 2]), ForecastSeries(0, 900, [1, 2]))
+    with pytest.raises(RuntimeError):
+        intersect(ForecastSeries(0, 3600, [1, 2]), ForecastSeries(7200, 3600, [1, 2]))
+
+
+def test_from_file_csv_interpolates_gaps(tmp_path):
+    path = tmp_path / 'prices.csv'
+    path.write_text(
+        'timestamp,value\n'
+        '2024-03-01T00:00:00+00:00,1\n'
+        '1709254800,2\n'
+        '2024-03-01T03:00:00+00:00,4\n',
+        encoding='utf-8'
+    )
+    series = ForecastSeries.from_file(str(path))
+    assert series.start == 1709251200
+    assert series.step == 3600
+    assert series.values.tolist() == [1, 2, 3, 4]
+
+
+def test_npz_round_trip(tmp_path):
+    path = str(tmp_path / 'series.npz')
+    series = ForecastSeries(1709251200, 900, [0.5, 1.5, 2.5])
+    series.to_npz(path)
+    loaded = ForecastSeries.from_file(path)
+    assert loaded.start == series.start
+    assert loaded.step == series.step
+    assert loaded.values.tolist() == series.values.tolist()
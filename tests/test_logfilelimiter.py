@@ -0,0 +1,100 @@
+""" Tests of LogFileLimiter: pruning, compressed segments and permissions """
+import os
+import gzip
+import stat
+import logging
+import pytest
+from logfilelimiter.logfilelimiter import LogFileLimiter, LimitedFileHandler
+
+
+def write_lines(path, count):
+    lines = [f'line {i:04d}\n' for i in range(count)]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+    return lines
+
+
+def read_text(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def test_prune_cuts_at_a_line_boundary(tmp_path):
+    path = str(tmp_path / 'test.log')
+    lines = write_lines(path, 100)
+    limiter = LogFileLimiter(path, 1)
+    limiter.prune(0.35)
+    content = read_text(path)
+    # 35 % of 100 lines of 10 bytes ends in line 35, which is dropped completely
+    assert content == ''.join(lines[36:])
+    assert limiter.currentSize == len(content)
+
+
+def test_prune_keeps_the_mode(tmp_path):
+    path = str(tmp_path / 'test.log')
+    write_lines(path, 100)
+    os.chmod(path, 0o644)
+    LogFileLimiter(path, 1).prune(0.5)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o644
+
+
+def test_prune_invalid_factor_raises(tmp_path):
+    path = str(tmp_path / 'test.log')
+    write_lines(path, 10)
+    with pytest.raises(ValueError):
+        LogFileLimiter(path, 1).prune(1.5)
+
+
+def test_prune_stores_and_shifts_compressed_segments(tmp_path):
+    path = str(tmp_path / 'test.log')
+    lines = write_lines(path, 100)
+    limiter = LogFileLimiter(path, 1, compressedSegments=2)
+    limiter.prune(0.5)
+    with gzip.open(f'{path}.1.gz', 'rt', encoding='utf-8') as f:
+        first = f.read()
+    assert first == ''.join(lines[:51])
+
+    limiter.prune(0.5)
+    limiter.prune(0.5)
+    assert os.path.exists(f'{path}.1.gz')
+    assert os.path.exists(f'{path}.2.gz')
+    assert not os.path.exists(f'{path}.3.gz')
+    with gzip.open(f'{path}.2.gz', 'rt', encoding='utf-8') as f:
+        assert f.read() != first
+
+
+def test_run_prunes_only_above_the_maximum_size(tmp_path):
+    path = str(tmp_path / 'test.log')
+    write_lines(path, 100)
+    limiter = LogFileLimiter(path, 1)
+    limiter.run()
+    assert os.path.getsize(path) == 1000
+
+    limiter.add_written_bytes(100)
+    write_lines(path, 110)
+    limiter.run()
+    assert os.path.getsize(path) <= 1024
+    assert limiter.currentSize == os.path.getsize(path)
+
+
+def test_handler_reopens_the_pruned_file(tmp_path):
+    path = str(tmp_path / 'test.log')
+    limiter = LogFileLimiter(path, 1)
+    handler = LimitedFileHandler(limiter)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    test_logger = logging.getLogger('test_logfilelimiter')
+    test_logger.propagate = False
+    test_logger.addHandler(handler)
+    try:
+        for i in range(120):
+            test_logger.warning('line %04d', i)
+        assert limiter.currentSize == 1200
+        limiter.run()
+        test_logger.warning('after prune')
+        handler.flush()
+        content = read_text(path)
+        assert content.endswith('line 0119\nafter prune\n')
+        assert len(content) < 1200
+    finally:
+        test_logger.removeHandler(handler)
+        handler.close()
@@ -0,0 +1,52 @@
+""" Tests of the NowcastCorrection of the solar forecast """
+import pytest
+from forecastseries.forecastseries import ForecastSeries
+from forecastsolar.nowcast import NowcastCorrection, MAX_RATIO
+
+
+def feed(nowcast, forecast, measured_power, start, seconds, interval=300):
+    for timestamp in range(int(start), int(start + seconds) + 1, interval):
+        nowcast.update(timestamp, measured_power, forecast)
+
+
+def test_ratio_stays_one_without_enough_forecast_energy():
+    forecast = ForecastSeries(0, 3600, [10] * 24)
+    nowcast = NowcastCorrection()
+    feed(nowcast, forecast, 0, 0, 3600)
+    assert nowcast.ratio == 1.0
+    assert nowcast.apply(3600, forecast) is forecast
+
+
+def test_ratio_follows_the_measured_power():
+    forecast = ForecastSeries(0, 3600, [1000] * 24)
+    nowcast = NowcastCorrection()
+    feed(nowcast, forecast, 500, 0, 2 * 3600)
+    assert nowcast.ratio == pytest.approx(0.5)
+
+
+def test_ratio_is_limited():
+    forecast = ForecastSeries(0, 3600, [1000] * 24)
+    nowcast = NowcastCorrection()
+    feed(nowcast, forecast, 5000, 0, 3600)
+    assert nowcast.ratio == MAX_RATIO
+
+
+def test_long_gaps_and_timestamps_outside_the_forecast_are_ignored():
+    forecast = ForecastSeries(0, 3600, [1000] * 24)
+    nowcast = NowcastCorrection()
+    nowcast.update(0, 1000, forecast)
+    nowcast.update(7200, 1000, forecast)
+    assert nowcast.forecast_energy == 0
+    nowcast.update(-100, 1000, forecast)
+    assert nowcast.last_time == 7200
+
+
+def test_apply_fades_out_over_the_horizon():
+    forecast = ForecastSeries(0, 3600, [1000] * 24)
+    nowcast = NowcastCorrection(horizon_seconds=3600)
+    feed(nowcast, forecast, 500, 0, 2 * 3600)
+    corrected = nowcast.apply(2 * 3600, forecast.align(2 * 3600))
+    assert corrected[0] == pytest.approx(1000 * (1 - 0.5 * 0.61), rel=0.01)
+    assert corrected[0] < corrected[1] < corrected[-1]
+    assert corrected[-1] == pytest.approx(1000, rel=0.001)
+    assert forecast[2] == 1000
@@ -0,0 +1,67 @@
+""" Tests of the OnlineConsumptionModel learned from the measured load """
+import datetime
+import numpy as np
+import pytest
+from forecastconsumption.onlinemodel import OnlineConsumptionModel
+
+UTC = datetime.timezone.utc
+# Monday 2024-03-04 10:00 UTC
+MONDAY_10 = datetime.datetime(2024, 3, 4, 10, tzinfo=UTC).timestamp()
+
+
+def create_model(tmp_path, **kwargs):
+    return OnlineConsumptionModel(str(tmp_path / 'consumption.npz'), UTC, **kwargs)
+
+
+def test_update_learns_the_mean_power_of_the_bin(tmp_path):
+    model = create_model(tmp_path)
+    for i, power in enumerate([0, 400, 400, 800, 800]):
+        model.update(MONDAY_10 + i * 600, power)
+    assert model.mean_power[0, 10] == pytest.approx(600)
+    assert model.weight[0, 10] == 2400
+    assert model.weight.sum() == 2400
+
+
+def test_long_gaps_are_limited(tmp_path):
+    model = create_model(tmp_path)
+    model.update(MONDAY_10, 500)
+    model.update(MONDAY_10 + 1800, 500)
+    assert model.weight[0, 10] == 900
+
+
+def test_weight_is_limited_to_the_memory(tmp_path):
+    model = create_model(tmp_path, memory_weeks=1)
+    for week in range(3):
+        model.update(MONDAY_10 + week * 7 * 86400, 1000)
+        for i in range(1, 7):
+            model.update(MONDAY_10 + week * 7 * 86400 + i * 600, 1000 * (week + 1))
+    assert model.weight[0, 10] == 3600
+    # the first week is forgotten, the last one dominates
+    assert model.mean_power[0, 10] > 2000
+
+
+def test_blend_uses_the_profile_until_enough_data(tmp_path):
+    model = create_model(tmp_path, min_weeks=1)
+    model.update(MONDAY_10, 1000)
+    model.update(MONDAY_10 + 900, 1000)
+    model.update(MONDAY_10 + 1800, 1000)
+    weekdays = np.array([0, 0])
+    hours = np.array([10, 11])
+    blended = model.blend(weekdays, hours, np.array([500.0, 500.0]))
+    assert blended.tolist() == pytest.approx([750, 500])
+
+
+def test_save_and_load(tmp_path):
+    model = create_model(tmp_path)
+    model.update(MONDAY_10, 700)
+    model.update(MONDAY_10 + 600, 700)
+    model.shutdown()
+    loaded = create_model(tmp_path)
+    assert loaded.mean_power[0, 10] == pytest.approx(700)
+    assert loaded.weight[0, 10] == 600
+
+
+def test_invalid_file_starts_empty(tmp_path):
+    (tmp_path / 'consumption.npz').write_bytes(b'no numpy file')
+    model = create_model(tmp_path)
+    assert model.weight.sum() == 0
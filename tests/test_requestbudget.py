@@ -0,0 +1,59 @@
+""" Tests of RequestBudget, the token bucket for forecast.solar """
+import time
+from forecastsolar.requestbudget import RequestBudget
+
+
+def test_acquire_until_the_budget_is_exhausted():
+    budget = RequestBudget(limit=3, period=3600)
+    now = time.time()
+    assert budget.interval == 1200
+    assert [budget.acquire(now) for _ in range(4)] == [True, True, True, False]
+    assert budget.available(now) == 0
+
+
+def test_tokens_are_refilled_continuously_up_to_the_limit():
+    budget = RequestBudget(limit=12, period=3600)
+    now = time.time()
+    for _ in range(12):
+        budget.acquire(now)
+    assert budget.available(now + 299) == 0
+    assert budget.available(now + 301) == 1
+    assert budget.available(now + 7200) == 12
+
+
+def test_update_follows_the_rate_limit_headers():
+    budget = RequestBudget(limit=12, period=3600)
+    now = time.time()
+    budget.update({
+        'X-Ratelimit-Limit': '60',
+        'X-Ratelimit-Period': '1800',
+        'X-Ratelimit-Remaining': '2',
+    }, now)
+    assert budget.limit == 60
+    assert budget.period == 1800
+    assert budget.available(now) == 2
+    assert budget.available(now + 30) == 3
+
+
+def test_update_remaining_never_adds_tokens():
+    budget = RequestBudget(limit=12, period=3600)
+    now = time.time()
+    budget.acquire(now)
+    budget.update({'X-Ratelimit-Remaining': '12'}, now)
+    assert budget.available(now) == 11
+
+
+def test_update_ignores_invalid_headers():
+    budget = RequestBudget(limit=12, period=3600)
+    now = time.time()
+    budget.update({'X-Ratelimit-Limit': 'many', 'X-Ratelimit-Remaining': '1'}, now)
+    assert budget.limit == 12
+    assert budget.available(now) == 12
+
+
+def test_exhaust_waits_for_the_next_refill():
+    budget = RequestBudget(limit=12, period=3600)
+    now = time.time()
+    budget.exhaust(now)
+    assert not budget.acquire(now)
+    assert budget.acquire(now + 300)
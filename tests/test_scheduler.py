@@ -0,0 +1,75 @@
+""" Tests of the EvaluationScheduler: periodic tick, debounce and max delay """
+import time
+import threading
+from scheduler.scheduler import EvaluationScheduler, REASON_PERIODIC
+
+
+def request_later(scheduler, delay, reason):
+    timer = threading.Timer(delay, scheduler.request_evaluation, args=(reason,))
+    timer.start()
+    return timer
+
+
+def test_periodic_tick_without_requests():
+    scheduler = EvaluationScheduler(debounce_seconds=0.05, max_delay_seconds=0.2)
+    start = time.monotonic()
+    assert scheduler.wait_until(time.time() + 0.1) == [REASON_PERIODIC]
+    assert time.monotonic() - start >= 0.09
+
+
+def test_tick_in_the_past_returns_immediately():
+    scheduler = EvaluationScheduler()
+    start = time.monotonic()
+    assert scheduler.wait_until(time.time() - 10) == [REASON_PERIODIC]
+    assert time.monotonic() - start < 0.1
+
+
+def test_request_wakes_up_early_after_debounce():
+    scheduler = EvaluationScheduler(debounce_seconds=0.05, max_delay_seconds=1)
+    request_later(scheduler, 0.05, 'mode')
+    start = time.monotonic()
+    assert scheduler.wait_until(time.time() + 10) == ['mode']
+    elapsed = time.monotonic() - start
+    assert 0.09 <= elapsed < 1
+    assert not scheduler.has_pending_requests()
+
+
+def test_burst_is_merged_into_one_evaluation():
+    scheduler = EvaluationScheduler(debounce_seconds=0.1, max_delay_seconds=1)
+    for reason in ('mode', 'charge_rate', 'mode'):
+        scheduler.request_evaluation(reason)
+    assert scheduler.has_pending_requests()
+    assert scheduler.wait_until(time.time() + 10) == ['mode', 'charge_rate']
+    assert not scheduler.has_pending_requests()
+
+
+def test_continuous_requests_are_bounded_by_max_delay():
+    scheduler = EvaluationScheduler(debounce_seconds=0.1, max_delay_seconds=0.3)
+    stop = threading.Event()
+
+    def flood():
+        while not stop.is_set():
+            scheduler.request_evaluation('flood')
+            time.sleep(0.02)
+    thread = threading.Thread(target=flood)
+    start = time.monotonic()
+    thread.start()
+    try:
+        assert scheduler.wait_until(time.time() + 10) == ['flood']
+        elapsed = time.monotonic() - start
+    finally:
+        stop.set()
+        thread.join()
+    assert 0.25 <= elapsed < 1
+
+
+def test_pending_requests_are_merged_into_the_periodic_tick():
+    scheduler = EvaluationScheduler(debounce_seconds=5, max_delay_seconds=5)
+    scheduler.request_evaluation('discharge_blocked')
+    assert scheduler.wait_until(time.time() + 0.05) == ['discharge_blocked', REASON_PERIODIC]
+    assert not scheduler.has_pending_requests()
+
+
+def test_max_delay_is_at_least_the_debounce():
+    scheduler = EvaluationScheduler(debounce_seconds=2, max_delay_seconds=1)
+    assert scheduler.max_delay_seconds == 2